@@ -0,0 +1,29 @@
+"""Add columns for metadata and request time
+
+Revision ID: 3c5e1a7d9b24
+Revises: fcabcc2708d6
+Create Date: 2026-10-17 10:12:31.402117
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '3c5e1a7d9b24'
+down_revision: Union[str, None] = 'fcabcc2708d6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('declaration', sa.Column('metadata_time', sa.Float(), nullable=True))
+    op.add_column('declaration', sa.Column('request_time', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('declaration', 'request_time')
+    op.drop_column('declaration', 'metadata_time')
@@ -0,0 +1,32 @@
+"""Add checkpoint table
+
+Revision ID: 5d2b8e4f7a16
+Revises: 8a4f2c6e1d37
+Create Date: 2026-10-17 13:24:05.381720
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2b8e4f7a16'
+down_revision: Union[str, None] = '8a4f2c6e1d37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('checkpoint',
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('updated_timestamp', sa.DateTime(), nullable=False),
+    sa.Column('value', sa.Text(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('checkpoint')
@@ -0,0 +1,42 @@
+"""Add work chunk table
+
+Revision ID: 8a4f2c6e1d37
+Revises: 3c5e1a7d9b24
+Create Date: 2026-10-17 11:02:48.118954
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4f2c6e1d37'
+down_revision: Union[str, None] = '3c5e1a7d9b24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('work_chunk',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_timestamp', sa.DateTime(), nullable=False),
+    sa.Column('updated_timestamp', sa.DateTime(), nullable=False),
+    sa.Column('queue', sa.String(length=50), nullable=False),
+    sa.Column('batch', sa.String(length=50), nullable=False),
+    sa.Column('page_ids', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('lease_owner', sa.String(length=100), nullable=True),
+    sa.Column('lease_expires', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_work_chunk_queue'), 'work_chunk', ['queue'], unique=False)
+    op.create_index(op.f('ix_work_chunk_status'), 'work_chunk', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_work_chunk_status'), table_name='work_chunk')
+    op.drop_index(op.f('ix_work_chunk_queue'), table_name='work_chunk')
+    op.drop_table('work_chunk')
@@ -0,0 +1,28 @@
+"""Allow longer checkpoint values
+
+Revision ID: a9c3e5f7b214
+Revises: e1f5a3c7b820
+Create Date: 2026-10-18 10:12:41.518302
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import mysql
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9c3e5f7b214'
+down_revision: Union[str, None] = 'e1f5a3c7b820'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column('checkpoint', 'value', existing_type=sa.Text(), type_=sa.Text().with_variant(mysql.MEDIUMTEXT(), 'mysql'), existing_nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('checkpoint', 'value', existing_type=sa.Text().with_variant(mysql.MEDIUMTEXT(), 'mysql'), type_=sa.Text(), existing_nullable=False)
@@ -0,0 +1,27 @@
+"""Add batch to failure
+
+Revision ID: b2d4f6a8c013
+Revises: d6b8f0a2c471
+Create Date: 2026-10-18 15:41:08.512734
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d4f6a8c013'
+down_revision: Union[str, None] = 'd6b8f0a2c471'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('failure', sa.Column('batch', sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('failure', 'batch')
@@ -0,0 +1,36 @@
+"""Add stage and artifact table
+
+Revision ID: b7e3f1a9c542
+Revises: 5d2b8e4f7a16
+Create Date: 2026-10-17 15:47:31.592206
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3f1a9c542'
+down_revision: Union[str, None] = '5d2b8e4f7a16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('declaration', sa.Column('stage', sa.String(length=10), nullable=True))
+    op.create_table('artifact',
+    sa.Column('declaration_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=20), nullable=False),
+    sa.Column('updated_timestamp', sa.DateTime(), nullable=False),
+    sa.Column('content', sa.Text(length=16777215), nullable=False),
+    sa.ForeignKeyConstraint(['declaration_id'], ['declaration.id'], ),
+    sa.PrimaryKeyConstraint('declaration_id', 'name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('artifact')
+    op.drop_column('declaration', 'stage')
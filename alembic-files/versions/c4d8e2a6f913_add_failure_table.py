@@ -0,0 +1,39 @@
+"""Add failure table
+
+Revision ID: c4d8e2a6f913
+Revises: b7e3f1a9c542
+Create Date: 2026-10-17 17:12:08.418530
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d8e2a6f913'
+down_revision: Union[str, None] = 'b7e3f1a9c542'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('failure',
+    sa.Column('page_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('created_timestamp', sa.DateTime(), nullable=False),
+    sa.Column('updated_timestamp', sa.DateTime(), nullable=False),
+    sa.Column('title', sa.String(length=255), nullable=False),
+    sa.Column('error', sa.String(length=100), nullable=False),
+    sa.Column('message', sa.Text(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('page_id')
+    )
+    op.create_index(op.f('ix_failure_next_attempt'), 'failure', ['next_attempt'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_failure_next_attempt'), table_name='failure')
+    op.drop_table('failure')
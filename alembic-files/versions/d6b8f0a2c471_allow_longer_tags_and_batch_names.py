@@ -0,0 +1,29 @@
+"""Allow longer tags and batch names
+
+Revision ID: d6b8f0a2c471
+Revises: a9c3e5f7b214
+Create Date: 2026-10-18 11:02:17.904615
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'd6b8f0a2c471'
+down_revision: Union[str, None] = 'a9c3e5f7b214'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column('tag', 'label', existing_type=sa.String(length=50), type_=sa.String(length=255), existing_nullable=False)
+    op.alter_column('work_chunk', 'batch', existing_type=sa.String(length=50), type_=sa.String(length=255), existing_nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('work_chunk', 'batch', existing_type=sa.String(length=255), type_=sa.String(length=50), existing_nullable=False)
+    op.alter_column('tag', 'label', existing_type=sa.String(length=255), type_=sa.String(length=50), existing_nullable=False)
@@ -0,0 +1,27 @@
+"""Add revision ID to failure
+
+Revision ID: e1f5a3c7b820
+Revises: c4d8e2a6f913
+Create Date: 2026-10-17 19:03:52.264017
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1f5a3c7b820'
+down_revision: Union[str, None] = 'c4d8e2a6f913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('failure', sa.Column('revision_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('failure', 'revision_id')
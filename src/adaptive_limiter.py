@@ -0,0 +1,169 @@
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class OverloadError(Exception):
+    """Raised when a service signals that it's overloaded
+
+    E.g. HTTP 429 or 503, a timeout or MediaWiki maxlag.
+    """
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdaptiveConcurrencyLimiter:
+    """Limits concurrent calls to a service with AIMD
+
+    The limit is raised by one for each full window of calls that
+    succeed with a healthy latency, i.e. not much slower than the
+    fastest calls seen recently (additive increase). When the service is
+    overloaded the limit is cut by a factor (multiplicative decrease)
+    and if it said when to come back, no new calls are started until
+    then. Calls that were already in flight when the limit was cut don't
+    cut it again, so a burst of errors only counts once.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maximum: int,
+        minimum: int = 1,
+        initial: int | None = None,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 0.5,
+        clock: Callable[[], float] = time
+    ):
+        if minimum < 1 or maximum < minimum:
+            raise ValueError("Limits must be 1 <= minimum <= maximum.")
+
+        self.name = name
+        self._maximum = maximum
+        self._minimum = minimum
+        self._limit = float(initial or minimum)
+        self._latency_tolerance = latency_tolerance
+        self._decrease_factor = decrease_factor
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._baseline_latency: float | None = None
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        logger.info(f"Concurrency limit for {self.name}: {self.limit}.")
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                pause = self._paused_until - self._clock()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self._in_flight < self.limit:
+                    self._in_flight += 1
+                    return
+                else:
+                    self._condition.wait()
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        with self._condition:
+            if self._baseline_latency is None or latency < self._baseline_latency:
+                self._baseline_latency = latency
+            else:
+                # Let the baseline drift slowly towards current latencies
+                # in case the service has become slower for good.
+                self._baseline_latency += (
+                    (latency - self._baseline_latency) * 0.01
+                )
+
+            if latency > self._baseline_latency * self._latency_tolerance:
+                return
+
+            self._set_limit(
+                min(self._maximum, self._limit + 1 / self._limit)
+            )
+            self._condition.notify_all()
+
+    def on_overload(
+        self,
+        retry_after: float | None = None,
+        started: float | None = None
+    ):
+        with self._condition:
+            now = self._clock()
+            if retry_after:
+                logger.warning(
+                    f"{self.name} asked to retry after {retry_after} seconds."
+                )
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+            if started is not None and started < self._last_decrease:
+                return
+
+            self._last_decrease = now
+            self._set_limit(
+                max(self._minimum, self._limit * self._decrease_factor)
+            )
+
+    def _set_limit(self, limit: float):
+        old_limit = self.limit
+        self._limit = limit
+        if self.limit != old_limit:
+            logger.info(f"Concurrency limit for {self.name}: {self.limit}.")
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot while making a call
+
+        Overload errors raised in the block cut the limit, successful
+        calls may raise it.
+        """
+        self.acquire()
+        started = self._clock()
+        try:
+            yield
+        except OverloadError as e:
+            self.on_overload(e.retry_after, started)
+            raise
+        else:
+            self.on_success(self._clock() - started)
+        finally:
+            self.release()
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Get seconds to wait from a Retry-After header
+
+    The value is either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid Retry-After header: '{value}'.")
+        return None
+
+    now = datetime.now(timezone.utc)
+    return max(0.0, (retry_time - now).total_seconds())
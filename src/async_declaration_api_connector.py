@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Coroutine
+
+from declaration_api_connector import (
+    DeclarationApiConnector,
+    DeclarationRequest
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDeclarationApiConnector:
+    """Keeps many declaration requests in flight at the same time
+
+    Requests run as tasks on an asyncio event loop in a separate thread.
+    The HTTP calls of the wrapped DeclarationApiConnector are blocking,
+    so they are run in a thread pool from the loop. The two TSA calls
+    for a declaration are made at the same time.
+
+    At most `concurrency` declarations are in flight. submit() blocks
+    when as many declarations are waiting to start, to keep the caller
+    from running ahead.
+    """
+
+    def __init__(self, connector: DeclarationApiConnector, concurrency: int = 8):
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least one.")
+
+        self._connector = connector
+        self._concurrency = concurrency
+        self._waiting = threading.BoundedSemaphore(concurrency * 2)
+        self._loop = asyncio.new_event_loop()
+        # Each declaration makes two TSA calls at the same time.
+        self._loop.set_default_executor(ThreadPoolExecutor(
+            concurrency * 2,
+            thread_name_prefix="declaration-request"
+        ))
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._thread = threading.Thread(
+            target=self._loop.run_forever,
+            name="declaration-requests",
+            daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self,
+        name: str,
+        iscc: str,
+        location: str,
+        rights_statement: str,
+        extra_public_metadata: dict,
+        extra_supplier_data: dict,
+        on_signed: Callable[[DeclarationRequest], None] | None = None
+    ) -> Future:
+        """Submit a declaration
+
+        Returns a future for the CID. `on_signed` is called from another
+        thread with the request when it has been signed and timestamped,
+        before it's sent.
+        """
+        return self._submit(self._request(
+            name,
+            iscc,
+            location,
+            rights_statement,
+            extra_public_metadata,
+            extra_supplier_data,
+            on_signed
+        ))
+
+    def submit_request(self, request: DeclarationRequest) -> Future:
+        """Submit a declaration that has already been signed
+
+        Returns a future for the CID.
+        """
+        return self._submit(self._send(request))
+
+    def _submit(self, coroutine: Coroutine) -> Future:
+        self._waiting.acquire()
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        future.add_done_callback(lambda f: self._waiting.release())
+        return future
+
+    async def _request(
+        self,
+        name: str,
+        iscc: str,
+        location: str,
+        rights_statement: str,
+        extra_public_metadata: dict,
+        extra_supplier_data: dict,
+        on_signed: Callable[[DeclarationRequest], None] | None
+    ) -> str | None:
+        async with self._semaphore:
+            request = self._connector.sign_declaration(
+                name,
+                iscc,
+                location,
+                rights_statement,
+                extra_public_metadata,
+                extra_supplier_data
+            )
+            (
+                request.tsa_signature,
+                request.commons_db_tsa_signature
+            ) = await asyncio.gather(
+                asyncio.to_thread(
+                    self._connector.get_tsa,
+                    request.signature,
+                    "tsa"
+                ),
+                asyncio.to_thread(
+                    self._connector.get_tsa,
+                    request.commons_db_signature,
+                    "commons-db-tsa"
+                )
+            )
+            if on_signed is not None:
+                await asyncio.to_thread(on_signed, request)
+            return await asyncio.to_thread(
+                self._connector.send_declaration,
+                request
+            )
+
+    async def _send(self, request: DeclarationRequest) -> str | None:
+        async with self._semaphore:
+            return await asyncio.to_thread(
+                self._connector.send_declaration,
+                request
+            )
+
+    def close(self):
+        """Wait for declarations in flight and stop the event loop"""
+        for _ in range(self._concurrency * 2):
+            self._waiting.acquire()
+        asyncio.run_coroutine_threadsafe(
+            self._loop.shutdown_default_executor(),
+            self._loop
+        ).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
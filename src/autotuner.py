@@ -0,0 +1,167 @@
+import logging
+import math
+import threading
+from dataclasses import dataclass
+from time import time
+from typing import Callable
+
+from pipeline import Pipeline, Stage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Allocation:
+    # Stage name to number of workers.
+    workers: dict[str, int]
+    # Files per hour the pipeline can do with these workers.
+    rate: float
+    bottleneck: str
+
+
+class Autotuner:
+    """Moves workers between pipeline stages to reach a target rate
+
+    Every interval the time spent in each stage per file that left the
+    pipeline is measured. By Little's law a stage needs `rate * time`
+    workers to keep up with a given rate. If the tuned stages can't get
+    that many workers in total, they are shared in proportion to the
+    time, which gives the highest rate possible. Stages that share a
+    lock act as a single worker and can't be tuned, but they can still
+    be the bottleneck.
+    """
+
+    def __init__(
+        self,
+        pipeline: Pipeline,
+        tuned_stages: list[str],
+        target_rate: float,
+        interval: float = 60,
+        report: Callable[[str], None] = print
+    ):
+        self._pipeline = pipeline
+        self._tuned_stages = [
+            s for s in pipeline.stages if s.name in tuned_stages
+        ]
+        self._budget = sum(s.workers for s in self._tuned_stages)
+        self._target_rate = target_rate
+        self._interval = interval
+        self._report = report
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="autotuner",
+            daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        last_stats = self._snapshot()
+        while not self._stopped.wait(self._interval):
+            stats = self._snapshot()
+            self.tune(last_stats, stats)
+            last_stats = stats
+
+    def _snapshot(self) -> tuple[float, int, dict[str, float]]:
+        busy_times = {s.name: s.stats()[1] for s in self._pipeline.stages}
+        return time(), self._pipeline.finished, busy_times
+
+    def tune(
+        self,
+        last_stats: tuple[float, int, dict[str, float]],
+        stats: tuple[float, int, dict[str, float]]
+    ) -> Allocation | None:
+        last_time, last_finished, last_busy_times = last_stats
+        now, finished, busy_times = stats
+        files = finished - last_finished
+        if files == 0:
+            self._report("TUNE: No files finished since last report.")
+            return None
+
+        observed_rate = files / (now - last_time) * 3600
+        # Seconds of work per file that leaves the pipeline.
+        work = {
+            name: (busy_times[name] - last_busy_times.get(name, 0)) / files
+            for name in busy_times
+        }
+        allocation = allocate(
+            self._pipeline.stages,
+            [s.name for s in self._tuned_stages],
+            work,
+            self._budget,
+            self._target_rate
+        )
+        for stage in self._tuned_stages:
+            stage.set_workers(allocation.workers[stage.name])
+
+        workers = " ".join(f"{k}={v}" for k, v in allocation.workers.items())
+        self._report(
+            f"TUNE: {observed_rate:.0f} files/h "
+            f"(target {self._target_rate:.0f}, possible {allocation.rate:.0f}). "
+            f"Workers: {workers}. Bottleneck: {allocation.bottleneck}."
+        )
+        return allocation
+
+
+def allocate(
+    stages: list[Stage],
+    tuned_stages: list[str],
+    work: dict[str, float],
+    budget: int,
+    target_rate: float
+) -> Allocation:
+    """Divide workers between stages
+
+    `work` is the seconds spent in each stage per file. The target rate
+    is in files per hour.
+    """
+    target_per_second = target_rate / 3600
+    needed = {
+        name: max(1, math.ceil(target_per_second * work[name]))
+        for name in tuned_stages
+    }
+    if sum(needed.values()) <= budget:
+        workers = needed
+    else:
+        total_work = sum(work[name] for name in tuned_stages)
+        workers = {}
+        for name in tuned_stages:
+            share = budget * work[name] / total_work if total_work else 1
+            workers[name] = max(1, math.floor(share))
+        # Hand out what's left after rounding down to the stages that
+        # limit the rate the most.
+        while sum(workers.values()) < budget:
+            name = min(
+                tuned_stages,
+                key=lambda n: _capacity(workers[n], work[n])
+            )
+            workers[name] += 1
+
+    # Capacity in files per second for each tuned stage and each group
+    # of stages sharing a lock.
+    capacities = {
+        name: _capacity(workers[name], work[name]) for name in tuned_stages
+    }
+    locks = {}
+    for stage in stages:
+        if stage.lock is not None:
+            locks.setdefault(id(stage.lock), []).append(stage.name)
+    for names in locks.values():
+        locked_work = sum(work.get(name, 0) for name in names)
+        capacities["+".join(names)] = _capacity(1, locked_work)
+
+    bottleneck = min(capacities, key=lambda name: capacities[name])
+    return Allocation(workers, capacities[bottleneck] * 3600, bottleneck)
+
+
+def _capacity(workers: int, work: float) -> float:
+    if work <= 0:
+        return math.inf
+
+    return workers / work
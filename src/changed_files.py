@@ -0,0 +1,125 @@
+import logging
+from typing import Iterable, Iterator
+
+import pywikibot
+from pywikibot.page import Page
+from pywikibot.pagegenerators import (
+    PagesFromPageidGenerator,
+    PreloadingGenerator
+)
+from pywikibot.site import BaseSite
+
+from declaration_journal import DeclarationJournal
+
+logger = logging.getLogger(__name__)
+
+# Name of the checkpoint in the journal with the time of the last run.
+CHECKPOINT_NAME = "changed-since"
+
+
+def sha1_from_base36(value: str) -> str:
+    """Convert a SHA-1 from the upload log to hexadecimal
+
+    The log has hashes in base 36, like the database, whereas image
+    info, and the journal, has them in hexadecimal.
+    """
+    return f"{int(value, 36):040x}"
+
+
+def get_uploads(
+    site: BaseSite,
+    start: pywikibot.Timestamp,
+    end: pywikibot.Timestamp
+) -> dict[int, str | None]:
+    """Get files uploaded between `start` and `end`
+
+    Both new files and new versions are included. Returns the page IDs
+    with the SHA-1 of the latest version uploaded.
+    """
+    uploads = {}
+    entries = site.logevents(
+        logtype="upload",
+        start=start,
+        end=end,
+        reverse=True
+    )
+    for entry in entries:
+        try:
+            page_id = entry.pageid()
+        except KeyError:
+            # Hidden or the page has been deleted.
+            continue
+
+        sha1 = entry.params.get("img_sha1")
+        uploads[page_id] = sha1_from_base36(sha1) if sha1 else None
+
+    logger.info(f"Found {len(uploads)} uploaded files in log.")
+    return uploads
+
+
+def is_changed(
+    page: Page,
+    revision_id: int,
+    image_hash: str | None,
+    uploaded_hash: str | None
+) -> bool:
+    if page.latest_revision_id != revision_id:
+        return True
+
+    return uploaded_hash is not None and uploaded_hash != image_hash
+
+
+def get_changed_pages(
+    site: BaseSite,
+    journal: DeclarationJournal,
+    start: pywikibot.Timestamp,
+    end: pywikibot.Timestamp
+) -> Iterator[Page]:
+    """Get pages for files in the journal that changed since `start`
+
+    Only files that were uploaded in the period are looked at. They are
+    changed if their latest revision or SHA-1 differs from the
+    declaration. The log and journal are read right away, the pages are
+    fetched when iterating.
+    """
+    uploads = get_uploads(site, start, end)
+    declared = {
+        d.page_id: (d.revision_id, d.image_hash)
+        for d in journal.get_page_id_matches(uploads)
+    }
+    logger.info(f"{len(declared)} of the uploaded files are in the journal.")
+    pages = PreloadingGenerator(PagesFromPageidGenerator(list(declared), site))
+    return _filter_changed(pages, declared, uploads)
+
+
+def save_checkpoint(
+    journal: DeclarationJournal,
+    start: pywikibot.Timestamp,
+    end: pywikibot.Timestamp,
+    stopped: bool,
+    files_failed: int
+):
+    """Save the time the next run looks for changes from
+
+    That's `end` if the run wasn't stopped and no file failed. Otherwise
+    the next run looks from `start` again, so no changes are missed.
+    """
+    if stopped or files_failed:
+        print("Not all changed files were declared. Next run looks from "
+              f"the same time: {start}.")
+        return
+
+    journal.save_checkpoint(CHECKPOINT_NAME, end.isoformat())
+
+
+def _filter_changed(
+    pages: Iterable[Page],
+    declared: dict[int, tuple[int, str | None]],
+    uploads: dict[int, str | None]
+) -> Iterator[Page]:
+    for page in pages:
+        revision_id, image_hash = declared[page.pageid]
+        if is_changed(page, revision_id, image_hash, uploads[page.pageid]):
+            yield page
+        else:
+            logger.debug(f"Unchanged: '{page.title()}'.")
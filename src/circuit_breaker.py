@@ -0,0 +1,135 @@
+import logging
+import threading
+from contextlib import contextmanager
+from time import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """Stops calls to a service that keeps failing
+
+    After `failure_threshold` calls in a row have failed the breaker
+    opens and calls wait instead of being made. When it has been open
+    for `reset_time` seconds it's half-open: one call is let through as
+    a probe while the others keep waiting. If the probe succeeds the
+    breaker closes and the waiting calls are made, otherwise it opens
+    again.
+
+    Work leading up to the calls can use wait() to pause while the
+    breaker is open.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_time: float = 60,
+        clock: Callable[[], float] = time
+    ):
+        if failure_threshold < 1:
+            raise ValueError("Failure threshold must be at least one.")
+
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_time = reset_time
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_time = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._condition:
+            if self._state == OPEN and self._open_time_left() <= 0:
+                return HALF_OPEN
+
+            return self._state
+
+    def _open_time_left(self) -> float:
+        return self._opened_time + self._reset_time - self._clock()
+
+    def wait(self):
+        """Wait until the breaker isn't open
+
+        Returns when it's half-open too, so that work reaches the calls
+        that probe the service.
+        """
+        with self._condition:
+            while self._state == OPEN and self._open_time_left() > 0:
+                self._condition.wait(self._open_time_left())
+
+    def acquire(self) -> bool:
+        """Wait until a call can be made
+
+        Returns True if the call is the probe.
+        """
+        with self._condition:
+            while True:
+                if self._state == CLOSED:
+                    return False
+
+                time_left = self._open_time_left()
+                if time_left > 0:
+                    self._condition.wait(time_left)
+                elif self._probing:
+                    self._condition.wait()
+                else:
+                    self._probing = True
+                    if self._state == OPEN:
+                        self._state = HALF_OPEN
+                        logger.info(f"Probing {self.name}.")
+                    return True
+
+    def on_success(self, probe: bool = False):
+        with self._condition:
+            if probe:
+                self._probing = False
+            self._failures = 0
+            if self._state != CLOSED:
+                self._state = CLOSED
+                logger.info(f"{self.name} has recovered, circuit closed.")
+                self._condition.notify_all()
+
+    def on_failure(self, probe: bool = False):
+        with self._condition:
+            self._failures += 1
+            if probe:
+                self._probing = False
+                logger.warning(f"Probe to {self.name} failed.")
+            elif self._state != CLOSED:
+                # A call made before the breaker opened.
+                return
+            elif self._failures < self._failure_threshold:
+                return
+            else:
+                logger.warning(
+                    f"{self.name} failed {self._failures} times in a row, "
+                    f"circuit open for {self._reset_time} seconds."
+                )
+
+            self._state = OPEN
+            self._opened_time = self._clock()
+            self._condition.notify_all()
+
+    @contextmanager
+    def call(self):
+        """Make a call through the breaker
+
+        The call counts as failed if the block raises.
+        """
+        probe = self.acquire()
+        try:
+            yield
+        except Exception:
+            self.on_failure(probe)
+            raise
+        else:
+            self.on_success(probe)
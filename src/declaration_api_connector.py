@@ -1,7 +1,11 @@
 import base64
 import json
 import logging
+import os
 import subprocess
+import tempfile
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
 from time import sleep, time
 from types import SimpleNamespace
 
@@ -9,8 +13,23 @@ import jwt
 import requests
 from jwcrypto.jwk import JWK
 
+from adaptive_limiter import (
+    AdaptiveConcurrencyLimiter,
+    OverloadError,
+    parse_retry_after
+)
+from circuit_breaker import CircuitBreaker
+from rate_limiter import RateLimiter
+
 logger = logging.getLogger(__name__)
 
+# Status codes for responses that mean that the service is overloaded.
+OVERLOAD_STATUS_CODES = (429, 503)
+# Times to retry a request that the service said it was overloaded for.
+OVERLOAD_RETRIES = 2
+# Seconds to wait before retrying if the service didn't say how long.
+OVERLOAD_RETRY_DELAY = 5
+
 
 class DeclarationApiConnector:
     def __init__(
@@ -24,7 +43,10 @@ class DeclarationApiConnector:
         public_key_path: str,
         tsa_url: str,
         tsa_skip_verify: bool = False,
-        rate_limit: float = 0
+        rate_limiter: RateLimiter | None = None,
+        registry_limiter: AdaptiveConcurrencyLimiter | None = None,
+        tsa_limiter: AdaptiveConcurrencyLimiter | None = None,
+        circuit_breaker: CircuitBreaker | None = None
     ):
         self._dry = dry
         self._member_credentials = self._read_json(member_credentials_path)
@@ -33,12 +55,13 @@ class DeclarationApiConnector:
         self._api_endpoint = api_endpoint
         self._api_key = api_key
         self._raw_api_key = raw_api_key
-        self._rate_limit = rate_limit
+        self._rate_limiter = rate_limiter
+        self._registry_limiter = registry_limiter
+        self._tsa_limiter = tsa_limiter
+        self._circuit_breaker = circuit_breaker
         self._tsa_url = tsa_url
         self._tsa_skip_verify = tsa_skip_verify
 
-        self._last_request_time = None
-
     def _read_json(self, path: str) -> dict:
         try:
             with open(path) as f:
@@ -62,6 +85,50 @@ class DeclarationApiConnector:
         extra_public_metadata: dict,
         extra_supplier_data: dict
     ) -> str | None:
+        request = self.create_request(
+            name,
+            iscc,
+            location,
+            rights_statement,
+            extra_public_metadata,
+            extra_supplier_data
+        )
+        return self.send_declaration(request)
+
+    def create_request(
+        self,
+        name: str,
+        iscc: str,
+        location: str,
+        rights_statement: str,
+        extra_public_metadata: dict,
+        extra_supplier_data: dict
+    ) -> "DeclarationRequest":
+        """Sign a declaration and get timestamps for it from the TSA"""
+        request = self.sign_declaration(
+            name,
+            iscc,
+            location,
+            rights_statement,
+            extra_public_metadata,
+            extra_supplier_data
+        )
+        request.tsa_signature = self.get_tsa(request.signature, "tsa")
+        request.commons_db_tsa_signature = self.get_tsa(
+            request.commons_db_signature,
+            "commons-db-tsa"
+        )
+        return request
+
+    def sign_declaration(
+        self,
+        name: str,
+        iscc: str,
+        location: str,
+        rights_statement: str,
+        extra_public_metadata: dict,
+        extra_supplier_data: dict
+    ) -> "DeclarationRequest":
         if self._member_credentials is None:
             raise Exception("Invalid memeber credentials.")
 
@@ -94,19 +161,16 @@ class DeclarationApiConnector:
             "credentials": [{"proof": proof}],
             "timestamp": timestamp
         }
-        signature = self._get_signature(public_metadata)
-        cdbSignature = self._get_signature(commons_db_metadata)
-        data = {
-            "signature": signature,
-            "tsaSignature": self._get_tsa(signature, "tsa"),
-            "declarationMetadata": {
-                "publicMetadata": public_metadata,
-                "commonsDbRegistry": commons_db_metadata
-            },
-            "commonsDbRegistrySignature": cdbSignature,
-            "commonsDbRegistryTsaSignature":
-                self._get_tsa(cdbSignature, "commons-db-tsa")
-        }
+        return DeclarationRequest(
+            public_metadata,
+            commons_db_metadata,
+            self._get_signature(public_metadata),
+            self._get_signature(commons_db_metadata)
+        )
+
+    def send_declaration(self, request: "DeclarationRequest") -> str | None:
+        declarer_id = self._member_credentials.get("credentialSubject").get("id")
+        data = request.data()
         headers = {
             "User-Agent": "commonsdb-commons-supplier/0.1.18",
             "Authorization": f"Bearer {self._api_key}",
@@ -117,15 +181,9 @@ class DeclarationApiConnector:
 
         logger.info(f"Sending request to '{self._api_endpoint}'.")
         logger.debug(f"POST: {json.dumps(data)}")
-        if self._rate_limit and self._last_request_time:
-            time_since_last = time() - self._last_request_time
-            if time_since_last < self._rate_limit:
-                wait_time = self._rate_limit - time_since_last
-                logger.debug(
-                    f"Waiting {wait_time} seconds for rate limit.")
-                sleep(wait_time)
-        self._last_request_time = time()
-        old_cid = public_metadata.get("supersedes")
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire()
+        old_cid = request.public_metadata.get("supersedes")
         if self._dry:
             def dry_json():
                 if old_cid:
@@ -138,8 +196,12 @@ class DeclarationApiConnector:
             )
             response.ok = True
         else:
-            response = requests.post(
-                self._api_endpoint, json=data, headers=headers, timeout=5)
+            response = self._post(
+                self._registry_limiter,
+                self._api_endpoint,
+                json=data,
+                headers=headers
+            )
         logger.debug(f"Received response: {response.text}")
 
         response_content = response.json()
@@ -175,46 +237,147 @@ class DeclarationApiConnector:
         )
         return signature
 
-    def _get_tsa(self, data: str, name: str) -> dict:
-        # TODO: Do this without having to juggle files.
-        with open(f"tmp/{name}.txt", "w") as data_file:
-            data_file.write(data)
-
+    def get_tsa(self, data: str, name: str) -> dict:
+        # The query is piped through openssl rather than written to files
+        # so that several requests can be made at the same time.
         # TODO: Is there a library that does this instead?
         openssl_command = [
             "openssl",
             "ts",
             "-query",
-            "-data",
-            f"tmp/{name}.txt",
             "-no_nonce",
             "-sha512",
-            "-cert",
-            "-out",
-            f"tmp/{name}.tsq"
+            "-cert"
         ]
-        subprocess.run(openssl_command)
+        process = subprocess.run(
+            openssl_command,
+            input=data.encode("utf-8"),
+            capture_output=True,
+            check=True
+        )
 
         headers = {"Content-Type": "application/timestamp-query"}
-        with open(f"tmp/{name}.tsq", "rb") as tsq_file:
-            tsq = tsq_file.read()
+        tsq = process.stdout
         tsq_b64 = base64.b64encode(tsq).decode()
-        r = requests.post(
+        r = self._post(
+            self._tsa_limiter,
             self._tsa_url,
             data=tsq,
             headers=headers,
-            timeout=5,
             verify=not self._tsa_skip_verify
         )
         tsr = r.content
         tsr_b64 = base64.b64encode(tsr).decode()
 
-        # Save to file if you want to verify easily.
-        with open(f"tmp/{name}.tsr", "wb") as tsr_file:
+        # Save to file if you want to verify easily. It's written to a
+        # file of its own first and then moved in place, so that
+        # concurrent requests, from threads or other processes, never
+        # leave a mix of two responses.
+        handle, tmp_path = tempfile.mkstemp(".tsr", f"{name}-", "tmp")
+        with os.fdopen(handle, "wb") as tsr_file:
             tsr_file.write(r.content)
+        os.replace(tmp_path, f"tmp/{name}.tsr")
 
         return {"tsq": tsq_b64, "tsr": tsr_b64}
 
+    def _post(
+        self,
+        limiter: AdaptiveConcurrencyLimiter | None,
+        url: str,
+        **kwargs
+    ) -> requests.Response:
+        """Make a POST request to the registry or TSA
+
+        Requests that the service responds to with an overload status
+        are retried up to OVERLOAD_RETRIES times, after waiting as long
+        as it asked. Timeouts aren't retried since the request may have
+        gone through. Raises OverloadError when the service is still
+        overloaded and ServiceError for other server errors.
+        """
+        for retries_left in range(OVERLOAD_RETRIES, -1, -1):
+            try:
+                return self._post_once(limiter, url, **kwargs)
+            except OverloadError as e:
+                if not retries_left or isinstance(e.__cause__, requests.Timeout):
+                    raise
+
+                logger.warning(f"{e} Retrying, {retries_left} retries left.")
+                if limiter is None or e.retry_after is None:
+                    # Otherwise the limiter waits until the service is ready.
+                    sleep(e.retry_after or OVERLOAD_RETRY_DELAY)
+
+    def _post_once(
+        self,
+        limiter: AdaptiveConcurrencyLimiter | None,
+        url: str,
+        **kwargs
+    ) -> requests.Response:
+        """Make a POST request without retrying
+
+        Requests that raise count as failures for the circuit breaker.
+        """
+        breaker = self._circuit_breaker
+        with (
+            breaker.call() if breaker else nullcontext(),
+            limiter.slot() if limiter else nullcontext()
+        ):
+            try:
+                response = requests.post(url, timeout=5, **kwargs)
+            except requests.Timeout as e:
+                raise OverloadError(f"Request to '{url}' timed out.") from e
+
+            if response.status_code in OVERLOAD_STATUS_CODES:
+                retry_after = parse_retry_after(
+                    response.headers.get("Retry-After")
+                )
+                raise OverloadError(
+                    f"'{url}' is overloaded: {response.status_code}.",
+                    retry_after
+                )
+
+            if response.status_code >= 500:
+                raise ServiceError(
+                    f"'{url}' responded with error: {response.status_code}."
+                )
+
+            return response
+
+
+@dataclass
+class DeclarationRequest:
+    public_metadata: dict
+    commons_db_metadata: dict
+    signature: str
+    commons_db_signature: str
+    tsa_signature: dict | None = None
+    commons_db_tsa_signature: dict | None = None
+
+    def data(self) -> dict:
+        if self.tsa_signature is None or self.commons_db_tsa_signature is None:
+            raise Exception("TSA signatures required.")
+
+        return {
+            "signature": self.signature,
+            "tsaSignature": self.tsa_signature,
+            "declarationMetadata": {
+                "publicMetadata": self.public_metadata,
+                "commonsDbRegistry": self.commons_db_metadata
+            },
+            "commonsDbRegistrySignature": self.commons_db_signature,
+            "commonsDbRegistryTsaSignature": self.commons_db_tsa_signature
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, text: str) -> "DeclarationRequest":
+        return cls(**json.loads(text))
+
+
+class ServiceError(Exception):
+    """Raised when the registry or TSA responds with a server error"""
+
 
 class ReadFileError(Exception):
     def __init__(self, path):
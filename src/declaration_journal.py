@@ -1,18 +1,28 @@
 import inspect
 import logging
-from datetime import datetime
-from typing import Optional, Sequence, Set
+from datetime import datetime, timedelta
+from itertools import batched
+from typing import Iterable, Iterator, Optional, Sequence, Set
 
 from sqlalchemy import (
     Column,
     Engine,
     ForeignKey,
+    Row,
     String,
     Table,
+    Text,
+    and_,
     create_engine,
+    delete,
     func,
-    select
+    insert,
+    or_,
+    select,
+    tuple_,
+    update
 )
+from sqlalchemy.dialects import mysql, postgresql
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -20,6 +30,7 @@ from sqlalchemy.orm import (
     mapped_column,
     relationship
 )
+from sqlalchemy.sql.expression import Insert
 
 logger = logging.getLogger(__name__)
 
@@ -51,19 +62,68 @@ class Declaration(Base):
     download_time: Mapped[Optional[float]]
     iscc: Mapped[Optional[str]] = mapped_column(String(61))
     iscc_time: Mapped[Optional[float]]
+    metadata_time: Mapped[Optional[float]]
+    request_time: Mapped[Optional[float]]
     tags: Mapped[Set["Tag"]] = relationship(secondary=tag_association)
     cid: Mapped[Optional[str]] = mapped_column(String(57))
+    # Last stage that was done, see STAGES.
+    stage: Mapped[Optional[str]] = mapped_column(String(10))
 
     def __repr__(self) -> str:
         fields = get_fields(self)
         return f"Declaration {fields}"
 
 
+# Stages of making a declaration, in order. Files are downloaded to a
+# temporary directory, so there's no stage for that.
+STAGE_ISCC = "iscc"
+STAGE_METADATA = "metadata"
+# Signed and timestamped by the TSA.
+STAGE_SIGNED = "signed"
+# Sent to the registry but no response received.
+STAGE_SUBMITTED = "submitted"
+STAGE_CONFIRMED = "confirmed"
+STAGES = [
+    STAGE_ISCC,
+    STAGE_METADATA,
+    STAGE_SIGNED,
+    STAGE_SUBMITTED,
+    STAGE_CONFIRMED
+]
+
+
+def stage_done(declaration: Declaration | None, stage: str) -> bool:
+    """Check if a declaration has been through a stage"""
+    if declaration is None or declaration.stage not in STAGES:
+        return False
+
+    return STAGES.index(declaration.stage) >= STAGES.index(stage)
+
+
+class Artifact(Base):
+    """Output from a stage, used to continue from it"""
+    __tablename__ = "artifact"
+
+    declaration_id: Mapped[int] = mapped_column(
+        ForeignKey("declaration.id"),
+        primary_key=True
+    )
+    name: Mapped[str] = mapped_column(String(20), primary_key=True)
+    updated_timestamp: Mapped[datetime]
+    # Large enough for a signed request with thumbnail, MEDIUMTEXT in
+    # MySQL.
+    content: Mapped[str] = mapped_column(Text(2**24 - 1))
+
+    def __repr__(self) -> str:
+        fields = get_fields(self)
+        return f"Artifact {fields}"
+
+
 class Tag(Base):
     __tablename__ = "tag"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    label: Mapped[str] = mapped_column(String(50))
+    label: Mapped[str] = mapped_column(String(255))
 
     def __repr__(self) -> str:
         fields = get_fields(self)
@@ -76,21 +136,90 @@ class Tag(Base):
         return hash(self.label)
 
 
+class WorkChunk(Base):
+    __tablename__ = "work_chunk"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    created_timestamp: Mapped[datetime]
+    updated_timestamp: Mapped[datetime]
+    queue: Mapped[str] = mapped_column(String(50), index=True)
+    # Batch name of the input the chunk was made from.
+    batch: Mapped[str] = mapped_column(String(255))
+    # Comma separated.
+    page_ids: Mapped[str] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(String(10), index=True)
+    lease_owner: Mapped[Optional[str]] = mapped_column(String(100))
+    lease_expires: Mapped[Optional[datetime]]
+
+    def get_page_ids(self) -> list[int]:
+        return [int(i) for i in self.page_ids.split(",") if i]
+
+    def __repr__(self) -> str:
+        fields = get_fields(self)
+        return f"WorkChunk {fields}"
+
+
+class Checkpoint(Base):
+    __tablename__ = "checkpoint"
+
+    name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    updated_timestamp: Mapped[datetime]
+    # Where to continue from, the format depends on the input. Positions
+    # in category trees hold the categories found so far.
+    value: Mapped[str] = mapped_column(
+        Text().with_variant(mysql.MEDIUMTEXT(), "mysql")
+    )
+
+    def __repr__(self) -> str:
+        fields = get_fields(self)
+        return f"Checkpoint {fields}"
+
+
+class Failure(Base):
+    """A file that couldn't be declared"""
+    __tablename__ = "failure"
+
+    page_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    created_timestamp: Mapped[datetime]
+    updated_timestamp: Mapped[datetime]
+    title: Mapped[str] = mapped_column(String(255))
+    # Revision of the page when it failed.
+    revision_id: Mapped[Optional[int]]
+    # Name of the exception class.
+    error: Mapped[str] = mapped_column(String(100))
+    message: Mapped[Optional[str]] = mapped_column(Text)
+    attempts: Mapped[int]
+    # Batch the file was in when it failed, it's tried again in the same.
+    batch: Mapped[Optional[str]] = mapped_column(String(255))
+    # When the file can be tried again, None if it shouldn't be.
+    next_attempt: Mapped[Optional[datetime]] = mapped_column(index=True)
+
+    def __repr__(self) -> str:
+        fields = get_fields(self)
+        return f"Failure {fields}"
+
+
+# Statuses for work chunks.
+CHUNK_PENDING = "pending"
+CHUNK_LEASED = "leased"
+CHUNK_DONE = "done"
+
+
 class DeclarationJournal:
     def __init__(self, engine: Engine, session: Session):
         self._session = session
         Base.metadata.create_all(engine)
 
-    def add_declaration(self, tag_labels: Set[str], **kwargs) -> Declaration:
-        tags = set()
-        for label in tag_labels:
-            statement = select(Tag).where(Tag.label == label)
-            tag = self._session.scalars(statement).one_or_none()
-            if tag is None:
-                tag = Tag(label=label)
-                self._session.add(tag)
-            tags.add(tag)
+    def _get_or_add_tag(self, label: str) -> Tag:
+        statement = select(Tag).where(Tag.label == label)
+        tag = self._session.scalars(statement).one_or_none()
+        if tag is None:
+            tag = Tag(label=label)
+            self._session.add(tag)
+        return tag
 
+    def add_declaration(self, tag_labels: Set[str], **kwargs) -> Declaration:
+        tags = {self._get_or_add_tag(label) for label in tag_labels}
         now = datetime.now()
         declaration = Declaration(
             created_timestamp=now,
@@ -102,6 +231,71 @@ class DeclarationJournal:
         self._session.commit()
         return declaration
 
+    def add_prepared_declarations(
+        self,
+        tag_labels: Set[str],
+        versions: Sequence[tuple[int, int]]
+    ) -> set[int]:
+        """Add declarations for page and revision IDs in bulk
+
+        The declarations and their tags are added with one multi-row
+        insert each. Pages that already have a declaration are left as
+        they are. Returns the page IDs that were added.
+        """
+        tags = {self._get_or_add_tag(label) for label in tag_labels}
+        self._session.flush()
+        page_ids = [page_id for page_id, _ in versions]
+        known = self.get_known_page_ids(page_ids)
+        now = datetime.now()
+        rows = [
+            {
+                "created_timestamp": now,
+                "updated_timestamp": now,
+                "page_id": page_id,
+                "revision_id": revision_id
+            }
+            for page_id, revision_id in versions
+            if page_id not in known
+        ]
+        if not rows:
+            self._session.commit()
+            return set()
+
+        # Added by someone else since the check are ignored.
+        self._session.execute(self._insert_ignore(Declaration), rows)
+        # Rows are found by their versions rather than the timestamp,
+        # which the database may store with less precision.
+        statement = select(Declaration.id, Declaration.page_id).where(
+            tuple_(Declaration.page_id, Declaration.revision_id).in_(
+                [(r["page_id"], r["revision_id"]) for r in rows]
+            )
+        )
+        added = self._session.execute(statement).all()
+        if added and tags:
+            # Another run may have added the same versions at once.
+            self._session.execute(
+                self._insert_ignore(tag_association),
+                [
+                    {"declaration_id": declaration_id, "tag_id": tag.id}
+                    for declaration_id, _ in added
+                    for tag in tags
+                ]
+            )
+        self._session.commit()
+        return {page_id for _, page_id in added}
+
+    def _insert_ignore(self, table: type[Base] | Table) -> Insert:
+        """Make an insert that skips rows that conflict with existing ones"""
+        dialect = self._session.get_bind().dialect.name
+        if dialect == "mysql":
+            return insert(table).prefix_with("IGNORE")
+        if dialect == "sqlite":
+            return insert(table).prefix_with("OR IGNORE")
+        if dialect == "postgresql":
+            return postgresql.insert(table).on_conflict_do_nothing()
+
+        return insert(table)
+
     def update_declaration(self, declaration: Declaration | None, **kwargs):
         if declaration is None:
             return
@@ -116,6 +310,38 @@ class DeclarationJournal:
         declaration.updated_timestamp = datetime.now()
         self._session.commit()
 
+    def set_stage(
+        self,
+        declaration: Declaration,
+        stage: str | None,
+        artifacts: dict[str, str] | None = None
+    ):
+        """Set the stage of a declaration and save what it produced"""
+        now = datetime.now()
+        for name, content in (artifacts or {}).items():
+            artifact = self._session.get(Artifact, (declaration.id, name))
+            if artifact is None:
+                artifact = Artifact(declaration_id=declaration.id, name=name)
+                self._session.add(artifact)
+            artifact.content = content
+            artifact.updated_timestamp = now
+
+        declaration.stage = stage
+        declaration.updated_timestamp = now
+        self._session.commit()
+
+    def get_artifacts(self, declaration: Declaration) -> dict[str, str]:
+        statement = select(Artifact).where(
+            Artifact.declaration_id == declaration.id
+        )
+        return {a.name: a.content for a in self._session.scalars(statement)}
+
+    def delete_artifacts(self, declaration: Declaration):
+        self._session.execute(
+            delete(Artifact).where(Artifact.declaration_id == declaration.id)
+        )
+        self._session.commit()
+
     def get_declarations(
         self,
         tag: str | None = None,
@@ -133,6 +359,113 @@ class DeclarationJournal:
         declarations = self._session.scalars(statement).all()
         return declarations
 
+    def get_page_ids(
+        self,
+        tag: str | None = None,
+        only_not_declared: bool = False,
+        chunk_size: int = 1000
+    ) -> Iterator[int]:
+        """Get page IDs of declarations, ordered by page ID
+
+        They are read in chunks, like in get_version_chunks().
+        """
+        last_page_id = 0
+        while True:
+            statement = (
+                select(Declaration.page_id)
+                .where(Declaration.page_id > last_page_id)
+                .order_by(Declaration.page_id)
+                .limit(chunk_size)
+            )
+            if tag is not None:
+                statement = statement.join(
+                    Declaration.tags.and_(Tag.label == tag)
+                )
+            if only_not_declared:
+                statement = statement.where(Declaration.cid.is_(None))
+            page_ids = self._session.scalars(statement).all()
+            if not page_ids:
+                return
+
+            yield from page_ids
+            last_page_id = page_ids[-1]
+
+    def get_snapshots(self, tag: str) -> Sequence[Declaration]:
+        """Get declarations with a tag that have metadata but no CID
+
+        They have what's needed to make the declaration stored in their
+        artifacts.
+        """
+        statement = (
+            select(Declaration)
+            .join(Declaration.tags.and_(Tag.label == tag))
+            .where(
+                Declaration.cid.is_(None),
+                Declaration.stage.in_(
+                    [STAGE_METADATA, STAGE_SIGNED, STAGE_SUBMITTED]
+                )
+            )
+            .order_by(Declaration.page_id)
+        )
+        return self._session.scalars(statement).all()
+
+    def get_version_chunks(
+        self,
+        tag: str | None = None,
+        chunk_size: int = 500
+    ) -> Iterator[Sequence[Row]]:
+        """Get page ID, revision ID and image hash of all declarations
+
+        Rows are read in chunks ordered by page ID, each chunk starting
+        after the last page ID of the one before, so that only one chunk
+        is in memory at a time.
+        """
+        last_page_id = 0
+        while True:
+            statement = (
+                select(
+                    Declaration.page_id,
+                    Declaration.revision_id,
+                    Declaration.image_hash
+                )
+                .where(Declaration.page_id > last_page_id)
+                .order_by(Declaration.page_id)
+                .limit(chunk_size)
+            )
+            if tag is not None:
+                statement = statement.join(
+                    Declaration.tags.and_(Tag.label == tag)
+                )
+            rows = self._session.execute(statement).all()
+            if not rows:
+                return
+
+            yield rows
+            last_page_id = rows[-1].page_id
+
+    def add_tag(self, label: str, page_ids: Iterable[int]) -> int:
+        """Add a tag to the declarations for page IDs
+
+        Returns the number of declarations that didn't have it already.
+        """
+        tag = self._get_or_add_tag(label)
+        self._session.flush()
+        statement = select(Declaration.id).where(
+            Declaration.page_id.in_(list(page_ids)),
+            ~Declaration.tags.any(Tag.id == tag.id)
+        )
+        declaration_ids = self._session.scalars(statement).all()
+        if declaration_ids:
+            self._session.execute(
+                insert(tag_association),
+                [
+                    {"declaration_id": i, "tag_id": tag.id}
+                    for i in declaration_ids
+                ]
+            )
+        self._session.commit()
+        return len(declaration_ids)
+
     def get_page_id_match(self, page_id: int) -> Declaration | None:
         statement = select(Declaration).where(Declaration.page_id == page_id)
         declaration = self._session.scalars(statement).one_or_none()
@@ -141,6 +474,83 @@ class DeclarationJournal:
 
         return declaration
 
+    def get_page_id_matches(
+        self,
+        page_ids: Iterable[int],
+        chunk_size: int = 500
+    ) -> Iterator[Declaration]:
+        """Get declarations for many page IDs
+
+        Page IDs are looked up in chunks, to not make a query per page
+        or one that's too large for the database.
+        """
+        for chunk_page_ids in batched(page_ids, chunk_size):
+            statement = select(Declaration).where(
+                Declaration.page_id.in_(chunk_page_ids)
+            )
+            yield from self._session.scalars(statement).all()
+
+    def get_known_page_ids(
+        self,
+        page_ids: Sequence[int],
+        only_declared: bool = False,
+        only_snapshotted: bool = False
+    ) -> set[int]:
+        """Get the page IDs that have declarations
+
+        If `only_declared` is True, only those that have been declared
+        in the registry are included. If `only_snapshotted` is True,
+        only those that have been declared or have their metadata saved
+        are included.
+        """
+        statement = select(Declaration.page_id).where(
+            Declaration.page_id.in_(page_ids)
+        )
+        if only_declared:
+            statement = statement.where(Declaration.cid.is_not(None))
+        elif only_snapshotted:
+            snapshot_stages = STAGES[STAGES.index(STAGE_METADATA):]
+            statement = statement.where(or_(
+                Declaration.cid.is_not(None),
+                Declaration.stage.in_(snapshot_stages)
+            ))
+        return set(self._session.scalars(statement).all())
+
+    def get_average_times(
+        self,
+        tag_labels: Iterable[str] = ()
+    ) -> dict[str, tuple[int, float | None]]:
+        """Get how long each step took on average for the declarations
+
+        Only declarations with any of the tags are used, if given.
+        Returns the number of declarations that have each of the time
+        columns, e.g. "download_time", and their average in seconds,
+        which is None if there are none.
+        """
+        columns = [
+            Declaration.download_time,
+            Declaration.iscc_time,
+            Declaration.metadata_time,
+            Declaration.request_time
+        ]
+        aggregates = []
+        for column in columns:
+            aggregates += [func.count(column), func.avg(column)]
+        statement = select(*aggregates)
+        tag_labels = list(tag_labels)
+        if tag_labels:
+            statement = statement.where(
+                Declaration.tags.any(Tag.label.in_(tag_labels))
+            )
+        row = self._session.execute(statement).one()
+        return {
+            column.key: (
+                row[2 * i],
+                None if row[2 * i + 1] is None else float(row[2 * i + 1])
+            )
+            for i, column in enumerate(columns)
+        }
+
     def get_image_hash_match(self, hash: str) -> Declaration | None:
         statement = select(Declaration).where(Declaration.image_hash == hash)
         declaration = self._session.scalars(statement).one_or_none()
@@ -158,6 +568,207 @@ class DeclarationJournal:
     def rollback_session(self):
         self._session.rollback()
 
+    def get_checkpoint(self, name: str) -> str | None:
+        checkpoint = self._session.get(Checkpoint, name)
+        if checkpoint is None:
+            return None
+
+        return checkpoint.value
+
+    def save_checkpoint(self, name: str, value: str):
+        checkpoint = self._session.get(Checkpoint, name)
+        if checkpoint is None:
+            checkpoint = Checkpoint(name=name)
+            self._session.add(checkpoint)
+        checkpoint.value = value
+        checkpoint.updated_timestamp = datetime.now()
+        self._session.commit()
+
+    def get_failure(self, page_id: int) -> Failure | None:
+        return self._session.get(Failure, page_id)
+
+    def save_failure(
+        self,
+        page_id: int,
+        title: str,
+        error: str,
+        message: str | None,
+        next_attempt: datetime | None,
+        revision_id: int | None = None,
+        batch: str | None = None
+    ) -> Failure:
+        """Add a failure for a page or count another attempt"""
+        now = datetime.now()
+        failure = self._session.get(Failure, page_id)
+        if failure is None:
+            failure = Failure(page_id=page_id, created_timestamp=now, attempts=0)
+            self._session.add(failure)
+        failure.updated_timestamp = now
+        failure.title = title
+        failure.revision_id = revision_id
+        failure.batch = batch
+        failure.error = error
+        failure.message = message
+        failure.attempts += 1
+        failure.next_attempt = next_attempt
+        self._session.commit()
+        return failure
+
+    def delete_failures(self, page_ids: Iterable[int]):
+        self._session.execute(
+            delete(Failure).where(Failure.page_id.in_(list(page_ids)))
+        )
+        self._session.commit()
+
+    def get_due_failures(self, now: datetime) -> Sequence[Failure]:
+        """Get failures that can be tried again, the longest waiting first
+
+        Failures for files that have been declared since are left out.
+        """
+        statement = (
+            select(Failure)
+            .outerjoin(Declaration, Declaration.page_id == Failure.page_id)
+            .where(Failure.next_attempt <= now, Declaration.cid.is_(None))
+            .order_by(Failure.next_attempt)
+        )
+        return self._session.scalars(statement).all()
+
+    def add_work_chunks(
+        self,
+        queue: str,
+        batch: str,
+        page_ids: Iterable[int],
+        chunk_size: int
+    ) -> int:
+        """Add page IDs to a work queue in chunks
+
+        Returns the number of chunks added.
+        """
+        number_of_chunks = 0
+        for chunk_page_ids in batched(page_ids, chunk_size):
+            now = datetime.now()
+            self._session.add(WorkChunk(
+                created_timestamp=now,
+                updated_timestamp=now,
+                queue=queue,
+                batch=batch,
+                page_ids=",".join(str(i) for i in chunk_page_ids),
+                status=CHUNK_PENDING
+            ))
+            number_of_chunks += 1
+            if number_of_chunks % 100 == 0:
+                self._session.commit()
+        self._session.commit()
+        return number_of_chunks
+
+    def claim_work_chunk(
+        self,
+        queue: str,
+        owner: str,
+        lease_time: timedelta
+    ) -> WorkChunk | None:
+        """Lease the next chunk in a queue that isn't taken
+
+        Chunks with expired leases are claimed again. On databases that
+        support it the row is locked, skipping rows locked by others, so
+        several workers can claim at the same time without waiting. The
+        update only succeeds if the chunk is still free, which makes the
+        claim atomic also on databases without row locks, like SQLite.
+        """
+        while True:
+            now = datetime.now()
+            claimable = and_(
+                WorkChunk.queue == queue,
+                or_(
+                    WorkChunk.status == CHUNK_PENDING,
+                    and_(
+                        WorkChunk.status == CHUNK_LEASED,
+                        WorkChunk.lease_expires < now
+                    )
+                )
+            )
+            statement = (
+                select(WorkChunk)
+                .where(claimable)
+                .order_by(WorkChunk.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            chunk = self._session.scalars(statement).one_or_none()
+            if chunk is None:
+                self._session.commit()
+                return None
+
+            result = self._session.execute(
+                update(WorkChunk)
+                .where(WorkChunk.id == chunk.id, claimable)
+                .values(
+                    status=CHUNK_LEASED,
+                    lease_owner=owner,
+                    lease_expires=now + lease_time,
+                    updated_timestamp=now
+                )
+            )
+            self._session.commit()
+            if result.rowcount == 1:
+                self._session.refresh(chunk)
+                return chunk
+
+            logger.debug(f"Chunk {chunk.id} was claimed by someone else.")
+
+    def renew_work_lease(
+        self,
+        chunk: WorkChunk,
+        owner: str,
+        lease_time: timedelta
+    ) -> bool:
+        """Extend the lease of a chunk
+
+        Returns False if the lease has been lost, e.g. because it had
+        expired and another worker claimed the chunk.
+        """
+        now = datetime.now()
+        result = self._session.execute(
+            update(WorkChunk)
+            .where(
+                WorkChunk.id == chunk.id,
+                WorkChunk.status == CHUNK_LEASED,
+                WorkChunk.lease_owner == owner
+            )
+            .values(lease_expires=now + lease_time, updated_timestamp=now)
+        )
+        self._session.commit()
+        return result.rowcount == 1
+
+    def complete_work_chunk(self, chunk: WorkChunk, owner: str) -> bool:
+        now = datetime.now()
+        result = self._session.execute(
+            update(WorkChunk)
+            .where(
+                WorkChunk.id == chunk.id,
+                WorkChunk.status == CHUNK_LEASED,
+                WorkChunk.lease_owner == owner
+            )
+            .values(
+                status=CHUNK_DONE,
+                lease_expires=None,
+                updated_timestamp=now
+            )
+        )
+        self._session.commit()
+        return result.rowcount == 1
+
+    def count_work_chunks(self, queue: str) -> dict[str, int]:
+        statement = (
+            select(WorkChunk.status, func.count())
+            .where(WorkChunk.queue == queue)
+            .group_by(WorkChunk.status)
+        )
+        return {
+            status: count
+            for status, count in self._session.execute(statement).all()
+        }
+
 
 def create_journal(database_url: str) -> DeclarationJournal:
     engine = create_engine(database_url)
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import socketserver
+import stat
+from dataclasses import dataclass, field
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Called with the title and result for each file as it's done.
+ResultCallback = Callable[[str, str], None]
+
+
+@dataclass
+class WorkRequest:
+    """Files to process, sent as a line of JSON
+
+    Files are given as titles, page IDs or a journal tag. `batch` is
+    the batch name to tag the declarations with and `limit` caps the
+    number of declarations made for this request.
+    """
+    titles: list[str] = field(default_factory=list)
+    page_ids: list[int] = field(default_factory=list)
+    tag: str | None = None
+    batch: str | None = None
+    limit: int | None = None
+
+    @classmethod
+    def from_json(cls, line: str) -> "WorkRequest":
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}.")
+
+        if not isinstance(data, dict):
+            raise ValueError("Request must be a JSON object.")
+
+        unknown = set(data) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}.")
+
+        request = cls(**data)
+        if not (
+            isinstance(request.titles, list)
+            and isinstance(request.page_ids, list)
+        ):
+            raise ValueError("Fields titles and page_ids must be lists.")
+        if not (request.titles or request.page_ids or request.tag):
+            raise ValueError("Request must have titles, page_ids or tag.")
+
+        return request
+
+
+class DeclarationService:
+    """Takes work requests over a Unix socket
+
+    Everything that's expensive to set up, e.g. the connection to
+    Commons, the journal and the ISCC workers, is kept between requests
+    by whatever `handle` uses. A client sends one request per line and
+    gets a line for each file as soon as it's done, followed by a line
+    from `handle`'s return value with "done" set. Bad requests and
+    errors get a line with "error" instead. Requests are handled one at
+    a time, in the order they come in.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        handle: Callable[[WorkRequest, ResultCallback], dict]
+    ):
+        self.path = path
+        self._handle = handle
+        _remove_stale_socket(path)
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                service._serve_client(self.rfile, self.wfile)
+
+        self._server = socketserver.UnixStreamServer(path, Handler)
+
+    def serve_forever(self):
+        logger.info(f"Listening for work requests on '{self.path}'.")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.remove(self.path)
+
+    def shutdown(self):
+        """Stop serving, from another thread"""
+        self._server.shutdown()
+
+    def _serve_client(self, rfile, wfile):
+        client_gone = False
+
+        def send(data: dict):
+            # The work goes on if the client goes away, since the
+            # results are in the journal anyway.
+            nonlocal client_gone
+            if client_gone:
+                return
+
+            try:
+                wfile.write(json.dumps(data).encode("utf-8") + b"\n")
+                wfile.flush()
+            except OSError:
+                logger.warning("Client went away before request was done.")
+                client_gone = True
+
+        for line in rfile:
+            if not line.strip():
+                continue
+
+            try:
+                request = WorkRequest.from_json(line.decode("utf-8"))
+            except ValueError as e:
+                send({"error": str(e)})
+                continue
+
+            logger.info(f"Got work request: {request}.")
+            try:
+                summary = self._handle(
+                    request,
+                    lambda title, result: send(
+                        {"title": title, "result": result}
+                    )
+                )
+            except Exception as e:
+                logger.exception("Error while handling work request.")
+                send({"error": str(e)})
+                continue
+
+            send({"done": True, **summary})
+            if client_gone:
+                return
+
+
+def _remove_stale_socket(path: str):
+    """Remove a socket left by a service that didn't stop cleanly"""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+
+    if not stat.S_ISSOCK(mode):
+        raise Exception(f"'{path}' exists and is not a socket.")
+
+    logger.warning(f"Removing old socket '{path}'.")
+    os.remove(path)
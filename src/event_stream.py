@@ -0,0 +1,160 @@
+import json
+import logging
+from dataclasses import dataclass
+from time import sleep
+from typing import Iterable, Iterator
+
+import requests
+from pywikibot import FilePage
+from pywikibot.site import BaseSite
+
+from input_checkpoint import InputCheckpoint
+from shard import Shard
+
+logger = logging.getLogger(__name__)
+
+COMMONS_WIKI = "commonswiki"
+FILE_NAMESPACE = 6
+
+
+@dataclass
+class Event:
+    # Used to continue the stream from after this event.
+    id: str | None
+    data: str
+
+
+def parse_events(lines: Iterable[str]) -> Iterator[Event]:
+    """Parse server-sent events
+
+    Only the fields used by Wikimedia EventStreams are handled: data
+    lines are joined and the last event ID is kept for following
+    events, as in the SSE specification.
+    """
+    event_id = None
+    data = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line:
+            if data:
+                yield Event(event_id, "\n".join(data))
+                data = []
+            continue
+
+        if line.startswith(":"):
+            # Comment, used to keep the connection alive.
+            continue
+
+        field, _, value = line.partition(":")
+        value = value.removeprefix(" ")
+        if field == "data":
+            data.append(value)
+        elif field == "id":
+            event_id = value
+
+    if data:
+        yield Event(event_id, "\n".join(data))
+
+
+def read_events(
+    source: str,
+    last_event_id: str | None = None,
+    retry_time: float = 5
+) -> Iterator[Event]:
+    """Read events from after `last_event_id`
+
+    `source` is either a URL to an EventStreams stream or a file with
+    events in the same format. Connections to a stream are opened again
+    when they are closed, which EventStreams does every 15 minutes, or
+    fail. Reading a file stops at its end.
+    """
+    if source.startswith(("http://", "https://")):
+        yield from _read_url(source, last_event_id, retry_time)
+    else:
+        yield from _read_file(source, last_event_id)
+
+
+def _read_url(
+    url: str,
+    last_event_id: str | None,
+    retry_time: float
+) -> Iterator[Event]:
+    while True:
+        headers = {"Accept": "text/event-stream"}
+        if last_event_id:
+            headers["Last-Event-ID"] = last_event_id
+        logger.info(f"Connecting to event stream: '{url}'.")
+        try:
+            with requests.get(
+                url,
+                headers=headers,
+                stream=True,
+                timeout=(10, 60)
+            ) as r:
+                r.raise_for_status()
+                lines = r.iter_lines(decode_unicode=True)
+                for event in parse_events(lines):
+                    if event.id:
+                        last_event_id = event.id
+                    yield event
+        except requests.RequestException as e:
+            logger.warning(f"Event stream failed: {e}.")
+            sleep(retry_time)
+
+
+def _read_file(path: str, last_event_id: str | None) -> Iterator[Event]:
+    skipping = last_event_id is not None
+    with open(path) as f:
+        for event in parse_events(f):
+            if skipping:
+                skipping = event.id != last_event_id
+                continue
+
+            yield event
+
+    if skipping:
+        logger.warning(f"Event '{last_event_id}' not found in '{path}'.")
+
+
+def get_upload_title(event: Event, wiki: str = COMMONS_WIKI) -> str | None:
+    """Get the file title if the event is a file upload on the wiki"""
+    try:
+        change = json.loads(event.data)
+    except json.JSONDecodeError:
+        logger.warning(f"Invalid event data: '{event.data}'.")
+        return None
+
+    is_upload = (
+        change.get("wiki") == wiki
+        and change.get("namespace") == FILE_NAMESPACE
+        and change.get("type") == "log"
+        and change.get("log_type") == "upload"
+    )
+    if not is_upload:
+        return None
+
+    return change.get("title")
+
+
+def upload_pages(
+    events: Iterable[Event],
+    checkpoint: InputCheckpoint,
+    site: BaseSite,
+    shard: Shard | None = None
+) -> Iterator[FilePage]:
+    """Get pages for files uploaded to Commons from events
+
+    Pages aren't preloaded, to not hold back files while waiting for
+    more uploads.
+    """
+    for event in events:
+        title = get_upload_title(event)
+        page = None
+        if title is not None and (shard is None or shard.contains(title)):
+            page = FilePage(site, title)
+            title = page.title()
+        else:
+            title = None
+
+        if checkpoint.add(event.id, title):
+            yield page
@@ -0,0 +1,112 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Callable
+
+from declaration_journal import DeclarationJournal, Failure
+from metadata_collector import MissingMetadataError
+
+logger = logging.getLogger(__name__)
+
+# Errors that happen again however many times the file is tried, e.g.
+# when the file page doesn't have the metadata needed.
+PERMANENT_ERRORS = (MissingMetadataError,)
+# Used when the registry didn't give a CID, without raising.
+NO_CID_ERROR = "NoCid"
+
+
+class FailureQueue:
+    """Failed files in the journal that are tried again later
+
+    Each failure is saved with the error, the number of attempts and
+    when the file can be tried next. The time to wait doubles with each
+    attempt, from `base_delay` up to `max_delay`. Files that fail with a
+    permanent error, or `max_attempts` times, aren't tried again. A
+    failure is removed when the file is declared.
+
+    Since most declared files have no failure, removals are saved in
+    batches of `remove_batch_size` and by flush(), rather than one
+    statement per file. Failures for declared files are never due, so
+    ones that are left if the run stops before that don't matter.
+    """
+
+    def __init__(
+        self,
+        journal: DeclarationJournal,
+        base_delay: timedelta = timedelta(minutes=15),
+        max_delay: timedelta = timedelta(days=1),
+        max_attempts: int = 10,
+        clock: Callable[[], datetime] = datetime.now,
+        remove_batch_size: int = 100
+    ):
+        self._journal = journal
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._max_attempts = max_attempts
+        self._clock = clock
+        self._remove_batch_size = remove_batch_size
+        self._removed: set[int] = set()
+
+    def add(
+        self,
+        page_id: int,
+        title: str,
+        error: Exception | None = None,
+        revision_id: int | None = None,
+        batch: str | None = None
+    ) -> Failure:
+        """Save a failure, `error` is None if there was no CID"""
+        self._removed.discard(page_id)
+        failure = self._journal.get_failure(page_id)
+        attempts = 1 if failure is None else failure.attempts + 1
+        permanent = isinstance(error, PERMANENT_ERRORS)
+        next_attempt = None
+        if not permanent and attempts < self._max_attempts:
+            delay = min(
+                self._base_delay * 2 ** (attempts - 1),
+                self._max_delay
+            )
+            next_attempt = self._clock() + delay
+        failure = self._journal.save_failure(
+            page_id,
+            title,
+            NO_CID_ERROR if error is None else type(error).__name__,
+            None if error is None else str(error),
+            next_attempt,
+            revision_id,
+            batch
+        )
+        if next_attempt is None:
+            logger.info(f"Not trying '{title}' again after {attempts} attempts.")
+        else:
+            logger.info(f"Trying '{title}' again after {next_attempt}.")
+        return failure
+
+    def remove(self, page_id: int):
+        self._removed.add(page_id)
+        if len(self._removed) >= self._remove_batch_size:
+            self.flush()
+
+    def flush(self):
+        """Save the removals that haven't been saved yet"""
+        if not self._removed:
+            return
+
+        self._journal.delete_failures(self._removed)
+        self._removed = set()
+
+    def due(self) -> list[int]:
+        """Get page IDs of the files that can be tried again now"""
+        self.flush()
+        return [f.page_id for f in self._journal.get_due_failures(self._clock())]
+
+    def due_batches(self) -> dict[str | None, list[int]]:
+        """Get page IDs of the files that can be tried again now by batch
+
+        The batch is the one a file was in when it last failed, None for
+        failures saved without one.
+        """
+        self.flush()
+        batches: dict[str | None, list[int]] = {}
+        for failure in self._journal.get_due_failures(self._clock()):
+            batches.setdefault(failure.batch, []).append(failure.page_id)
+        return batches
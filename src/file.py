@@ -1,4 +1,7 @@
+import json
 import logging
+from concurrent.futures import Future
+from contextlib import AbstractContextManager, nullcontext
 from tempfile import TemporaryDirectory
 from time import time
 
@@ -6,11 +9,24 @@ import pywikibot
 from pywikibot import FilePage
 from pywikibot.data import api
 
-from declaration_api_connector import DeclarationApiConnector
-from declaration_journal import DeclarationJournal
+from async_declaration_api_connector import AsyncDeclarationApiConnector
+from declaration_api_connector import (
+    DeclarationApiConnector,
+    DeclarationRequest
+)
+from declaration_journal import (
+    STAGE_CONFIRMED,
+    STAGE_ISCC,
+    STAGE_METADATA,
+    STAGE_SIGNED,
+    STAGE_SUBMITTED,
+    DeclarationJournal,
+    stage_done
+)
 from file_fetcher import FileFetcher
 from iscc_generator import IsccGenerator
-from metadata_collector import MetadataCollector
+from iscc_worker_pool import IsccWorkerPool
+from metadata_collector import MetadataCollector, MissingMetadataError
 from thumbnail_generator import ThumbnailGenerator
 
 logger = logging.getLogger(__name__)
@@ -23,25 +39,53 @@ class File:
         page: FilePage,
         tags: set[str],
         metadata_collector: MetadataCollector,
-        api_connector: DeclarationApiConnector
+        api_connector: DeclarationApiConnector,
+        iscc_pool: IsccWorkerPool | None = None,
+        file_fetcher: FileFetcher | None = None,
+        journal_lock: AbstractContextManager | None = None
     ):
         self._journal = journal
         self._page = page
         self._tags = tags
         self._metadata_collector = metadata_collector
         self._api_connector = api_connector
+        self._iscc_pool = iscc_pool
+        self._file_fetcher = file_fetcher or FileFetcher()
+        # Held when writing to the journal from steps that may run at the
+        # same time as others using it.
+        self._journal_lock = journal_lock or nullcontext()
 
         self._extra_public_metadata = {}
+        self._extra_supplier_metadata = {}
+        self._name: str | None = None
+        self._location: str | None = None
+        self._license_url: str | None = None
         self._declaration = self._journal.get_page_id_match(self._page.pageid)
         self._iscc: str | None = None
         self._file_size: int | None = None
         self._file_width: int | None = None
         self._file_height: int | None = None
         self._download_time: float | None = None
+        self._iscc_time: float | None = None
+        self._metadata_time: float | None = None
+        self._request_time: float | None = None
         self._storage = TemporaryDirectory()
         self._path: str | None = None
 
-        self._add_extmetadata()
+        # Output from stages that were done by an earlier run that
+        # didn't finish the declaration.
+        self._artifacts: dict[str, str] = {}
+        self._resuming = (
+            self._declaration is not None
+            and self._declaration.cid is None
+            and self._declaration.stage is not None
+            and self._declaration.revision_id == self._page.latest_revision_id
+        )
+        if self._resuming:
+            self._artifacts = self._journal.get_artifacts(self._declaration)
+            logger.info(
+                f"Resuming declaration after stage: {self._declaration.stage}."
+            )
 
     def _add_extmetadata(self):
         """Add non-default metadata for the file
@@ -70,6 +114,11 @@ class File:
         return self._declaration is not None \
             and self._declaration.cid is not None
 
+    def is_snapshotted(self) -> bool:
+        """Check if the metadata for a declaration has been saved"""
+        return self.is_in_registry() \
+            or stage_done(self._declaration, STAGE_METADATA)
+
     def prepare_declaration(self):
         self._declaration = self._journal.add_declaration(
             self._tags,
@@ -78,46 +127,91 @@ class File:
         )
 
     def create_declaration(self):
-        self._download_file()
-        iscc_time = self._generate_iscc()
-        self._generate_tumbnail()
+        self.download_file()
+        self.generate_iscc_and_thumbnail()
+        self.save_declaration()
 
-        self._declaration = self._journal.add_declaration(
-            self._tags,
-            page_id=self._page.pageid,
-            revision_id=self._page.latest_revision_id,
-            image_hash=self._page.latest_file_info.sha1,
-            file_size=self._file_size,
-            width=self._file_width,
-            height=self._file_height,
-            download_time=self._download_time,
-            iscc=self._iscc,
-            iscc_time=iscc_time
-        )
+    def update_declaration(self):
+        if self._declaration is None:
+            raise Exception("Declaration required.")
+
+        self.download_file()
+        self.generate_iscc_and_thumbnail()
+        self.save_declaration()
+
+    def _resumes_after(self, stage: str, artifact: str | None = None) -> bool:
+        if not self._resuming or not stage_done(self._declaration, stage):
+            return False
+
+        return artifact is None or artifact in self._artifacts
+
+    def _set_stage(self, stage: str, artifacts: dict[str, str] | None = None):
+        with self._journal_lock:
+            self._journal.set_stage(self._declaration, stage, artifacts)
+
+    def needs_iscc(self) -> bool:
+        """Check if ISCC should be generated
+
+        It's generated unless the declaration has one for the current
+        version of the file.
+        """
+        if self._declaration is None or self._declaration.iscc is None:
+            return True
+
+        return self._declaration.image_hash != self._page.latest_file_info.sha1
+
+    def download_file(self):
+        if self._resumes_after(STAGE_ISCC):
+            logger.debug("ISCC already generated, not downloading file.")
+            return
 
-    def _download_file(self):
         download_start_time = time()
-        file_fetcher = FileFetcher()
         (
             self._path,
             self._file_size,
             self._file_width,
             self._file_height
-        ) = file_fetcher.fetch_file(self._storage.name, self._page)
+        ) = self._file_fetcher.fetch_file(self._storage.name, self._page)
         self._download_time = time() - download_start_time
 
-    def _generate_iscc(self) -> float:
+    def generate_iscc_and_thumbnail(self):
+        """Generate thumbnail and ISCC if the declaration doesn't have one
+
+        Uses the worker pool if there is one, otherwise runs in this
+        process.
+        """
+        if self._resumes_after(STAGE_ISCC):
+            thumbnail = self._artifacts.get("thumbnail")
+            if thumbnail is not None:
+                self._extra_public_metadata["thumbnail"] = thumbnail
+            return
+
+        if self._iscc_pool is None:
+            if self.needs_iscc():
+                self.generate_iscc()
+            self.generate_thumbnail()
+            return
+
+        if self._path is None:
+            raise Exception("File path required.")
+
+        result = self._iscc_pool.generate(self._path, self.needs_iscc())
+        if result.iscc is not None:
+            self._iscc = result.iscc
+            self._iscc_time = result.iscc_time
+        if result.thumbnail is not None:
+            self._extra_public_metadata["thumbnail"] = result.thumbnail
+
+    def generate_iscc(self):
         if self._path is None:
             raise Exception("File path required.")
 
         iscc_start_time = time()
         iscc_generator = IsccGenerator(self._path)
         self._iscc = iscc_generator.generate()
-        iscc_time = time() - iscc_start_time
-
-        return iscc_time
+        self._iscc_time = time() - iscc_start_time
 
-    def _generate_tumbnail(self):
+    def generate_thumbnail(self):
         if self._path is None:
             raise Exception("File path required.")
 
@@ -126,73 +220,234 @@ class File:
         if thumbnail is not None:
             self._extra_public_metadata["thumbnail"] = thumbnail
 
-    def update_declaration(self):
-        if self._declaration is None:
-            raise Exception("Declaration required.")
+    def save_declaration(self):
+        """Add or update the declaration in the journal
+
+        Fields for the ISCC are only written if it was generated, i.e.
+        they are kept when updating a declaration that already had one.
+        """
+        if self._resumes_after(STAGE_ISCC):
+            return
 
         args = {
             "page_id": self._page.pageid,
             "revision_id": self._page.latest_revision_id,
             "image_hash": self._page.latest_file_info.sha1
         }
-
-        self._download_file()
-        self._generate_tumbnail()
-        if self._declaration.iscc is None:
-            iscc_time = self._generate_iscc()
+        if self._iscc is not None:
             args.update({
                 "file_size": self._file_size,
                 "width": self._file_width,
                 "height": self._file_height,
                 "download_time": self._download_time,
                 "iscc": self._iscc,
-                "iscc_time": iscc_time
+                "iscc_time": self._iscc_time
             })
 
-        self._journal.update_declaration(self._declaration, **args)
+        if self._declaration is None:
+            self._declaration = self._journal.add_declaration(
+                self._tags,
+                **args
+            )
+        else:
+            self._journal.update_declaration(self._declaration, **args)
+
+        artifacts = {}
+        thumbnail = self._extra_public_metadata.get("thumbnail")
+        if thumbnail is not None:
+            artifacts["thumbnail"] = thumbnail
+        self._journal.set_stage(self._declaration, STAGE_ISCC, artifacts)
 
     def make_request(self) -> bool:
+        self.collect_metadata()
+        cid = self.request_declaration()
+        if cid is None:
+            return False
+
+        self.save_cid(cid)
+        return True
+
+    def collect_metadata(self):
         if self._declaration is None:
             raise Exception("Declaration required.")
 
         if self._declaration.iscc is None:
             raise Exception("ISCC required.")
 
-        logger.debug("Getting location.")
-        location = self._metadata_collector.get_url()
-        logger.debug("Getting name.")
-        name = self._metadata_collector.get_name()
-        logger.debug("Getting license.")
-        license_url = self._metadata_collector.get_license()
+        if self._resumes_after(STAGE_METADATA, "metadata"):
+            self._restore_metadata(self._artifacts["metadata"])
+            return
+
+        metadata_start_time = time()
+        # Loaded here rather than when the file is set up, so that files
+        # that are skipped or prepared don't need more requests to Commons.
+        self._add_extmetadata()
+        self._get_required_metadata()
 
-        extra_supplier_metadata = {}
         logger.debug("Getting creator.")
         creator = self._metadata_collector.get_creator()
         if creator:
-            extra_supplier_metadata["creator"] = creator
+            self._extra_supplier_metadata["creator"] = creator
         logger.debug("Getting creation date.")
         creation_date = self._metadata_collector.get_creation_date()
         if creation_date:
-            extra_supplier_metadata["creationDate"] = creation_date
+            self._extra_supplier_metadata["creationDate"] = creation_date
         logger.debug("Getting PD rationale.")
         pd_rationale = self._metadata_collector.get_pd_rationale()
         if pd_rationale:
-            extra_supplier_metadata["pdRationale"] = pd_rationale
+            self._extra_supplier_metadata["pdRationale"] = pd_rationale
 
         if self._declaration.cid is not None:
             self._extra_public_metadata["supersedes"] = (
                 self._declaration.cid
             )
-        cid = self._api_connector.request_declaration(
-            name,
+        self._metadata_time = (
+            (self._metadata_time or 0) + time() - metadata_start_time
+        )
+        self._set_stage(STAGE_METADATA, {"metadata": self._dump_metadata()})
+
+    def _get_required_metadata(self):
+        """Get the metadata that a declaration can't be made without
+
+        Raises MissingMetadataError if any of it can't be found. Metadata
+        that has already been got, by validate_metadata(), is kept.
+        """
+        if self._location is None:
+            logger.debug("Getting location.")
+            self._location = self._metadata_collector.get_url()
+        if self._name is None:
+            logger.debug("Getting name.")
+            self._name = self._metadata_collector.get_name()
+        if self._license_url is None:
+            logger.debug("Getting license.")
+            self._license_url = self._metadata_collector.get_license()
+
+    def validate_metadata(self):
+        """Check that the required metadata can be found
+
+        Done before the file is downloaded, so that no time is spent on
+        files that can't be declared.
+        """
+        if self._resumes_after(STAGE_METADATA, "metadata"):
+            return
+
+        validation_start_time = time()
+        self._get_required_metadata()
+        self._metadata_time = time() - validation_start_time
+
+    def has_invalid_metadata(self) -> bool:
+        """Check if this revision has failed for missing metadata before"""
+        failure = self._journal.get_failure(self._page.pageid)
+        return (
+            failure is not None
+            and failure.error == MissingMetadataError.__name__
+            and failure.revision_id == self._page.latest_revision_id
+        )
+
+    def _dump_metadata(self) -> str:
+        public = {
+            k: v
+            for k, v in self._extra_public_metadata.items()
+            if k != "thumbnail"
+        }
+        return json.dumps({
+            "name": self._name,
+            "location": self._location,
+            "license": self._license_url,
+            "public": public,
+            "supplier": self._extra_supplier_metadata
+        })
+
+    def _restore_metadata(self, text: str):
+        metadata = json.loads(text)
+        self._name = metadata["name"]
+        self._location = metadata["location"]
+        self._license_url = metadata["license"]
+        self._extra_public_metadata.update(metadata["public"])
+        self._extra_supplier_metadata.update(metadata["supplier"])
+
+    def _stored_request(self) -> DeclarationRequest | None:
+        """Get the request signed by an earlier run, if there is one"""
+        if not self._resumes_after(STAGE_SIGNED, "request"):
+            return None
+
+        if self._declaration.stage == STAGE_SUBMITTED:
+            logger.warning(
+                "Request was sent by an earlier run without getting a "
+                "response. Sending it again, it may already have been "
+                "accepted by the registry."
+            )
+        else:
+            self._set_stage(STAGE_SUBMITTED)
+        return DeclarationRequest.from_json(self._artifacts["request"])
+
+    def _save_signed_request(self, request: DeclarationRequest):
+        self._set_stage(STAGE_SIGNED, {"request": request.to_json()})
+        self._set_stage(STAGE_SUBMITTED)
+
+    def request_declaration(self) -> str | None:
+        request_start_time = time()
+        request = self._stored_request()
+        if request is None:
+            request = self._api_connector.create_request(
+                *self._request_arguments()
+            )
+            self._save_signed_request(request)
+        cid = self._api_connector.send_declaration(request)
+        self._request_time = time() - request_start_time
+        return cid
+
+    def submit_declaration(
+        self,
+        async_connector: AsyncDeclarationApiConnector
+    ) -> Future:
+        """Submit the declaration without waiting for the response
+
+        Returns a future for the CID. It should be saved with save_cid()
+        when it's done.
+        """
+        request_start_time = time()
+        request = self._stored_request()
+        if request is None:
+            future = async_connector.submit(
+                *self._request_arguments(),
+                on_signed=self._save_signed_request
+            )
+        else:
+            future = async_connector.submit_request(request)
+
+        def set_request_time(future: Future):
+            self._request_time = time() - request_start_time
+
+        # Callbacks are called in the order they were added, so this is
+        # done before the caller is notified.
+        future.add_done_callback(set_request_time)
+        return future
+
+    def _request_arguments(self) -> tuple:
+        if self._declaration is None or self._declaration.iscc is None:
+            raise Exception("Declaration with ISCC required.")
+
+        if self._name is None or self._location is None or self._license_url is None:
+            raise Exception("Metadata required.")
+
+        return (
+            self._name,
             self._declaration.iscc,
-            location,
-            license_url,
+            self._location,
+            self._license_url,
             self._extra_public_metadata,
-            extra_supplier_metadata
+            self._extra_supplier_metadata
         )
-        if cid is None:
-            return False
 
-        self._journal.update_declaration(self._declaration, cid=cid)
-        return True
+    def save_cid(self, cid: str):
+        args = {
+            "cid": cid,
+            "stage": STAGE_CONFIRMED,
+            "request_time": self._request_time
+        }
+        if self._metadata_time is not None:
+            # Not collected by this run if the metadata was stored.
+            args["metadata_time"] = self._metadata_time
+        self._journal.delete_artifacts(self._declaration)
+        self._journal.update_declaration(self._declaration, **args)
@@ -1,13 +1,25 @@
 import logging
 import os
+from contextlib import nullcontext
 
 from PIL import Image
 from pywikibot import FilePage
+from pywikibot.comms import http
+from pywikibot.exceptions import MaxlagTimeoutError, ServerError
+
+from adaptive_limiter import (
+    AdaptiveConcurrencyLimiter,
+    OverloadError,
+    parse_retry_after
+)
 
 logger = logging.getLogger(__name__)
 
 
 class FileFetcher:
+    def __init__(self, limiter: AdaptiveConcurrencyLimiter | None = None):
+        self._limiter = limiter
+
     def fetch_file(
         self,
         directory: str,
@@ -16,9 +28,43 @@ class FileFetcher:
         filename = page.title(with_ns=False, as_filename=True)
         path = f"{directory}/{filename}"
         logger.info(f"Downloading file: '{filename}'")
-        success = page.download(path, url_width=330)
+        with self._limiter.slot() if self._limiter else nullcontext():
+            success = self._download(page, path)
         if not success:
             raise Exception("Failed to download file.")
 
         image = Image.open(path)
         return path, os.path.getsize(path), image.width, image.height
+
+    def _download(self, page: FilePage, path: str) -> bool:
+        """Download a version of the file at most 330 px wide
+
+        This does the same as FilePage.download() except that it raises
+        OverloadError when Commons is overloaded.
+        """
+        try:
+            url = page.get_file_url(url_width=330)
+        except MaxlagTimeoutError as e:
+            raise OverloadError("Commons API is lagged.") from e
+
+        try:
+            response = http.fetch(url, stream=True)
+        except ServerError as e:
+            # Raised for server errors, including 503, and timeouts.
+            raise OverloadError(f"Failed to download file: {e}") from e
+
+        if response.status_code == 429:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            raise OverloadError("Too many download requests.", retry_after)
+
+        if response.status_code != 200:
+            logger.warning(
+                f"Unsuccessful request ({response.status_code}): {response.url}"
+            )
+            return False
+
+        with open(path, "wb") as f:
+            for chunk in response.iter_content(100 * 1024):
+                f.write(chunk)
+
+        return True
@@ -0,0 +1,256 @@
+import logging
+import threading
+from collections import OrderedDict
+from itertools import batched, islice
+from time import time
+from typing import Any, Callable, Iterable, Iterator
+
+from pywikibot.data.api import ListGenerator
+from pywikibot.page import Category, FilePage, Page
+from pywikibot.pagegenerators import PagesFromTitlesGenerator
+from pywikibot.site import BaseSite
+
+from shard import Shard
+
+logger = logging.getLogger(__name__)
+
+# Number of lines in list files that are fetched together.
+LIST_CHUNK_SIZE = 50
+# Number of category members that are fetched together.
+MEMBER_CHUNK_SIZE = 50
+
+
+class InputCheckpoint:
+    """Keeps track of how far the input has been processed
+
+    Each page is added with its position in the input, e.g. an event ID
+    or a line number. Files finish out of order when processed
+    concurrently. The position of the checkpoint is the one of the last
+    page for which it and all pages before it are done, so no file is
+    missed when continuing from it. Positions that aren't for a file,
+    e.g. other events in a stream, are done as soon as they are added.
+    A file that's already being processed is dropped if it's added
+    again.
+
+    The position is passed to `save` at most every `save_interval`
+    seconds, and when save() is called.
+    """
+
+    def __init__(
+        self,
+        save: Callable[[Any], None],
+        save_interval: float = 10,
+        clock: Callable[[], float] = time
+    ):
+        self._save = save
+        self._save_interval = save_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next_number = 0
+        # Number in order added -> [position, done].
+        self._pages: OrderedDict[int, list] = OrderedDict()
+        # Title -> number of the page being processed.
+        self._titles: dict[str, int] = {}
+        self._position: Any = None
+        self._saved_position: Any = None
+        self._saved_time = clock()
+
+    @property
+    def position(self) -> Any:
+        return self._position
+
+    def add(self, position: Any, title: str | None = None) -> bool:
+        """Add a position that has been read
+
+        Returns True if the file should be processed.
+        """
+        with self._lock:
+            number = self._next_number
+            self._next_number += 1
+            process = title is not None and title not in self._titles
+            self._pages[number] = [position, not process]
+            if process:
+                self._titles[title] = number
+            self._advance()
+            return process
+
+    def done(self, title: str):
+        with self._lock:
+            number = self._titles.pop(title, None)
+            if number is None:
+                return
+
+            self._pages[number][1] = True
+            self._advance()
+
+    def save(self):
+        with self._lock:
+            self._save_position()
+
+    def _advance(self):
+        while self._pages:
+            number, (position, done) = next(iter(self._pages.items()))
+            if not done:
+                break
+
+            del self._pages[number]
+            if position is not None:
+                self._position = position
+
+        if self._clock() - self._saved_time >= self._save_interval:
+            self._save_position()
+
+    def _save_position(self):
+        self._saved_time = self._clock()
+        if self._position is None or self._position == self._saved_position:
+            return
+
+        self._save(self._position)
+        self._saved_position = self._position
+        logger.debug(f"Saved input position: {self._position}.")
+
+
+def _add(checkpoint: InputCheckpoint | None, position: Any, page: Page) -> bool:
+    if checkpoint is None:
+        return True
+
+    return checkpoint.add(position, page.title())
+
+
+def list_file_pages(
+    lines: Iterable[str],
+    site: BaseSite,
+    checkpoint: InputCheckpoint | None = None,
+    position: dict | None = None,
+    content: bool = True
+) -> Iterator[Page]:
+    """Get pages for lines in a list file
+
+    Lines are read as they're needed, so the file doesn't have to fit in
+    memory. Positions are {"line": N}, where N is the number of lines
+    done. Pages are fetched in chunks and given in the order of the
+    lines, since a chunk may come back in any order. The wikitext is
+    only fetched if `content` is True.
+    """
+    start = position["line"] if position else 0
+    if start:
+        logger.info(f"Continuing list after line {start}.")
+    numbered_lines = islice(enumerate(lines, 1), start, None)
+    for chunk in batched(numbered_lines, LIST_CHUNK_SIZE):
+        line_numbers = {}
+        titles = []
+        for number, line in chunk:
+            title = line.strip()
+            if title:
+                titles.append(title)
+                line_numbers[Page(site, title).title()] = number
+        pages = site.preloadpages(
+            PagesFromTitlesGenerator(titles, site),
+            groupsize=LIST_CHUNK_SIZE,
+            content=content
+        )
+        for page in sorted(pages, key=lambda p: line_numbers.get(p.title(), 0)):
+            line = line_numbers.get(page.title())
+            if _add(checkpoint, {"line": line} if line else None, page):
+                yield page
+
+
+def _file_members(
+    category: Category,
+    start_sortkey: str | None = None
+) -> Iterator[tuple[FilePage, str]]:
+    """Get the files in a category with their hex sort keys
+
+    Members are listed in sort key order, from `start_sortkey` if given.
+    Their latest revisions are fetched in chunks, without the content.
+    """
+    params = {
+        "cmtitle": category.title(),
+        "cmtype": "file",
+        "cmprop": "ids|title|sortkey"
+    }
+    if start_sortkey:
+        params["cmstarthexsortkey"] = start_sortkey
+    members = ListGenerator("categorymembers", site=category.site, **params)
+    for chunk in batched(members, MEMBER_CHUNK_SIZE):
+        pages = []
+        for member in chunk:
+            page = FilePage(category.site, member["title"])
+            # Like pages loaded from the API, so the ID isn't fetched again.
+            page._pageid = member["pageid"]
+            pages.append(page)
+        for _ in category.site.preloadpages(
+            pages,
+            groupsize=MEMBER_CHUNK_SIZE,
+            content=False
+        ):
+            pass
+        for page, member in zip(pages, chunk):
+            yield page, member["sortkey"]
+
+
+def category_pages(
+    category: Category,
+    depth: int,
+    shard: Shard | None = None,
+    checkpoint: InputCheckpoint | None = None,
+    position: dict | None = None
+) -> Iterator[Page]:
+    """Get files in a category and its subcategories
+
+    Categories are gone through breadth first, down to `depth` levels
+    below `category`. Positions are {"categories": [[TITLE, LEVEL], ...],
+    "index": N, "sortkey": KEY, "pageid": ID}: the categories found so
+    far in the order they're gone through, the index of the current one
+    and the hex sort key and page ID of its last file that is done.
+    When continuing from a position, the files of that category are
+    listed from the sort key, so neither the files nor the categories
+    before it are listed again.
+    """
+    site = category.site
+    # Shared by the positions, categories are only added to the end.
+    categories = [[category.title(), 0]]
+    index = 0
+    start = None
+    if position is not None:
+        if "categories" in position:
+            categories = position["categories"]
+            index = position["index"]
+            start = position["sortkey"], position["pageid"]
+            logger.info(
+                f"Continuing '{categories[index][0]}' after page {start[1]}."
+            )
+        else:
+            logger.warning("Checkpoint from an older version, starting over.")
+    visited = {title for title, _ in categories}
+    while index < len(categories):
+        title, level = categories[index]
+        current = Category(site, title)
+        members = _file_members(current, start[0] if start else None)
+        for page, sortkey in members:
+            if start is not None and sortkey == start[0]:
+                # Files with the same sort key are in page ID order.
+                if page.pageid <= start[1]:
+                    continue
+
+            item_position = {
+                "categories": categories,
+                "index": index,
+                "sortkey": sortkey,
+                "pageid": page.pageid
+            }
+            if shard is not None and not shard.contains(page.pageid):
+                if checkpoint is not None:
+                    checkpoint.add(item_position)
+                continue
+
+            if _add(checkpoint, item_position, page):
+                yield page
+        start = None
+
+        if level < depth:
+            for subcategory in current.subcategories():
+                if subcategory.title() not in visited:
+                    visited.add(subcategory.title())
+                    categories.append([subcategory.title(), level + 1])
+        index += 1
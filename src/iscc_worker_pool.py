@@ -0,0 +1,107 @@
+import logging
+import multiprocessing
+import os
+from dataclasses import dataclass
+from tempfile import TemporaryDirectory
+from time import time
+
+from iscc_generator import IsccGenerator
+from thumbnail_generator import ThumbnailGenerator
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IsccResult:
+    iscc: str | None
+    iscc_time: float | None
+    thumbnail: str | None
+
+
+class IsccWorkerPool:
+    """Generates ISCC and thumbnails in separate processes
+
+    The worker processes are started up front and import iscc_sdk once.
+    Each worker is replaced by a fresh process after it has handled
+    `max_tasks_per_worker` files. This keeps memory from native
+    libraries from growing during long runs.
+    """
+
+    def __init__(
+        self,
+        processes: int | None = None,
+        max_tasks_per_worker: int | None = 100
+    ):
+        self.processes = processes or os.cpu_count() or 1
+        # Spawn rather than fork since the main process runs threads.
+        context = multiprocessing.get_context("spawn")
+        logger.info(
+            f"Starting {self.processes} ISCC worker processes. Workers are "
+            f"recycled after {max_tasks_per_worker} files."
+        )
+        self._pool = context.Pool(
+            self.processes,
+            initializer=_initialize_worker,
+            initargs=(logging.getLogger().level,),
+            maxtasksperchild=max_tasks_per_worker
+        )
+
+    def generate(self, source: str | bytes, with_iscc: bool = True) -> IsccResult:
+        """Generate ISCC and thumbnail for a file
+
+        `source` is either a path to the file or its content. Blocks
+        until a worker is done with it.
+        """
+        return self._pool.apply(_generate, (source, with_iscc))
+
+    def generate_batch(
+        self,
+        sources: list[str | bytes],
+        with_iscc: bool = True
+    ) -> list[IsccResult]:
+        return self._pool.starmap(
+            _generate,
+            [(s, with_iscc) for s in sources]
+        )
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _initialize_worker(log_level: int):
+    logging.basicConfig(
+        level=log_level,
+        format="{asctime};{name};{levelname};{message}",
+        style="{"
+    )
+    logger.debug(f"ISCC worker started: {os.getpid()}.")
+
+
+def _generate(source: str | bytes, with_iscc: bool) -> IsccResult:
+    if isinstance(source, bytes):
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "file")
+            with open(path, "wb") as f:
+                f.write(source)
+            return _generate_from_path(path, with_iscc)
+
+    return _generate_from_path(source, with_iscc)
+
+
+def _generate_from_path(path: str, with_iscc: bool) -> IsccResult:
+    iscc = None
+    iscc_time = None
+    if with_iscc:
+        iscc_start_time = time()
+        iscc = IsccGenerator(path).generate()
+        iscc_time = time() - iscc_start_time
+
+    thumbnail = ThumbnailGenerator(path).generate()
+    return IsccResult(iscc, iscc_time, thumbnail)
@@ -0,0 +1,75 @@
+import logging
+from itertools import batched
+from typing import Callable, Iterable, Iterator, Sequence
+
+from pywikibot.page import Page
+
+from declaration_journal import DeclarationJournal
+
+logger = logging.getLogger(__name__)
+
+
+class JournalFilter:
+    """Drops input that would be skipped since it's in the journal
+
+    Page IDs are looked up in the journal in chunks of `chunk_size`,
+    rather than one at a time when each file is processed, so pages
+    that would be skipped aren't fetched from Commons. When preparing,
+    all pages in the journal are dropped, or with `snapshot` those that
+    have their metadata saved or have been declared. Otherwise those
+    that have been declared in the registry are dropped.
+
+    The filter may be used from another thread than the one processing
+    files, in which case the journal should have its own session.
+    """
+
+    def __init__(
+        self,
+        journal: DeclarationJournal,
+        prepare: bool = False,
+        snapshot: bool = False,
+        chunk_size: int = 500
+    ):
+        self._journal = journal
+        self._only_declared = not prepare
+        self._only_snapshotted = prepare and snapshot
+        self._chunk_size = chunk_size
+        self.skipped = 0
+
+    def page_ids(self, page_ids: Iterable[int]) -> Iterator[int]:
+        for chunk in batched(page_ids, self._chunk_size):
+            known = self._get_known_page_ids(chunk)
+            self._count(len(known))
+            for page_id in chunk:
+                if page_id not in known:
+                    yield page_id
+
+    def pages(
+        self,
+        pages: Iterable[Page],
+        on_skip: Callable[[Page], None] | None = None
+    ) -> Iterator[Page]:
+        """Filter pages that have page IDs
+
+        `on_skip` is called with each page that's dropped.
+        """
+        for chunk in batched(pages, self._chunk_size):
+            known = self._get_known_page_ids([p.pageid for p in chunk])
+            self._count(len(known))
+            for page in chunk:
+                if page.pageid not in known:
+                    yield page
+                elif on_skip is not None:
+                    on_skip(page)
+
+    def _get_known_page_ids(self, page_ids: Sequence[int]) -> set[int]:
+        return self._journal.get_known_page_ids(
+            page_ids,
+            self._only_declared,
+            self._only_snapshotted
+        )
+
+    def _count(self, skipped: int):
+        if skipped:
+            self.skipped += skipped
+            logger.info(f"Left out {skipped} pages that are in the journal.")
@@ -1,18 +1,27 @@
 #! /usr/bin/env python
 
+import json
 import logging
+import multiprocessing
 import os
-import random
+import queue
 import sys
 from argparse import ArgumentParser, Namespace
-from datetime import datetime
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from itertools import batched, chain
 from pathlib import Path
+from tempfile import mkstemp
+from threading import Lock
 from time import time
+from typing import Any, Callable, Iterable, Iterator
 
+import pywikibot
 import urllib3
 from dotenv import load_dotenv
 from pywikibot import FilePage, Site
-from pywikibot.page import Category
+from pywikibot.page import Category, Page
 from pywikibot.pagegenerators import (
     PagesFromPageidGenerator,
     PagesFromTitlesGenerator,
@@ -21,10 +30,33 @@ from pywikibot.pagegenerators import (
 from pywikibot.site import BaseSite
 from sqlalchemy.exc import PendingRollbackError
 
+from adaptive_limiter import AdaptiveConcurrencyLimiter
+from async_declaration_api_connector import AsyncDeclarationApiConnector
+from autotuner import Autotuner
+from changed_files import CHECKPOINT_NAME as CHANGED_CHECKPOINT
+from changed_files import get_changed_pages
+from changed_files import save_checkpoint as save_changed_checkpoint
+from circuit_breaker import CircuitBreaker
 from declaration_api_connector import DeclarationApiConnector
 from declaration_journal import DeclarationJournal, create_journal
+from declaration_service import DeclarationService, WorkRequest
+from event_stream import read_events, upload_pages
+from failure_queue import FailureQueue
 from file import File
+from file_fetcher import FileFetcher
+from input_checkpoint import InputCheckpoint, category_pages, list_file_pages
+from iscc_worker_pool import IsccWorkerPool
+from journal_filter import JournalFilter
 from metadata_collector import MetadataCollector
+from outcome_log import OutcomeLog
+from pipeline import Pipeline, Quota, Stage
+from rate_limiter import FileBucket, MemoryBucket, RateLimiter
+from run_plan import STAGE_TIME_COLUMNS, RunPlan, get_stage_times
+from sampling import reservoir_sample
+from shard import Shard
+from snapshot_page import SnapshotPage
+from staleness_scanner import StalenessScanner
+from work_queue import WorkQueue
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +66,20 @@ FAILED = "FAILED"
 ONLY_ISCC = "ONLY_ISCC"
 SKIPPED = "SKIPPED"
 PREPARED = "PREPARED"
+# Used by the pipeline for files that were dropped since the limit was hit.
+CANCELLED = "CANCELLED"
+
+# Input that starts with this is the name of a work queue to take files from.
+QUEUE_PREFIX = "Queue:"
+# Input that starts with this is an event stream URL or file to take
+# uploads from.
+STREAM_PREFIX = "Stream:"
+# Input that starts with this means files in the journal that have been
+# changed since the given time or the last run.
+CHANGED_PREFIX = "Changed:"
+
+# Pipeline stages that the autotuner moves workers between.
+TUNED_STAGES = ["download", "iscc", "metadata", "request"]
 
 
 def process_file(
@@ -43,22 +89,31 @@ def process_file(
     api_connector: DeclarationApiConnector,
     site: BaseSite,
     batch_name: str,
-    prepare: bool = False
+    prepare: bool = False,
+    iscc_pool: IsccWorkerPool | None = None,
+    file_fetcher: FileFetcher | None = None,
+    quota: Quota | None = None
 ) -> str:
     metadata_collector = MetadataCollector(site, page)
 
     tags = set(args.tag)
     tags.add(batch_name)
-    file = File(journal, page, tags, metadata_collector, api_connector)
+    file = File(
+        journal,
+        page,
+        tags,
+        metadata_collector,
+        api_connector,
+        iscc_pool,
+        file_fetcher
+    )
 
     if not file.is_in_journal():
-        if prepare:
+        if prepare and not args.snapshot:
             file.prepare_declaration()
             return PREPARED
-
-        file.create_declaration()
     else:
-        if prepare:
+        if prepare and (not args.snapshot or file.is_snapshotted()):
             logger.info("Skipping file already in journal.")
             return SKIPPED
 
@@ -66,17 +121,54 @@ def process_file(
             logger.info("Skipping file already in registry.")
             return SKIPPED
 
+    if args.validate_first and not prepare:
+        if file.has_invalid_metadata():
+            logger.info("Skipping file that was missing metadata.")
+            return SKIPPED
+
+        file.validate_metadata()
+
+    if file.is_in_journal():
         file.update_declaration()
+    else:
+        file.create_declaration()
 
     if args.iscc:
         return ONLY_ISCC
 
-    if file.make_request():
+    if prepare:
+        # Only the metadata is saved, for declaring from it later.
+        file.collect_metadata()
+        return PREPARED
+
+    if quota is None:
+        quota = Quota(None)
+    if not quota.acquire():
+        # The limit was hit by another process while this file was
+        # being prepared.
+        return CANCELLED
+
+    try:
+        declared = file.make_request()
+    except Exception:
+        quota.release()
+        raise
+
+    if declared:
+        quota.commit()
         return DECLARED
     else:
+        quota.release()
         return FAILED
 
 
+def as_file_page(page: Page | SnapshotPage) -> FilePage | SnapshotPage:
+    if isinstance(page, SnapshotPage):
+        return page
+
+    return FilePage(page)
+
+
 def get_os_env(name: str, optional: bool = False) -> str:
     value = os.getenv(name)
     if value is None:
@@ -107,7 +199,12 @@ def make_arguments() -> Namespace:
         "--iscc",
         "-i",
         action="store_true",
-        help="Stop after generating ISCC. No declarations are made."
+        help="Stop after generating ISCC. No declarations are made. Implies --pipeline."
+    )
+    parser.add_argument(
+        "--outcome-log",
+        metavar="FILE",
+        help="Append the result for each file to this file, as a line of JSON. Worker processes write to the same file."  # noqa: 501
     )
     parser.add_argument(
         "--quit-on-error",
@@ -126,7 +223,17 @@ def make_arguments() -> Namespace:
         "--rate-limit",
         "-r",
         type=float,
-        help="Rate limit in seconds for requests to the registry API. WARNING: may not be accurate."
+        help="Rate limit in seconds for requests to the registry API, i.e. the average time between requests."  # noqa: 501
+    )
+    parser.add_argument(
+        "--rate-burst",
+        type=int,
+        default=1,
+        help="Number of requests to the registry API that can be made at once after a pause, when using --rate-limit."  # noqa: 501
+    )
+    parser.add_argument(
+        "--rate-limit-file",
+        help="File to keep the rate limit state in. Processes on the same host that use the same file share one rate limit."  # noqa: 501
     )
     parser.add_argument(
         "--limit",
@@ -152,157 +259,1468 @@ def make_arguments() -> Namespace:
         action="store_true",
         help="Prepare declarations rather than making them. This adds them to the journal so they can be made later."  # noqa: 501
     )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="With --prepare, also download the files, generate ISCC and thumbnails and collect the metadata, and save it all in the journal. The declarations can then be made with --from-snapshot."  # noqa: 501
+    )
+    parser.add_argument(
+        "--from-snapshot",
+        action="store_true",
+        help="Make the declarations with the tag given as input from what was saved with --snapshot, without fetching anything from Commons. Can't be used with --processes."  # noqa: 501
+    )
     parser.add_argument(
         "--recurse-categories",
         "-c",
         action="store_true",
         help="Process files in subcategories to a depth of at most 100. Only relevant when a category is used as input."  # noqa: 501
     )
-    parser.add_argument("files")
-    return parser.parse_args()
+    parser.add_argument(
+        "--pipeline",
+        "-P",
+        action="store_true",
+        help="Process files concurrently in a pipeline where each step, e.g. download and ISCC generation, has its own workers."  # noqa: 501
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=4,
+        help="Number of threads downloading files when using --pipeline."
+    )
+    parser.add_argument(
+        "--iscc-workers",
+        type=int,
+        default=2,
+        help="Number of threads generating ISCC and thumbnails when using --pipeline."
+    )
+    parser.add_argument(
+        "--metadata-workers",
+        type=int,
+        default=4,
+        help="Number of threads collecting metadata when using --pipeline."
+    )
+    parser.add_argument(
+        "--request-workers",
+        type=int,
+        default=2,
+        help="Number of threads making requests to the registry when using --pipeline."
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=10,
+        help="Maximum number of files waiting for each step when using --pipeline."
+    )
+    parser.add_argument(
+        "--iscc-processes",
+        type=int,
+        help="Generate ISCC and thumbnails in this many worker processes. Defaults to the number of CPUs when --iscc is used, otherwise ISCC is generated in the main process."  # noqa: 501
+    )
+    parser.add_argument(
+        "--recycle-iscc-workers",
+        type=int,
+        default=100,
+        help="Replace an ISCC worker process after it has processed this many files."
+    )
+    parser.add_argument(
+        "--async-requests",
+        type=int,
+        help="Keep up to this many declaration requests in flight at the same time. Implies --pipeline."  # noqa: 501
+    )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        "-a",
+        action="store_true",
+        help="Adjust how many downloads and requests to the TSA and registry are made at the same time. Starts at one and goes up while responses are fast and down when a service is overloaded. The number of workers are the upper limits."  # noqa: 501
+    )
+    parser.add_argument(
+        "--circuit-breaker",
+        type=int,
+        metavar="FAILURES",
+        help="Stop making requests to the registry and TSA after this many have failed in a row, e.g. from server errors or timeouts. Downloads and metadata collection are paused too. A single request is made every --circuit-reset-time seconds to see if they have recovered."  # noqa: 501
+    )
+    parser.add_argument(
+        "--circuit-reset-time",
+        type=float,
+        default=60,
+        help="Seconds to wait before trying again when using --circuit-breaker."
+    )
+    parser.add_argument(
+        "--validate-first",
+        action="store_true",
+        help="Check that the metadata needed for a declaration can be found before downloading a file. Files that can't be declared are saved as failures in the journal and skipped by later runs with this option until the file page has been edited. Not used with --prepare."  # noqa: 501
+    )
+    parser.add_argument(
+        "--target-rate",
+        type=float,
+        help="Files per hour to aim for. Measures how long each step takes and moves workers between download, ISCC, metadata and request steps to reach it, or get as close as possible. The total number of workers is the sum of the workers for those steps. Implies --pipeline."  # noqa: 501
+    )
+    parser.add_argument(
+        "--tune-interval",
+        type=float,
+        default=60,
+        help="Seconds between adjustments and reports when using --target-rate."
+    )
+    parser.add_argument(
+        "--shard",
+        type=Shard.parse,
+        help="Only process one part of the input, given as INDEX/COUNT, e.g. 2/3 for the second of three parts. Pages are split by a hash of their page ID, or title for list files, so that runs with the same COUNT on different hosts process different pages."  # noqa: 501
+    )
+    parser.add_argument(
+        "--fill-queue",
+        help="Add the pages from the input to this work queue in the journal instead of processing them. Workers can then process them by giving \"Queue:\" followed by the queue name as input."  # noqa: 501
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100,
+        help="Number of pages in each chunk added with --fill-queue, given to a worker process with --processes or added to the journal together with --prepare."  # noqa: 501
+    )
+    parser.add_argument(
+        "--lease-time",
+        type=float,
+        default=10,
+        help="Minutes that a worker holds a chunk from a work queue without renewing it. Chunks from workers that stop are given to other workers after this."  # noqa: 501
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="Process files in this many worker processes. The input is read once and its pages are handed out to the workers in chunks of --chunk-size pages. Each worker runs like a separate run with the other options."  # noqa: 501
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="Keep running and take work requests on this Unix socket instead of processing the input. Connections to Commons, the journal and the registry are set up once and kept between requests."  # noqa: 501
+    )
+    parser.add_argument(
+        "--find-stale",
+        action="store_true",
+        help="Compare the declarations in the journal with the latest versions of the files on Commons instead of processing files. Declarations for files that have changed are tagged \"stale:\" followed by the date and those for deleted files \"missing:\" followed by the date. If a tag is given as input only declarations with that tag are compared."  # noqa: 501
+    )
+    parser.add_argument("files", nargs="?")
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Process files that failed in earlier runs and are due to be tried again instead of an input. The time before a file is tried again doubles with each attempt. Files are tagged with the batch they failed in. Files that are missing metadata aren't tried again."  # noqa: 501
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Go through the input and print how many files are new, would be updated or skipped, and an estimate of how long the run would take with the other options. The estimate uses the time each step took for earlier files with the same tags. Nothing is downloaded and no requests are made to the registry."  # noqa: 501
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from where the last run with the same list file or category, and shard, stopped. Can't be used with --sample or --processes."  # noqa: 501
+    )
+    args = parser.parse_args()
+    if not args.files and not (args.serve or args.find_stale or args.retry_failed):
+        parser.error(
+            "Input is required unless --serve, --find-stale or --retry-failed "
+            "is used."
+        )
+    if args.files and args.retry_failed:
+        parser.error("Input can't be given with --retry-failed.")
+    if args.resume and (args.sample or args.processes):
+        parser.error("--resume can't be used with --sample or --processes.")
+    if args.snapshot and not args.prepare:
+        parser.error("--snapshot requires --prepare.")
+    if args.from_snapshot and (args.prepare or args.processes):
+        parser.error("--from-snapshot can't be used with --prepare or --processes.")
+    if args.plan and (args.serve or args.find_stale or args.fill_queue):
+        parser.error("--plan can't be used with --serve, --find-stale or --fill-queue.")
+    if args.plan and args.files and args.files.startswith((QUEUE_PREFIX, STREAM_PREFIX)):
+        parser.error("--plan can't be used with a work queue or event stream.")
+    return args
 
 
-if __name__ == "__main__":
-    args = make_arguments()
-    log_level = logging.DEBUG if args.verbose else logging.INFO
-    logging.basicConfig(
-        level=log_level,
-        format="{asctime};{name};{levelname};{message}",
-        style="{"
-    )
+class RunSummary:
+    """Counts of the results for the files in a run
 
-    load_dotenv()
-    api_endpoint = get_os_env("API_ENDPOINT")
-    api_key = get_os_env("API_KEY")
-    raw_api_key = get_os_env("RAW_API_KEY", True)
-    member_credentials_path = get_os_env("MEMBER_CREDENTIALS_FILE")
-    private_key_path = get_os_env("PRIVATE_KEY_FILE")
-    public_key_path = get_os_env("PUBLIC_KEY_FILE")
-    declaration_journal_url = get_os_env("DECLARATION_JOURNAL_URL")
-    tsa_url = get_os_env("TSA_URL")
-    tsa_skip_verify = bool(get_os_env("TSA_SKIP_VERIFY", True))
+    Only the numbers are kept, so memory use doesn't grow with the size
+    of the run. The result for each file is written to `outcome_log` if
+    given.
+    """
+
+    def __init__(
+        self,
+        limit: int | None = None,
+        on_add: Callable[[str, str], None] | None = None,
+        outcome_log: OutcomeLog | None = None
+    ):
+        self.limit = limit
+        self.files_declared = 0
+        self.files_skipped = 0
+        self.files_failed = 0
+        # Left out before processing since they're in the journal.
+        self.files_filtered = 0
+        # Called with the title and result for each file.
+        self._on_add = on_add
+        self.outcome_log = outcome_log
+
+    def add(self, title: str, result: str | None):
+        if result is None:
+            return
+
+        if self._on_add is not None:
+            self._on_add(title, result)
+        if self.outcome_log is not None:
+            self.outcome_log.add(title, result)
+        if result == DECLARED:
+            self.files_declared += 1
+        elif result == SKIPPED:
+            self.files_skipped += 1
+        elif result == FAILED:
+            self.files_failed += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "declared": self.files_declared,
+            "skipped": self.files_skipped,
+            "failed": self.files_failed,
+            "filtered": self.files_filtered
+        }
+
+    def merge(self, other: "RunSummary"):
+        self.files_declared += other.files_declared
+        self.files_skipped += other.files_skipped
+        self.files_failed += other.files_failed
+        self.files_filtered += other.files_filtered
+
+    def __getstate__(self) -> dict:
+        # Summaries are sent from worker processes without the callback
+        # and the log, which stay in the process.
+        state = self.__dict__.copy()
+        state["_on_add"] = None
+        state["outcome_log"] = None
+        return state
+
+    def print(self):
+        print(f"{self.files_declared} files declared.")
+        if self.files_filtered:
+            print(
+                f"{self.files_filtered} files left out since they're in the "
+                "journal."
+            )
+        if self.files_skipped:
+            print(f"{self.files_skipped} files skipped.")
+        if self.files_failed:
+            print(f"{self.files_failed} requests failed. See log for details.")
+
+
+def read_lines(path: str) -> Iterator[str]:
+    with open(path) as f:
+        yield from f
+
+
+def get_pages(
+    args: Namespace,
+    journal: DeclarationJournal,
+    site: BaseSite,
+    checkpoint: InputCheckpoint | None = None,
+    position: dict | None = None,
+    journal_filter: JournalFilter | None = None
+) -> tuple[Iterable[Page], int | None, str]:
+    """Get pages from the input argument
+
+    Returns the pages, the number of pages if it's known beforehand and
+    the batch name. Pages from list files and categories are added to
+    `checkpoint` and start after `position`, if given. Pages that would
+    be skipped are dropped by `journal_filter`, if given.
+    """
+    def skip_page(page: Page):
+        if checkpoint is not None:
+            checkpoint.done(page.title())
 
-    if tsa_skip_verify:
-        urllib3.disable_warnings()
-    declaration_journal = create_journal(declaration_journal_url)
-    site = Site("commons")
     number_of_files = None
     if os.path.exists(args.files):
         list_file = args.files
         logger.info(f"Reading file list from file: '{list_file}'.")
-        with open(list_file) as f:
-            titles = f.readlines()
-            if args.sample:
-                sample_size = min(args.sample, len(titles))
-                titles = random.sample(titles, sample_size)
+        titles = read_lines(list_file)
+        if args.shard:
+            titles = (t for t in titles if args.shard.contains(t))
+        if args.sample:
+            titles = reservoir_sample(titles, args.sample)
             number_of_files = len(titles)
-            pages = PreloadingGenerator(PagesFromTitlesGenerator(titles, site))
+        # Only the page IDs and revisions are needed when planning,
+        # filling the queue or preparing without a snapshot. Worker
+        # processes fetch the pages again.
+        content = not (
+            args.processes
+            or args.plan
+            or args.fill_queue
+            or (args.prepare and not args.snapshot)
+        )
+        pages = list_file_pages(titles, site, checkpoint, position, content)
+        if journal_filter is not None:
+            # Page IDs aren't known until the pages have been fetched.
+            pages = journal_filter.pages(pages, skip_page)
         batch_name = f"batch:{Path(list_file).stem}"
     elif args.files.startswith("Category:"):
         category = Category(site, args.files)
         category_depth = 100 if args.recurse_categories else 0
-        pages = category.members(
-            recurse=category_depth,  # pyright: ignore[reportArgumentType]
-            member_type="file"
+        # Members are listed with their page IDs, so the shard is picked
+        # out before anything else is fetched.
+        pages = category_pages(
+            category,
+            category_depth,
+            args.shard,
+            checkpoint,
+            position
         )
+        if journal_filter is not None:
+            pages = journal_filter.pages(pages, skip_page)
+        if args.sample:
+            pages = reservoir_sample(pages, args.sample)
+            number_of_files = len(pages)
         batch_name = f"batch:category-{category.pageid}"
-    elif declaration_journal.tag_exists(args.files):
+    elif journal.tag_exists(args.files):
         files_tag = args.files
         logger.info(f"Reading file list from journal tag: '{files_tag}'.")
-        only_not_declared = not args.update
-        declarations = declaration_journal.get_declarations(
+        page_ids = journal.get_page_ids(
             files_tag,
-            args.sample,
-            only_not_declared=only_not_declared
+            only_not_declared=not args.update
         )
-        number_of_files = len(declarations)
-        pages = PreloadingGenerator(PagesFromPageidGenerator(
-            [d.page_id for d in declarations],
-            site
-        ))
+        if journal_filter is not None:
+            page_ids = journal_filter.page_ids(page_ids)
+        if args.shard:
+            page_ids = (i for i in page_ids if args.shard.contains(i))
+        if args.sample:
+            page_ids = reservoir_sample(page_ids, args.sample)
+        else:
+            page_ids = list(page_ids)
+        number_of_files = len(page_ids)
+        pages = pages_from_ids(page_ids, site)
         batch_name = args.files
     else:
         raise Exception("No valid list file, tag or category specified.")
 
-    start_total_time = time()
-    error_files = []
-    skipped_files = []
-    files_declared = 0
-    timestamp = datetime.now().astimezone().replace(microsecond=0).isoformat()
-    breaking_error = False
-    print(f"START: {timestamp}")
-    api_connector = DeclarationApiConnector(
-        args.dry,
-        api_endpoint,
-        api_key,
-        raw_api_key,
-        member_credentials_path,
-        private_key_path,
-        public_key_path,
-        tsa_url,
-        tsa_skip_verify,
-        args.rate_limit
-    )
+    return pages, number_of_files, batch_name
+
+
+def print_progress(
+    i: int,
+    number_of_files: int | None,
+    summary: RunSummary,
+    title: str
+):
     if number_of_files:
-        print(f"Processing {number_of_files} files.")
-    for i, page in enumerate(pages):
-        logger.info(f"Starting on file: '{page.title()}'.")
+        progress = f"{i + 1}/{number_of_files}"
+    else:
+        progress = f"{i + 1}"
+    if summary.limit:
+        progress += f" [{summary.files_declared + 1}/{summary.limit}]"
+    progress += f" {title}"
+    print(progress)
+
+
+@dataclass
+class Run:
+    """What's shared between all files in a run"""
+    args: Namespace
+    journal: DeclarationJournal
+    api_connector: DeclarationApiConnector
+    site: BaseSite
+    batch_name: str
+    summary: RunSummary
+    number_of_files: int | None = None
+    iscc_pool: IsccWorkerPool | None = None
+    async_connector: AsyncDeclarationApiConnector | None = None
+    file_fetcher: FileFetcher | None = None
+    # Declarations left to make, may be shared with other processes.
+    quota: Quota = field(default_factory=lambda: Quota(None))
+    failures: FailureQueue | None = None
+    # Open while the registry or TSA is failing.
+    circuit_breaker: CircuitBreaker | None = None
+    # Set when the run was stopped before all input was processed.
+    stopped: bool = False
 
-        if number_of_files:
-            progress = f"{i + 1}/{number_of_files}"
+
+def record_failure(
+    run: Run,
+    page: Page,
+    result: str | None,
+    error: Exception | None = None
+):
+    """Add failed files to the failure queue and remove declared ones"""
+    if run.failures is None or result not in (FAILED, DECLARED):
+        return
+
+    try:
+        if not page.exists():
+            # Nothing to try again.
+            return
+
+        if result == FAILED:
+            run.failures.add(
+                page.pageid,
+                page.title(),
+                error,
+                page.latest_revision_id,
+                run.batch_name
+            )
         else:
-            progress = f"{i + 1}"
-        if args.limit:
-            progress += f" [{files_declared + 1}/{args.limit}]"
-        progress += f" {page.title()}"
-        print(progress)
+            run.failures.remove(page.pageid)
+    except Exception:
+        logger.exception(f"Couldn't save failure for file: '{page.title()}'.")
+
+
+def run_serial(pages: Iterable[Page], run: Run):
+    args = run.args
+    summary = run.summary
+    for i, page in enumerate(pages):
+        if run.circuit_breaker is not None and not args.iscc:
+            run.circuit_breaker.wait()
+        logger.info(f"Starting on file: '{page.title()}'.")
+        print_progress(i, run.number_of_files, summary, page.title())
 
         start_time = time()
         try:
-            page = FilePage(page)
+            page = as_file_page(page)
             process_result = process_file(
                 page,
                 args,
-                declaration_journal,
-                api_connector,
-                site,
-                batch_name,
-                args.prepare
+                run.journal,
+                run.api_connector,
+                run.site,
+                run.batch_name,
+                args.prepare,
+                run.iscc_pool,
+                run.file_fetcher,
+                run.quota
             )
-            if process_result == DECLARED:
-                files_declared += 1
-            elif process_result == SKIPPED:
+            if process_result == CANCELLED:
+                # Not counted or logged, like in the pipeline, since it's
+                # processed again by a later run.
+                continue
+
+            summary.add(page.title(), process_result)
+            record_failure(run, page, process_result)
+            if process_result == SKIPPED:
                 print("SKIP")
-                skipped_files.append(page.title())
         except Exception as e:
             logger.exception(f"Error while processing file: '{page.title()}'.")
             print("ERROR")
-            error_files.append(page.title())
+            summary.add(page.title(), FAILED)
 
             if type(e) is PendingRollbackError:
                 logger.error("Rolling back session due to error.")
                 logger.exception(e)
-                declaration_journal.rollback_session()
+                run.journal.rollback_session()
 
+            record_failure(run, page, FAILED, e)
             if args.quit_on_error:
+                run.stopped = True
                 break
 
         finally:
             logger.info(f"Done with file '{page.title()}'.")
             process_time = time() - start_time
             print(f"File time: {process_time:.2f}")
-            if args.limit and files_declared == args.limit:
+            if run.quota.reached():
                 print(f"Hit limit for declarations made: {args.limit}.")
+                run.stopped = True
+                break
+
+
+@dataclass
+class PipelineItem:
+    page: Page
+    start_time: float = field(default_factory=time)
+    file: File | None = None
+    cid: str | None = None
+
+
+def make_pipeline(run: Run, journal_lock: Lock, quota: Quota) -> Pipeline:
+    """Create a pipeline that does the same steps as process_file()
+
+    Steps that touch the journal share a lock since the session can't
+    be used by more than one thread at a time.
+    """
+    args = run.args
+    tags = set(args.tag)
+    tags.add(run.batch_name)
+    # Prepared declarations aren't made, so they're not validated.
+    validate_first = args.validate_first and not args.prepare
+    iscc_workers = args.iscc_workers
+    if run.iscc_pool is not None:
+        # Have enough threads waiting for the pool to keep all of its
+        # processes busy.
+        iscc_workers = max(iscc_workers, run.iscc_pool.processes)
+    # Let the autotuner give any of the stages all the workers.
+    max_workers = None
+    if args.target_rate:
+        max_workers = (
+            args.download_workers
+            + iscc_workers
+            + args.metadata_workers
+            + args.request_workers
+        )
+
+    def load(item: PipelineItem) -> str | None:
+        logger.info(f"Starting on file: '{item.page.title()}'.")
+        page = as_file_page(item.page)
+        metadata_collector = MetadataCollector(run.site, page)
+        item.file = File(
+            run.journal,
+            page,
+            tags,
+            metadata_collector,
+            run.api_connector,
+            run.iscc_pool,
+            run.file_fetcher,
+            journal_lock
+        )
+        if not item.file.is_in_journal():
+            if args.prepare and not args.snapshot:
+                item.file.prepare_declaration()
+                return PREPARED
+        else:
+            if args.prepare and (not args.snapshot or item.file.is_snapshotted()):
+                logger.info("Skipping file already in journal.")
+                return SKIPPED
+
+            if item.file.is_in_registry() and not args.update:
+                logger.info("Skipping file already in registry.")
+                return SKIPPED
+
+        if validate_first and item.file.has_invalid_metadata():
+            logger.info("Skipping file that was missing metadata.")
+            return SKIPPED
+
+    def wait_for_services():
+        # Don't fetch more from Commons for files that can't be declared.
+        if run.circuit_breaker is not None and not args.iscc:
+            run.circuit_breaker.wait()
+
+    def validate_metadata(item: PipelineItem):
+        wait_for_services()
+        item.file.validate_metadata()
+
+    def download(item: PipelineItem):
+        wait_for_services()
+        item.file.download_file()
+
+    def generate_iscc(item: PipelineItem):
+        item.file.generate_iscc_and_thumbnail()
+
+    def save_declaration(item: PipelineItem) -> str | None:
+        item.file.save_declaration()
+        if args.iscc:
+            return ONLY_ISCC
+
+    def collect_metadata(item: PipelineItem):
+        wait_for_services()
+        item.file.collect_metadata()
+
+    def request_declaration(item: PipelineItem) -> str | None | Future:
+        if args.prepare:
+            return PREPARED
+
+        if not quota.acquire():
+            # The limit was hit by other files while this one was waiting.
+            return CANCELLED
+
+        if run.async_connector is not None:
+            return submit_declaration(item)
+
+        try:
+            item.cid = item.file.request_declaration()
+        except Exception:
+            quota.release()
+            raise
+
+        if item.cid is None:
+            quota.release()
+            return FAILED
+
+    def submit_declaration(item: PipelineItem) -> Future:
+        stage_result = Future()
+
+        def done(cid_future: Future):
+            try:
+                item.cid = cid_future.result()
+            except Exception as e:
+                quota.release()
+                stage_result.set_exception(e)
+                return
+
+            if item.cid is None:
+                quota.release()
+                stage_result.set_result(FAILED)
+            else:
+                stage_result.set_result(None)
+
+        try:
+            cid_future = item.file.submit_declaration(run.async_connector)
+        except Exception:
+            quota.release()
+            raise
+
+        cid_future.add_done_callback(done)
+        return stage_result
+
+    def save_cid(item: PipelineItem) -> str:
+        try:
+            item.file.save_cid(item.cid)
+        except Exception:
+            quota.release()
+            raise
+
+        quota.commit()
+        return DECLARED
+
+    stages = [Stage("load", load, lock=journal_lock)]
+    if validate_first:
+        stages.append(Stage(
+            "validate",
+            validate_metadata,
+            args.metadata_workers
+        ))
+    return Pipeline(stages + [
+        Stage("download", download, args.download_workers, None, max_workers),
+        Stage("iscc", generate_iscc, iscc_workers, None, max_workers),
+        Stage("journal", save_declaration, lock=journal_lock),
+        Stage(
+            "metadata",
+            collect_metadata,
+            args.metadata_workers,
+            None,
+            max_workers
+        ),
+        Stage(
+            "request",
+            request_declaration,
+            args.request_workers,
+            None,
+            max_workers
+        ),
+        # Declarations that have been made are saved even when stopping.
+        Stage("record", save_cid, lock=journal_lock, cancellable=False),
+    ], args.queue_size)
+
+
+def run_pipeline(pages: Iterable[Page], run: Run):
+    args = run.args
+    journal_lock = Lock()
+    pipeline = make_pipeline(run, journal_lock, run.quota)
+    autotuner = None
+    if args.target_rate:
+        autotuner = Autotuner(
+            pipeline,
+            TUNED_STAGES,
+            args.target_rate,
+            args.tune_interval
+        )
+        autotuner.start()
+    items = (PipelineItem(page) for page in pages)
+    try:
+        consume_pipeline_results(pipeline, items, run, journal_lock)
+    finally:
+        if autotuner is not None:
+            autotuner.stop()
+
+
+def consume_pipeline_results(
+    pipeline: Pipeline,
+    items: Iterable[PipelineItem],
+    run: Run,
+    journal_lock: Lock
+):
+    args = run.args
+    summary = run.summary
+    finished = 0
+    for pipeline_result in pipeline.run(items):
+        item = pipeline_result.item
+        result = pipeline_result.result
+        if result is None and pipeline_result.error is None:
+            # Cancelled since the run is stopping.
+            continue
+
+        if result == CANCELLED:
+            continue
+
+        title = item.page.title()
+        print_progress(finished, run.number_of_files, summary, title)
+        finished += 1
+        if pipeline_result.error is not None:
+            e = pipeline_result.error
+            logger.error(
+                f"Error while processing file: '{title}'.",
+                exc_info=e
+            )
+            print("ERROR")
+            result = FAILED
+            if type(e) is PendingRollbackError:
+                logger.error("Rolling back session due to error.")
+                with journal_lock:
+                    run.journal.rollback_session()
+
+            if args.quit_on_error:
+                run.stopped = True
+                pipeline.stop()
+        elif result == SKIPPED:
+            print("SKIP")
+
+        summary.add(title, result)
+        with journal_lock:
+            record_failure(run, item.page, result, pipeline_result.error)
+        logger.info(f"Done with file '{title}'.")
+        print(f"File time: {time() - item.start_time:.2f}")
+        if run.quota.reached():
+            print(f"Hit limit for declarations made: {args.limit}.")
+            run.stopped = True
+            pipeline.stop()
+
+
+def prepare_pages(pages: Iterable[Page], run: Run):
+    """Prepare declarations for pages in bulk
+
+    Pages are taken in chunks of --chunk-size and added to the journal
+    with one insert for the declarations and one for their tags, rather
+    than a few statements for each file. Pages that are already in the
+    journal are skipped.
+    """
+    args = run.args
+    summary = run.summary
+    tags = set(args.tag)
+    tags.add(run.batch_name)
+    done = 0
+    for chunk in batched(pages, args.chunk_size):
+        existing = [p for p in chunk if p.exists()]
+        versions = {p.pageid: p.latest_revision_id for p in existing}
+        try:
+            added = run.journal.add_prepared_declarations(
+                tags,
+                list(versions.items())
+            )
+        except Exception:
+            logger.exception("Error while preparing files.")
+            print("ERROR")
+            run.journal.rollback_session()
+            for page in chunk:
+                summary.add(page.title(), FAILED)
+            if args.quit_on_error:
+                run.stopped = True
                 break
 
+            continue
+
+        for page in chunk:
+            if page.exists() and page.pageid in added:
+                summary.add(page.title(), PREPARED)
+            else:
+                summary.add(page.title(), SKIPPED)
+        done += len(chunk)
+        print(f"Prepared {len(added)} of {len(chunk)} files, {done} done")
+
+
+def uses_pipeline(args: Namespace) -> bool:
+    return bool(
+        args.pipeline
+        or args.iscc
+        or args.async_requests
+        or args.target_rate
+    )
+
+
+def run_pages(pages: Iterable[Page], run: Run):
+    args = run.args
+    if args.prepare and not args.snapshot:
+        prepare_pages(pages, run)
+        return
+
+    if uses_pipeline(args):
+        run_pipeline(pages, run)
+    else:
+        run_serial(pages, run)
+
+
+class PagesFromIds:
+    """Pages for page IDs, fetched from Commons when iterated over
+
+    The IDs can be used without fetching the pages.
+    """
+
+    def __init__(self, page_ids: Iterable[int], site: BaseSite):
+        self.page_ids = page_ids
+        self._site = site
+
+    def __iter__(self) -> Iterator[Page]:
+        return PreloadingGenerator(
+            PagesFromPageidGenerator(self.page_ids, self._site)
+        )
+
+
+def pages_from_ids(page_ids: Iterable[int], site: BaseSite) -> Iterable[Page]:
+    return PagesFromIds(page_ids, site)
+
+
+def make_journal_filter(
+    args: Namespace,
+    journal: DeclarationJournal
+) -> JournalFilter | None:
+    """Make a filter for pages that would be skipped, if any would be"""
+    if args.plan or (args.update and not args.prepare):
+        # The plan counts the pages that would be skipped.
+        return None
+
+    return JournalFilter(journal, args.prepare, args.snapshot)
+
+
+def filter_page_ids(page_ids: list[int], run: Run) -> list[int]:
+    journal_filter = make_journal_filter(run.args, run.journal)
+    if journal_filter is None:
+        return page_ids
+
+    page_ids = list(journal_filter.page_ids(page_ids))
+    run.summary.files_filtered += journal_filter.skipped
+    return page_ids
+
+
+def run_batches(batches: dict[str, Iterable[Page]], run: Run):
+    """Process pages from several batches, each tagged with its batch"""
+    for batch_name, pages in batches.items():
+        run.batch_name = batch_name
+        run_pages(pages, run)
+        if run.stopped:
+            break
+
+
+def run_queue_worker(work_queue: WorkQueue, run: Run):
+    """Process chunks from a work queue until it's empty"""
+    for chunk in work_queue.chunks():
+        run.batch_name = chunk.batch
+        page_ids = filter_page_ids(chunk.get_page_ids(), run)
+        run_pages(pages_from_ids(page_ids, run.site), run)
+        if run.stopped:
+            break
+
+    status = ", ".join(f"{v} {k}" for k, v in work_queue.status().items())
+    print(f"Queue '{work_queue.name}': {status}.")
+
+
+def handle_work_request(
+    request: WorkRequest,
+    on_result: Callable[[str, str], None],
+    run: Run
+) -> dict:
+    """Process the files in a request to the service with a warm run"""
+    site = run.site
+    if request.titles:
+        pages = PreloadingGenerator(PagesFromTitlesGenerator(request.titles, site))
+        batch_name = "batch:service"
+    elif request.page_ids:
+        pages = pages_from_ids(request.page_ids, site)
+        batch_name = "batch:service"
+    else:
+        if not run.journal.tag_exists(request.tag):
+            raise ValueError(f"No such tag in journal: '{request.tag}'.")
+
+        declarations = run.journal.get_declarations(
+            request.tag,
+            only_not_declared=not run.args.update
+        )
+        pages = pages_from_ids([d.page_id for d in declarations], site)
+        batch_name = request.tag
+
+    run.batch_name = request.batch or batch_name
+    limit = request.limit or run.args.limit
+    run.summary = RunSummary(limit, on_result, run.summary.outcome_log)
+    run.quota = Quota(limit)
+    run.stopped = False
+    run_pages(pages, run)
+    return run.summary.to_dict()
+
+
+def make_input_checkpoint(
+    journal_url: str,
+    name: str,
+    to_text: Callable[[Any], str] = str
+) -> InputCheckpoint:
+    # The position is saved from the thread reading the input and the
+    # one getting results, so it gets its own session.
+    journal = create_journal(journal_url)
+    return InputCheckpoint(
+        lambda position: journal.save_checkpoint(name, to_text(position))
+    )
+
+
+def configure_logging(verbose: bool):
+    log_level = logging.DEBUG if verbose else logging.INFO
+    logging.basicConfig(
+        level=log_level,
+        format="{asctime};{name};{levelname};{message}",
+        style="{"
+    )
+
+
+def make_run(
+    args: Namespace,
+    journal: DeclarationJournal,
+    site: BaseSite,
+    batch_name: str,
+    number_of_files: int | None = None,
+    quota: Quota | None = None
+) -> Run:
+    """Set up connectors and workers for a run from arguments and environment"""
+    api_endpoint = get_os_env("API_ENDPOINT")
+    api_key = get_os_env("API_KEY")
+    raw_api_key = get_os_env("RAW_API_KEY", True)
+    member_credentials_path = get_os_env("MEMBER_CREDENTIALS_FILE")
+    private_key_path = get_os_env("PRIVATE_KEY_FILE")
+    public_key_path = get_os_env("PUBLIC_KEY_FILE")
+    tsa_url = get_os_env("TSA_URL")
+    tsa_skip_verify = bool(get_os_env("TSA_SKIP_VERIFY", True))
+
+    if tsa_skip_verify:
+        urllib3.disable_warnings()
+    rate_limiter = None
+    if args.rate_limit:
+        if args.rate_limit_file:
+            bucket = FileBucket(args.rate_limit_file)
+        else:
+            bucket = MemoryBucket()
+        rate_limiter = RateLimiter(1 / args.rate_limit, args.rate_burst, bucket)
+    registry_limiter = None
+    tsa_limiter = None
+    file_fetcher = FileFetcher()
+    if args.adaptive_concurrency:
+        max_requests = args.async_requests or args.request_workers
+        registry_limiter = AdaptiveConcurrencyLimiter("registry", max_requests)
+        # Each declaration makes two requests to the TSA.
+        tsa_limiter = AdaptiveConcurrencyLimiter("TSA", max_requests * 2)
+        file_fetcher = FileFetcher(
+            AdaptiveConcurrencyLimiter("download", args.download_workers)
+        )
+    circuit_breaker = None
+    if args.circuit_breaker:
+        circuit_breaker = CircuitBreaker(
+            "Registry and TSA",
+            args.circuit_breaker,
+            args.circuit_reset_time
+        )
+    api_connector = DeclarationApiConnector(
+        args.dry,
+        api_endpoint,
+        api_key,
+        raw_api_key,
+        member_credentials_path,
+        private_key_path,
+        public_key_path,
+        tsa_url,
+        tsa_skip_verify,
+        rate_limiter,
+        registry_limiter,
+        tsa_limiter,
+        circuit_breaker
+    )
+    outcome_log = None
+    if args.outcome_log:
+        outcome_log = OutcomeLog(args.outcome_log)
+    iscc_processes = args.iscc_processes
+    if args.iscc and iscc_processes is None:
+        # Use all cores when only generating ISCC, split between the
+        # worker processes if there are any.
+        iscc_processes = max(1, (os.cpu_count() or 1) // (args.processes or 1))
+    run = Run(
+        args,
+        journal,
+        api_connector,
+        site,
+        batch_name,
+        RunSummary(args.limit, outcome_log=outcome_log),
+        number_of_files,
+        file_fetcher=file_fetcher,
+        quota=quota or Quota(args.limit),
+        failures=FailureQueue(journal),
+        circuit_breaker=circuit_breaker
+    )
+    if iscc_processes:
+        run.iscc_pool = IsccWorkerPool(iscc_processes, args.recycle_iscc_workers)
+    if args.async_requests:
+        run.async_connector = AsyncDeclarationApiConnector(
+            api_connector,
+            args.async_requests
+        )
+    return run
+
+
+def close_run(run: Run):
+    if run.failures is not None:
+        try:
+            run.failures.flush()
+        except Exception:
+            logger.exception("Couldn't remove failures for declared files.")
+    if run.summary.outcome_log is not None:
+        run.summary.outcome_log.close()
+    if run.iscc_pool is not None:
+        run.iscc_pool.close()
+    if run.async_connector is not None:
+        run.async_connector.close()
+
+
+def make_work_queue(name: str, journal_url: str, lease_time: float) -> WorkQueue:
+    # The queue gets its own session since leases are renewed from
+    # another thread.
+    return WorkQueue(
+        create_journal(journal_url),
+        name,
+        timedelta(minutes=lease_time)
+    )
+
+
+def make_plan(
+    args: Namespace,
+    journal: DeclarationJournal,
+    batch_names: Iterable[str]
+) -> RunPlan:
+    """Set up a plan for a run from arguments and earlier runs
+
+    The stage times are from earlier files with the same tags and batch
+    names. The workers and rate limit are the ones the run would use.
+    """
+    if args.prepare and not args.snapshot:
+        # Only the page and revision IDs are added.
+        stages = []
+    elif args.from_snapshot:
+        stages = ["request"]
+    elif args.iscc:
+        stages = ["download", "iscc"]
+    elif args.prepare:
+        stages = ["download", "iscc", "metadata"]
+    else:
+        stages = list(STAGE_TIME_COLUMNS)
+    tags = set(args.tag)
+    tags.update(batch_names)
+    plan = RunPlan(
+        get_stage_times(journal, stages, tags),
+        processes=args.processes or 1,
+        pooled=bool(args.target_rate)
+    )
+    if uses_pipeline(args):
+        iscc_workers = args.iscc_workers
+        iscc_processes = args.iscc_processes
+        if args.iscc and iscc_processes is None:
+            iscc_processes = max(1, (os.cpu_count() or 1) // plan.processes)
+        if iscc_processes:
+            iscc_workers = max(iscc_workers, iscc_processes)
+        plan.workers = {
+            "download": args.download_workers,
+            "iscc": iscc_workers,
+            "metadata": args.metadata_workers,
+            "request": args.async_requests or args.request_workers
+        }
+    if "request" in stages:
+        plan.limit = args.limit
+        if args.rate_limit:
+            plan.request_rate = 1 / args.rate_limit
+    return plan
+
+
+def run_worker_process(
+    args: Namespace,
+    quota: Quota,
+    page_chunks: Any,
+    results: Any,
+    stop: Any
+):
+    """Process chunks of page IDs from the coordinator
+
+    Runs in a worker process started by run_processes(), with its own
+    site, journal session and connectors. Takes chunks, with the batch
+    they're in, until it gets None. If `page_chunks` is None, chunks are
+    taken from the work queue given as input instead. The summary is
+    sent back through `results`.
+    """
+    configure_logging(args.verbose)
+    load_dotenv()
+    journal_url = get_os_env("DECLARATION_JOURNAL_URL")
+    site = Site("commons")
+    # Batch names are set from each chunk.
+    run = make_run(args, create_journal(journal_url), site, "", quota=quota)
+    try:
+        if page_chunks is None:
+            work_queue = make_work_queue(
+                args.files.removeprefix(QUEUE_PREFIX),
+                journal_url,
+                args.lease_time
+            )
+            run_queue_worker(work_queue, run)
+        else:
+            for batch_name, page_ids in iter(page_chunks.get, None):
+                if run.stopped or stop.is_set():
+                    # Keep taking chunks until None so the coordinator
+                    # doesn't block.
+                    continue
+
+                run.batch_name = batch_name
+                run_pages(pages_from_ids(page_ids, site), run)
+    finally:
+        if run.stopped:
+            stop.set()
+        close_run(run)
+        results.put(run.summary)
+
+
+def _any_alive(workers: list) -> bool:
+    return any(w.is_alive() for w in workers)
+
+
+def _put_chunk(
+    page_chunks: Any,
+    chunk: tuple[str, list[int]] | None,
+    workers: list
+) -> bool:
+    """Put a chunk for the workers unless they have all died"""
+    while True:
+        try:
+            page_chunks.put(chunk, timeout=1)
+            return True
+        except queue.Full:
+            if not _any_alive(workers):
+                return False
+
+
+def _put_batches(
+    batches: dict[str, Iterable[Page]],
+    page_chunks: Any,
+    workers: list,
+    chunk_size: int,
+    stop: Any,
+    quota: Quota
+):
+    """Put the page IDs for the workers in chunks, until stopped"""
+    for batch_name, pages in batches.items():
+        if isinstance(pages, PagesFromIds):
+            # E.g. from a tag, no need to fetch pages to get the IDs.
+            page_ids = pages.page_ids
+        else:
+            page_ids = (p.pageid for p in pages)
+        for chunk in batched(page_ids, chunk_size):
+            if stop.is_set() or quota.reached():
+                return
+
+            if not _put_chunk(page_chunks, (batch_name, list(chunk)), workers):
+                logger.error("All worker processes have stopped.")
+                return
+
+
+def run_processes(
+    batches: dict[str, Iterable[Page]],
+    args: Namespace
+) -> tuple[RunSummary, bool, bool]:
+    """Hand out pages to worker processes
+
+    The input is read once, here, and the page IDs are put on a queue
+    in chunks with their batch name. Returns the summaries of the workers merged into one,
+    whether all workers exited cleanly and whether the run was stopped
+    before all input was processed.
+    """
+    # Spawn rather than fork since pywikibot and the journal may have
+    # threads and connections open.
+    context = multiprocessing.get_context("spawn")
+    quota = Quota(args.limit, context)
+    from_queue = args.files is not None and args.files.startswith(QUEUE_PREFIX)
+    page_chunks = None if from_queue else context.Queue(args.processes * 2)
+    results = context.Queue()
+    stop = context.Event()
+    rate_limit_file = None
+    if args.rate_limit and not args.rate_limit_file:
+        # The rate limit is for the whole run, so the workers share it.
+        handle, rate_limit_file = mkstemp(".json", "rate-limit-", "tmp")
+        os.close(handle)
+        args.rate_limit_file = rate_limit_file
+
+    logger.info(f"Starting {args.processes} worker processes.")
+    workers = [
+        context.Process(
+            target=run_worker_process,
+            args=(args, quota, page_chunks, results, stop),
+            name=f"worker-{n}"
+        )
+        for n in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        if page_chunks is not None:
+            _put_batches(batches, page_chunks, workers, args.chunk_size, stop, quota)
+    finally:
+        if page_chunks is not None:
+            for _ in workers:
+                _put_chunk(page_chunks, None, workers)
+
+        summary = RunSummary(args.limit)
+        received = 0
+        while received < len(workers):
+            try:
+                summary.merge(results.get(timeout=1))
+                received += 1
+            except queue.Empty:
+                if not _any_alive(workers):
+                    break
+
+        for worker in workers:
+            worker.join()
+        if rate_limit_file is not None:
+            os.remove(rate_limit_file)
+
+    failed = [w.name for w in workers if w.exitcode != 0]
+    if failed:
+        logger.error(f"Worker processes exited with errors: {', '.join(failed)}.")
+    return summary, not failed, stop.is_set()
+
+
+if __name__ == "__main__":
+    args = make_arguments()
+    configure_logging(args.verbose)
+
+    load_dotenv()
+    declaration_journal_url = get_os_env("DECLARATION_JOURNAL_URL")
+    declaration_journal = create_journal(declaration_journal_url)
+    site = Site("commons")
+    if args.find_stale:
+        if args.files and not declaration_journal.tag_exists(args.files):
+            raise Exception(f"No such tag in journal: '{args.files}'.")
+
+        scanner = StalenessScanner(declaration_journal, site)
+        result = scanner.scan(args.files)
+        print(f"{result.scanned} declarations compared.")
+        print(f"{result.stale} stale, tagged '{scanner.stale_tag}'.")
+        print(f"{result.missing} missing, tagged '{scanner.missing_tag}'.")
+        sys.exit(0)
+
+    if args.serve:
+        run = make_run(args, declaration_journal, site, "")
+        service = DeclarationService(
+            args.serve,
+            lambda request, on_result: handle_work_request(
+                request,
+                on_result,
+                run
+            )
+        )
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Stopping service.")
+        finally:
+            close_run(run)
+        sys.exit(0)
+
+    work_queue = None
+    input_checkpoint = None
+    journal_filter = None
+    # Batch name -> pages, when the input has more than one batch.
+    batches = None
+    if args.retry_failed:
+        # Files are tried again in the batch they failed in.
+        retry_page_ids = {}
+        due = FailureQueue(declaration_journal).due_batches()
+        for batch, page_ids in due.items():
+            if args.shard:
+                page_ids = [i for i in page_ids if args.shard.contains(i)]
+            if page_ids:
+                # Failures saved before they had batches.
+                batch = batch or "batch:retry"
+                retry_page_ids.setdefault(batch, []).extend(page_ids)
+        number_of_files = sum(len(i) for i in retry_page_ids.values())
+        logger.info(f"{number_of_files} failed files are due to be tried again.")
+        batches = {
+            batch: pages_from_ids(page_ids, site)
+            for batch, page_ids in retry_page_ids.items()
+        }
+        pages = chain.from_iterable(batches.values())
+        batch_name = "batch:retry"
+    elif args.from_snapshot:
+        if not declaration_journal.tag_exists(args.files):
+            raise Exception(f"No such tag in journal: '{args.files}'.")
+
+        snapshots = declaration_journal.get_snapshots(args.files)
+        pages = [SnapshotPage(d) for d in snapshots]
+        number_of_files = len(pages)
+        batch_name = args.files
+    elif args.files.startswith(QUEUE_PREFIX):
+        work_queue = make_work_queue(
+            args.files.removeprefix(QUEUE_PREFIX),
+            declaration_journal_url,
+            args.lease_time
+        )
+        pages = []
+        number_of_files = None
+        # Batch names are set from each chunk.
+        batch_name = ""
+    elif args.files.startswith(STREAM_PREFIX):
+        if args.processes:
+            raise Exception("An event stream can't be used with --processes.")
+
+        stream_source = args.files.removeprefix(STREAM_PREFIX)
+        checkpoint_name = f"stream:{stream_source}"
+        input_checkpoint = make_input_checkpoint(
+            declaration_journal_url,
+            checkpoint_name
+        )
+        last_event_id = declaration_journal.get_checkpoint(checkpoint_name)
+        if last_event_id is not None:
+            logger.info(f"Continuing stream after event: '{last_event_id}'.")
+        pages = upload_pages(
+            read_events(stream_source, last_event_id),
+            input_checkpoint,
+            site,
+            args.shard
+        )
+        number_of_files = None
+        batch_name = "batch:stream"
+    elif args.files.startswith(CHANGED_PREFIX):
+        since = (
+            args.files.removeprefix(CHANGED_PREFIX)
+            or declaration_journal.get_checkpoint(CHANGED_CHECKPOINT)
+        )
+        if not since:
+            raise Exception(
+                "No earlier run to look for changes since. Give a time the "
+                "first time, e.g. 'Changed:2026-01-01T00:00:00Z'."
+            )
+
+        changed_since = pywikibot.Timestamp.fromISOformat(since)
+        changed_until = pywikibot.Timestamp.nowutc()
+        logger.info(f"Looking for files changed since {changed_since}.")
+        pages = get_changed_pages(
+            site,
+            declaration_journal,
+            changed_since,
+            changed_until
+        )
+        # The changed files are all in the journal.
+        args.update = True
+        number_of_files = None
+        batch_name = "batch:changed"
+    else:
+        position = None
+        resumable = (
+            os.path.exists(args.files) or args.files.startswith("Category:")
+        )
+        if resumable and not (args.processes or args.fill_queue or args.sample):
+            checkpoint_name = f"input:{args.files}"
+            if args.shard:
+                checkpoint_name += f":{args.shard}"
+            if not args.plan:
+                # Planning doesn't move the checkpoint.
+                input_checkpoint = make_input_checkpoint(
+                    declaration_journal_url,
+                    checkpoint_name,
+                    json.dumps
+                )
+            saved_position = declaration_journal.get_checkpoint(checkpoint_name)
+            if args.resume:
+                if saved_position is None:
+                    logger.warning("No checkpoint to resume from.")
+                else:
+                    position = json.loads(saved_position)
+        # The pages may be read from another thread than the one using
+        # the journal, so the filter gets its own session.
+        journal_filter = make_journal_filter(
+            args,
+            create_journal(declaration_journal_url)
+        )
+        pages, number_of_files, batch_name = get_pages(
+            args,
+            declaration_journal,
+            site,
+            input_checkpoint,
+            position,
+            journal_filter
+        )
+    if batches is None:
+        batches = {batch_name: pages}
+
+    if args.plan:
+        plan = make_plan(args, declaration_journal, list(batches))
+        plan.add_pages(
+            pages,
+            declaration_journal,
+            args.prepare,
+            args.update,
+            snapshot=args.snapshot
+        )
+        plan.print()
+        sys.exit(0)
+
+    if args.fill_queue:
+        work_queue = WorkQueue(declaration_journal, args.fill_queue)
+        number_of_chunks = 0
+        for name, batch_pages in batches.items():
+            number_of_chunks += work_queue.fill(
+                name,
+                (p.pageid for p in batch_pages),
+                args.chunk_size
+            )
+        print(f"Added {number_of_chunks} chunks to queue '{args.fill_queue}'.")
+        if journal_filter is not None and journal_filter.skipped:
+            print(
+                f"{journal_filter.skipped} files left out since they're in "
+                "the journal."
+            )
+        sys.exit(0)
+
+    start_total_time = time()
+    timestamp = datetime.now().astimezone().replace(microsecond=0).isoformat()
+    breaking_error = False
+    print(f"START: {timestamp}")
+    if args.shard:
+        print(f"Processing shard {args.shard}.")
+    if number_of_files:
+        print(f"Processing {number_of_files} files.")
+    if args.processes:
+        summary, workers_ok, stopped = run_processes(batches, args)
+        breaking_error = not workers_ok
+    else:
+        run = make_run(
+            args,
+            declaration_journal,
+            site,
+            batch_name,
+            number_of_files
+        )
+        if input_checkpoint is not None:
+            def finish_input_file(title: str, result: str):
+                # Cancelled files are processed again when the input is
+                # continued.
+                if result != CANCELLED:
+                    input_checkpoint.done(title)
+
+            run.summary = RunSummary(
+                args.limit,
+                finish_input_file,
+                run.summary.outcome_log
+            )
+        try:
+            if work_queue is not None:
+                run_queue_worker(work_queue, run)
+            else:
+                run_batches(batches, run)
+        finally:
+            close_run(run)
+            if input_checkpoint is not None:
+                input_checkpoint.save()
+        summary = run.summary
+        stopped = run.stopped
+
+    if args.files is not None and args.files.startswith(CHANGED_PREFIX):
+        save_changed_checkpoint(
+            declaration_journal,
+            changed_since,
+            changed_until,
+            stopped or breaking_error,
+            summary.files_failed
+        )
+
+    if journal_filter is not None:
+        summary.files_filtered += journal_filter.skipped
     print(f"Total time: {time() - start_total_time:.2f}")
-    print(f"{files_declared} files declared.")
-    if skipped_files:
-        print(f"{len(skipped_files)} files skipped:")
-        print("\n".join(skipped_files))
-    if error_files:
-        print(f"{len(error_files)} requests failed. See log for details:")
-        print("\n".join(error_files))
+    summary.print()
     timestamp = datetime.now().astimezone().replace(microsecond=0).isoformat()
     print(f"DONE: {timestamp}")
 
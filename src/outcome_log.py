@@ -0,0 +1,66 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from time import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class OutcomeLog:
+    """Append-only file with the result for each file, one JSON per line
+
+    Lines are written and synced to disk in batches, every `batch_size`
+    lines or `sync_interval` seconds, whichever comes first, rather than
+    for each file. A batch is written with a single write to a file
+    opened for appending, so several processes can use the same file
+    without mixing up lines.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 100,
+        sync_interval: float = 5,
+        clock: Callable[[], float] = time
+    ):
+        self.path = path
+        self._batch_size = batch_size
+        self._sync_interval = sync_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._lines: list[str] = []
+        self._synced_time = clock()
+
+    def add(self, title: str, result: str):
+        line = json.dumps({
+            "time": datetime.now().astimezone().isoformat(),
+            "title": title,
+            "result": result
+        })
+        with self._lock:
+            self._lines.append(line + "\n")
+            due = self._clock() - self._synced_time >= self._sync_interval
+            if due or len(self._lines) >= self._batch_size:
+                self._sync()
+
+    def _sync(self):
+        self._synced_time = self._clock()
+        if not self._lines:
+            return
+
+        os.write(self._fd, "".join(self._lines).encode())
+        os.fsync(self._fd)
+        self._lines = []
+
+    def close(self):
+        with self._lock:
+            if self._fd is None:
+                return
+
+            self._sync()
+            os.close(self._fd)
+            self._fd = None
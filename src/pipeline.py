@@ -0,0 +1,350 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from functools import partial
+from time import time
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Put in a stage queue to make one of its workers quit.
+_QUIT = object()
+
+
+@dataclass
+class PipelineResult:
+    item: Any
+    # None if the item was cancelled before reaching the end.
+    result: str | None
+    error: Exception | None = None
+
+
+class Stage:
+    """A step in the pipeline with its own pool of worker threads
+
+    `function` is called with a work item. If it returns None the item
+    moves on to the next stage, otherwise the returned value is the
+    result for the item and it leaves the pipeline. It may also return a
+    Future of that value, in which case the worker moves on to the next
+    item without waiting for it. Stages that share a lock never run at
+    the same time, which is used to serialise access to things that
+    aren't thread safe, like the journal session.
+
+    `max_workers` threads are started, but only `workers` of them work
+    at the same time. The number can be changed while running with
+    set_workers().
+
+    Items reaching a stage after the pipeline has been stopped are
+    cancelled, unless the stage isn't `cancellable`. That's used for
+    stages that save the outcome of work that can't be undone.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function: Callable[[Any], str | None | Future],
+        workers: int = 1,
+        lock: Optional[threading.Lock] = None,
+        max_workers: int | None = None,
+        cancellable: bool = True
+    ):
+        if workers < 1:
+            raise ValueError(f"Stage '{name}' needs at least one worker.")
+
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.max_workers = max(workers, max_workers or workers)
+        self.lock = lock
+        self.cancellable = cancellable
+        self._condition = threading.Condition()
+        self._active = 0
+        self._processed = 0
+        self._busy_time = 0.0
+
+    def set_workers(self, workers: int):
+        with self._condition:
+            self.workers = max(1, min(workers, self.max_workers))
+            self._condition.notify_all()
+
+    def stats(self) -> tuple[int, float]:
+        """Get number of items processed and total time spent on them"""
+        with self._condition:
+            return self._processed, self._busy_time
+
+    def run(self, item: Any) -> str | None | Future:
+        with self._condition:
+            while self._active >= self.workers:
+                self._condition.wait()
+            self._active += 1
+
+        start_time = time()
+        is_future = False
+        try:
+            if self.lock is None:
+                result = self.function(item)
+            else:
+                with self.lock:
+                    result = self.function(item)
+
+            if isinstance(result, Future):
+                is_future = True
+                result.add_done_callback(
+                    lambda f: self._record(time() - start_time)
+                )
+            return result
+        finally:
+            if not is_future:
+                self._record(time() - start_time)
+            with self._condition:
+                self._active -= 1
+                self._condition.notify()
+
+    def _record(self, duration: float):
+        with self._condition:
+            self._processed += 1
+            self._busy_time += duration
+
+
+class _Count:
+    def __init__(self):
+        self.value = 0
+
+
+class Quota:
+    """Thread safe cap on how many items may be committed
+
+    Items acquire a slot before doing the work that counts towards the
+    quota and then either commit or release it. Acquiring blocks while
+    all free slots are held by items that haven't finished yet, so the
+    quota is never overshot and a failed item leaves room for the next.
+
+    Given a multiprocessing context the quota is also shared with
+    processes started from that context, when passed to them as an
+    argument.
+    """
+
+    def __init__(self, limit: int | None, context: Any = None):
+        self._limit = limit
+        if context is None:
+            self._committed = _Count()
+            self._in_flight = _Count()
+            self._condition = threading.Condition()
+        else:
+            self._committed = context.Value("i", 0, lock=False)
+            self._in_flight = context.Value("i", 0, lock=False)
+            self._condition = context.Condition()
+
+    def acquire(self) -> bool:
+        if self._limit is None:
+            return True
+
+        with self._condition:
+            while self._committed.value + self._in_flight.value >= self._limit:
+                if self._committed.value >= self._limit:
+                    return False
+
+                self._condition.wait()
+
+            self._in_flight.value += 1
+            return True
+
+    def commit(self):
+        if self._limit is None:
+            return
+
+        with self._condition:
+            self._in_flight.value -= 1
+            self._committed.value += 1
+            self._condition.notify_all()
+
+    def release(self):
+        if self._limit is None:
+            return
+
+        with self._condition:
+            self._in_flight.value -= 1
+            self._condition.notify_all()
+
+    def reached(self) -> bool:
+        """Check if the limit has been committed"""
+        if self._limit is None:
+            return False
+
+        with self._condition:
+            return self._committed.value >= self._limit
+
+
+class Pipeline:
+    """Runs items through stages concurrently
+
+    There is a bounded queue in front of each stage. When a queue is
+    full the stage before it blocks, which keeps memory use flat and
+    stops fast stages from running far ahead of slow ones.
+    """
+
+    def __init__(self, stages: list[Stage], queue_size: int = 10):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage.")
+
+        self.stages = stages
+        # Number of items that have left the pipeline.
+        self.finished = 0
+        self._queue_size = queue_size
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """Stop feeding new items
+
+        Items already in the pipeline are cancelled, i.e. they are
+        returned with the result None as soon as they reach a stage that
+        is cancellable.
+        """
+        self._stopped.set()
+
+    def run(self, items: Iterable) -> Iterator[PipelineResult]:
+        queues = [queue.Queue(self._queue_size) for _ in self.stages]
+        # Items with finished futures, for each stage.
+        done_queues = [queue.Queue() for _ in self.stages]
+        results = queue.Queue()
+        # Set by the feeder when it's done: number of items fed and the
+        # error that stopped it, if any.
+        fed = []
+        threads = [threading.Thread(
+            target=self._feed,
+            args=(items, queues[0], results, fed),
+            name="pipeline-feeder",
+            daemon=True
+        )]
+        for i, stage in enumerate(self.stages):
+            next_queue = queues[i + 1] if i + 1 < len(queues) else None
+            for n in range(stage.max_workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[i], done_queues[i], next_queue, results),
+                    name=f"pipeline-{stage.name}-{n}",
+                    daemon=True
+                ))
+            threads.append(threading.Thread(
+                target=self._forward_futures,
+                args=(done_queues[i], next_queue, results),
+                name=f"pipeline-{stage.name}-futures",
+                daemon=True
+            ))
+        for thread in threads:
+            thread.start()
+
+        received = 0
+        try:
+            while not fed or received < fed[0]:
+                result = results.get()
+                if result is None:
+                    # The feeder is done and `fed` is set.
+                    continue
+
+                received += 1
+                self.finished += 1
+                yield result
+
+            feed_error = fed[1]
+            if feed_error is not None:
+                raise feed_error
+        finally:
+            self.stop()
+            for stage, stage_queue in zip(self.stages, queues):
+                for _ in range(stage.max_workers):
+                    stage_queue.put(_QUIT)
+            for done_queue in done_queues:
+                done_queue.put(_QUIT)
+
+    def _feed(
+        self,
+        items: Iterable,
+        first_queue: queue.Queue,
+        results: queue.Queue,
+        fed: list
+    ):
+        count = 0
+        error = None
+        try:
+            for item in items:
+                if self._stopped.is_set():
+                    break
+
+                first_queue.put(item)
+                count += 1
+        except Exception as e:
+            error = e
+        finally:
+            fed.extend([count, error])
+            # Wake up the reader in case it's waiting for results.
+            results.put(None)
+
+    def _work(
+        self,
+        stage: Stage,
+        in_queue: queue.Queue,
+        done_queue: queue.Queue,
+        next_queue: queue.Queue | None,
+        results: queue.Queue
+    ):
+        while True:
+            item = in_queue.get()
+            if item is _QUIT:
+                return
+
+            if self._stopped.is_set() and stage.cancellable:
+                results.put(PipelineResult(item, None))
+                continue
+
+            try:
+                result = stage.run(item)
+            except Exception as e:
+                results.put(PipelineResult(item, None, e))
+                continue
+
+            if isinstance(result, Future):
+                # The callback runs on the thread that finishes the
+                # future, e.g. an event loop, which mustn't block on a
+                # full queue. The item is forwarded by another thread.
+                result.add_done_callback(partial(_put_done, done_queue, item))
+            else:
+                self._forward(item, result, next_queue, results)
+
+    def _forward_futures(
+        self,
+        done_queue: queue.Queue,
+        next_queue: queue.Queue | None,
+        results: queue.Queue
+    ):
+        while True:
+            done = done_queue.get()
+            if done is _QUIT:
+                return
+
+            item, future = done
+            try:
+                result = future.result()
+            except Exception as e:
+                results.put(PipelineResult(item, None, e))
+                continue
+
+            self._forward(item, result, next_queue, results)
+
+    def _forward(
+        self,
+        item: Any,
+        result: str | None,
+        next_queue: queue.Queue | None,
+        results: queue.Queue
+    ):
+        if result is not None or next_queue is None:
+            results.put(PipelineResult(item, result))
+        else:
+            next_queue.put(item)
+
+
+def _put_done(done_queue: queue.Queue, item: Any, future: Future):
+    done_queue.put((item, future))
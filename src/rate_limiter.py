@@ -0,0 +1,151 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from collections import deque
+from time import sleep, time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBucket:
+    """Token bucket state shared by threads in one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: float | None = None
+        self._updated: float | None = None
+
+    def take(self, rate: float, burst: int, now: float) -> float:
+        with self._lock:
+            self._tokens, self._updated, wait_time = take_token(
+                self._tokens,
+                self._updated,
+                rate,
+                burst,
+                now
+            )
+            return wait_time
+
+
+class FileBucket:
+    """Token bucket state shared by processes on one host
+
+    The state is kept in a file that is locked while it's updated.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        # Threads in this process also need to take turns since flock()
+        # locks are per file descriptor.
+        self._lock = threading.Lock()
+
+    def take(self, rate: float, burst: int, now: float) -> float:
+        with self._lock, open(self._path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                state = json.loads(content) if content else {}
+                tokens, updated, wait_time = take_token(
+                    state.get("tokens"),
+                    state.get("updated"),
+                    rate,
+                    burst,
+                    now
+                )
+                f.seek(0)
+                f.truncate()
+                json.dump({"tokens": tokens, "updated": updated}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        return wait_time
+
+
+def take_token(
+    tokens: float | None,
+    updated: float | None,
+    rate: float,
+    burst: int,
+    now: float
+) -> tuple[float, float, float]:
+    """Take a token from a bucket
+
+    Returns the new number of tokens, the time they were counted at and
+    how long to wait before using the token. If the bucket is empty the
+    token is borrowed, i.e. the number of tokens goes below zero. This
+    way callers that wait are served in the order they came and no one
+    has to check the bucket again.
+    """
+    if tokens is None or updated is None:
+        tokens = burst
+        updated = now
+
+    tokens = min(burst, tokens + (now - updated) * rate)
+    tokens -= 1
+    wait_time = max(0.0, -tokens / rate)
+    return tokens, now, wait_time
+
+
+class RateLimiter:
+    """Token bucket rate limiter
+
+    Allows `rate` requests per second on average and up to `burst`
+    requests at once after a pause. The bucket can be shared between
+    processes by giving a FileBucket.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        bucket: MemoryBucket | FileBucket | None = None,
+        clock: Callable[[], float] = time,
+        wait: Callable[[float], None] = sleep
+    ):
+        if rate <= 0:
+            raise ValueError("Rate must be positive.")
+        if burst < 1:
+            raise ValueError("Burst must be at least one.")
+
+        self._rate = rate
+        self._burst = burst
+        self._bucket = bucket or MemoryBucket()
+        self._clock = clock
+        self._wait = wait
+        self._lock = threading.Lock()
+        # Times of recent requests in this process, to report the rate.
+        self._request_times = deque()
+
+    def acquire(self):
+        """Wait until a request may be made"""
+        wait_time = self._bucket.take(self._rate, self._burst, self._clock())
+        if wait_time > 0:
+            logger.debug(f"Waiting {wait_time:.3f} seconds for rate limit.")
+            self._wait(wait_time)
+
+        self._log_rate()
+
+    def _log_rate(self, window: float = 60):
+        now = self._clock()
+        with self._lock:
+            self._request_times.append(now)
+            while self._request_times[0] < now - window:
+                self._request_times.popleft()
+
+            first = self._request_times[0]
+            count = len(self._request_times)
+
+        elapsed = now - first
+        if count < 2 or elapsed <= 0:
+            return
+
+        observed_rate = (count - 1) / elapsed
+        logger.info(
+            f"Request rate: {observed_rate:.2f}/s (target {self._rate:.2f}/s)."
+        )
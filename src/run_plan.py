@@ -0,0 +1,214 @@
+import logging
+from dataclasses import dataclass
+from itertools import batched
+from typing import Iterable
+
+from pywikibot.page import Page
+
+from declaration_journal import DeclarationJournal
+
+logger = logging.getLogger(__name__)
+
+# Stage -> journal column with the time it took for each file.
+STAGE_TIME_COLUMNS = {
+    "download": "download_time",
+    "iscc": "iscc_time",
+    "metadata": "metadata_time",
+    "request": "request_time"
+}
+
+
+@dataclass
+class StageTime:
+    # Number of earlier files the average is from.
+    files: int
+    seconds: float | None
+    # True if there were no earlier files with the tags, so the average
+    # is from all files in the journal.
+    all_tags: bool = False
+
+
+def get_stage_times(
+    journal: DeclarationJournal,
+    stages: list[str],
+    tag_labels: Iterable[str]
+) -> dict[str, StageTime]:
+    """Get the average time for stages from earlier runs
+
+    Declarations with any of the tags are used. For stages that no such
+    declaration has a time for, all declarations are used.
+    """
+    tagged = journal.get_average_times(tag_labels)
+    everything = None
+    stage_times = {}
+    for stage in stages:
+        column = STAGE_TIME_COLUMNS[stage]
+        files, seconds = tagged[column]
+        if files:
+            stage_times[stage] = StageTime(files, seconds)
+            continue
+
+        if everything is None:
+            everything = journal.get_average_times()
+        files, seconds = everything[column]
+        stage_times[stage] = StageTime(files, seconds, True)
+    return stage_times
+
+
+@dataclass
+class RunPlan:
+    """How many files a run would process and about how long it'd take
+
+    Files are counted as new, to update, to skip or missing on Commons.
+    The time is estimated from `stage_times`, the average time for each
+    stage that new and updated files go through. Without `workers` a
+    file goes through all stages before the next one starts. With
+    `workers` for each stage, files go through the stages at the same
+    time and the slowest stage sets the pace, unless the workers are
+    `pooled` and moved to the stages that need them. `processes` each
+    do this for their part of the files. Requests to the registry are
+    made at most `request_rate` per second, for all processes together.
+    """
+    stage_times: dict[str, StageTime]
+    workers: dict[str, int] | None = None
+    pooled: bool = False
+    processes: int = 1
+    request_rate: float | None = None
+    # Most number of declarations to make.
+    limit: int | None = None
+    new: int = 0
+    update: int = 0
+    skip: int = 0
+    missing: int = 0
+
+    def add_pages(
+        self,
+        pages: Iterable[Page],
+        journal: DeclarationJournal,
+        prepare: bool = False,
+        update: bool = False,
+        chunk_size: int = 500,
+        snapshot: bool = False
+    ):
+        """Count pages by what the run would do with them
+
+        Like process_file(), pages in the journal are skipped when
+        preparing, unless making a snapshot of ones that don't have
+        their metadata saved. Declared ones are skipped unless updating.
+        The pages are looked up in the journal in chunks.
+        """
+        for chunk in batched(pages, chunk_size):
+            existing = [p for p in chunk if p.exists()]
+            self.missing += len(chunk) - len(existing)
+            page_ids = [p.pageid for p in existing]
+            known = journal.get_known_page_ids(page_ids)
+            skipped = set()
+            if known and prepare:
+                skipped = known
+                if snapshot:
+                    skipped = journal.get_known_page_ids(
+                        page_ids,
+                        only_snapshotted=True
+                    )
+            elif known and not update:
+                skipped = journal.get_known_page_ids(page_ids, True)
+            for page_id in page_ids:
+                if page_id not in known:
+                    self.new += 1
+                elif page_id in skipped:
+                    self.skip += 1
+                else:
+                    self.update += 1
+            logger.debug(f"Planned {self.new + self.update + self.skip} files.")
+
+    @property
+    def files_to_process(self) -> int:
+        files = self.new + self.update
+        if self.limit is not None:
+            files = min(files, self.limit)
+        return files
+
+    def _stage_seconds(self) -> dict[str, float]:
+        return {
+            stage: time.seconds or 0.0
+            for stage, time in self.stage_times.items()
+        }
+
+    def file_time(self) -> tuple[float, str | None]:
+        """Get the seconds between files being done, once the run is going
+
+        Also returns what sets the pace: a stage, the request rate or
+        None if it's all stages together.
+        """
+        seconds = self._stage_seconds()
+        bottleneck = None
+        if not seconds:
+            time = 0.0
+        elif self.workers is None:
+            time = sum(seconds.values())
+        elif self.pooled:
+            workers = sum(self.workers[s] for s in seconds)
+            time = sum(seconds.values()) / workers
+        else:
+            bottleneck = max(seconds, key=lambda s: seconds[s] / self.workers[s])
+            time = seconds[bottleneck] / self.workers[bottleneck]
+        time /= self.processes
+        if self.request_rate and "request" in seconds:
+            if 1 / self.request_rate > time:
+                time = 1 / self.request_rate
+                bottleneck = "request rate"
+        return time, bottleneck
+
+    def duration(self) -> float:
+        """Get the estimated wall time of the run in seconds"""
+        return self.files_to_process * self.file_time()[0]
+
+    def report(self) -> list[str]:
+        lines = [
+            f"{self.new} new files, {self.update} to update, {self.skip} to "
+            f"skip and {self.missing} missing on Commons."
+        ]
+        if self.limit is not None and self.new + self.update > self.limit:
+            lines.append(f"Only {self.limit} will be declared, see --limit.")
+        seconds = self._stage_seconds()
+        total = sum(seconds.values())
+        for stage, time in self.stage_times.items():
+            if time.seconds is None:
+                lines.append(f"{stage}: no earlier files to estimate from.")
+                continue
+
+            share = seconds[stage] / total if total else 0
+            line = (
+                f"{stage}: {time.seconds:.2f} s per file ({share:.0%}), "
+                f"from {time.files} earlier files"
+            )
+            if time.all_tags:
+                line += " with any tags"
+            lines.append(line + ".")
+
+        file_time, bottleneck = self.file_time()
+        if file_time:
+            rate = 3600 / file_time
+            lines.append(
+                f"Estimated time: {format_duration(self.duration())} for "
+                f"{self.files_to_process} files, {rate:.0f} files per hour."
+            )
+        if bottleneck is not None:
+            lines.append(f"Limited by: {bottleneck}.")
+        return lines
+
+    def print(self):
+        for line in self.report():
+            print(line)
+
+
+def format_duration(seconds: float) -> str:
+    minutes = round(seconds / 60)
+    if minutes < 1:
+        return f"{seconds:.0f} s"
+
+    hours, minutes = divmod(minutes, 60)
+    if not hours:
+        return f"{minutes} min"
+
+    return f"{hours} h {minutes} min"
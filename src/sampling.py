@@ -0,0 +1,46 @@
+import random
+from itertools import islice
+from math import exp, floor, log
+from typing import Iterable, TypeVar
+
+T = TypeVar("T")
+
+# Marks the end of the items.
+_END = object()
+
+
+def reservoir_sample(
+    items: Iterable[T],
+    size: int,
+    rng: random.Random | None = None
+) -> list[T]:
+    """Pick a random sample of at most `size` items in one pass
+
+    Only the sample is kept in memory, so it works for input that is too
+    large to hold or whose length isn't known beforehand. Uses Algorithm
+    L, which jumps over the items that won't be picked rather than
+    drawing a random number for each of them.
+    """
+    rng = rng or random.Random()
+    items = iter(items)
+    reservoir = list(islice(items, size))
+    if len(reservoir) < size or size == 0:
+        return reservoir
+
+    weight = exp(log(_uniform(rng)) / size)
+    while True:
+        skip = floor(log(_uniform(rng)) / log(1 - weight))
+        item = next(islice(items, skip, None), _END)
+        if item is _END:
+            return reservoir
+
+        reservoir[rng.randrange(size)] = item
+        weight *= exp(log(_uniform(rng)) / size)
+
+
+def _uniform(rng: random.Random) -> float:
+    # Between 0 and 1, without either, so that it can be logged.
+    while True:
+        value = rng.random()
+        if value > 0:
+            return value
@@ -0,0 +1,36 @@
+import re
+import zlib
+
+
+class Shard:
+    """One of several equal parts of the input
+
+    Pages are assigned to shards by a hash of their page ID, or title
+    when the ID isn't known without asking Commons. The hash is stable
+    between runs and hosts.
+    """
+
+    def __init__(self, index: int, count: int):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"Invalid shard: {index}/{count}.")
+
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value: str) -> "Shard":
+        match = re.fullmatch(r"(\d+)/(\d+)", value.strip())
+        if match is None:
+            raise ValueError(f"Shard must be given as INDEX/COUNT: '{value}'.")
+
+        return cls(int(match.group(1)), int(match.group(2)))
+
+    def contains(self, key: int | str) -> bool:
+        if isinstance(key, str):
+            # Titles from list files may have either spaces or underscores.
+            key = key.strip().replace("_", " ")
+        checksum = zlib.crc32(str(key).encode("utf-8"))
+        return checksum % self.count == self.index - 1
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
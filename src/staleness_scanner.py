@@ -0,0 +1,129 @@
+import logging
+from dataclasses import dataclass
+from datetime import date
+
+from pywikibot.site import BaseSite
+
+from declaration_journal import DeclarationJournal
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScanResult:
+    scanned: int = 0
+    stale: int = 0
+    missing: int = 0
+
+
+class StalenessScanner:
+    """Finds declarations for files that have changed on Commons
+
+    Declarations are read from the journal in chunks of as many pages as
+    can be asked for in one API request: 50, or 500 with the
+    apihighlimits right. The latest revision and SHA-1 of the pages are
+    compared to the declarations. Declarations for changed files are
+    tagged with `stale_tag` and those for deleted files with
+    `missing_tag`, so that they can be used as input.
+    """
+
+    def __init__(
+        self,
+        journal: DeclarationJournal,
+        site: BaseSite,
+        chunk_size: int | None = None,
+        stale_tag: str | None = None,
+        missing_tag: str | None = None
+    ):
+        self._journal = journal
+        self._site = site
+        self._chunk_size = chunk_size or site.maxlimit
+        today = date.today().isoformat()
+        self.stale_tag = stale_tag or f"stale:{today}"
+        self.missing_tag = missing_tag or f"missing:{today}"
+
+    def scan(self, tag: str | None = None) -> ScanResult:
+        """Scan declarations with a tag, or all if none is given"""
+        result = ScanResult()
+        chunks = self._journal.get_version_chunks(tag, self._chunk_size)
+        for rows in chunks:
+            versions = self.get_current_versions([r.page_id for r in rows])
+            stale = []
+            missing = []
+            for page_id, revision_id, image_hash in rows:
+                if page_id not in versions:
+                    continue
+
+                version = versions[page_id]
+                if version is None:
+                    missing.append(page_id)
+                elif is_stale(revision_id, image_hash, *version):
+                    stale.append(page_id)
+
+            if stale:
+                self._journal.add_tag(self.stale_tag, stale)
+            if missing:
+                self._journal.add_tag(self.missing_tag, missing)
+            result.scanned += len(rows)
+            result.stale += len(stale)
+            result.missing += len(missing)
+            logger.info(
+                f"Scanned {result.scanned} declarations, {result.stale} stale "
+                f"and {result.missing} missing."
+            )
+
+        return result
+
+    def get_current_versions(
+        self,
+        page_ids: list[int]
+    ) -> dict[int, tuple[int, str | None] | None]:
+        """Get latest revision ID and SHA-1 for pages
+
+        Pages that don't exist have None. Pages that weren't in the
+        response are left out.
+        """
+        request = self._site.simple_request(
+            action="query",
+            pageids=page_ids,
+            prop="revisions|imageinfo",
+            rvprop="ids",
+            iiprop="sha1"
+        )
+        data = request.submit()
+        pages = data.get("query", {}).get("pages", {})
+        if isinstance(pages, dict):
+            pages = pages.values()
+
+        versions = {}
+        for page in pages:
+            page_id = page.get("pageid")
+            if page_id is None:
+                continue
+
+            if "missing" in page:
+                versions[page_id] = None
+            elif "revisions" in page:
+                image_info = page.get("imageinfo") or [{}]
+                versions[page_id] = (
+                    page["revisions"][0]["revid"],
+                    image_info[0].get("sha1")
+                )
+
+        return versions
+
+
+def is_stale(
+    revision_id: int,
+    image_hash: str | None,
+    current_revision_id: int,
+    current_hash: str | None
+) -> bool:
+    if revision_id != current_revision_id:
+        return True
+
+    return (
+        image_hash is not None
+        and current_hash is not None
+        and image_hash != current_hash
+    )
@@ -0,0 +1,109 @@
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Iterable, Iterator
+
+from declaration_journal import DeclarationJournal, WorkChunk
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    """Chunks of page IDs in the journal that workers lease
+
+    Several workers, possibly on different hosts, can take chunks from
+    the same queue. A chunk is leased to one worker at a time and the
+    lease is renewed in the background while the worker is busy with
+    it. If the worker dies the lease expires and the chunk is given to
+    another worker.
+
+    The journal should have its own session, i.e. not be the one used
+    to process files, since the lease is renewed from another thread.
+    """
+
+    def __init__(
+        self,
+        journal: DeclarationJournal,
+        name: str,
+        lease_time: timedelta = timedelta(minutes=10),
+        owner: str | None = None
+    ):
+        self._journal = journal
+        self.name = name
+        self._lease_time = lease_time
+        self._owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+
+    def fill(self, batch: str, page_ids: Iterable[int], chunk_size: int) -> int:
+        with self._lock:
+            return self._journal.add_work_chunks(
+                self.name,
+                batch,
+                page_ids,
+                chunk_size
+            )
+
+    def chunks(self) -> Iterator[WorkChunk]:
+        """Claim chunks until the queue is empty
+
+        A chunk is marked as done when the next one is asked for, i.e.
+        when the caller is done with it. If the caller stops before that
+        the chunk is left for its lease to expire.
+        """
+        while True:
+            with self._lock:
+                chunk = self._journal.claim_work_chunk(
+                    self.name,
+                    self._owner,
+                    self._lease_time
+                )
+            if chunk is None:
+                logger.info(f"No more work in queue '{self.name}'.")
+                return
+
+            logger.info(f"Claimed chunk {chunk.id} from queue '{self.name}'.")
+            with self._renewing(chunk):
+                yield chunk
+
+            with self._lock:
+                completed = self._journal.complete_work_chunk(chunk, self._owner)
+            if not completed:
+                logger.warning(
+                    f"Lease for chunk {chunk.id} was lost before it was done."
+                )
+
+    def status(self) -> dict[str, int]:
+        with self._lock:
+            return self._journal.count_work_chunks(self.name)
+
+    @contextmanager
+    def _renewing(self, chunk: WorkChunk):
+        stopped = threading.Event()
+
+        def renew():
+            interval = self._lease_time.total_seconds() / 3
+            while not stopped.wait(interval):
+                with self._lock:
+                    renewed = self._journal.renew_work_lease(
+                        chunk,
+                        self._owner,
+                        self._lease_time
+                    )
+                if not renewed:
+                    logger.warning(f"Lost lease for chunk {chunk.id}.")
+                    return
+
+        thread = threading.Thread(
+            target=renew,
+            name=f"lease-{chunk.id}",
+            daemon=True
+        )
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
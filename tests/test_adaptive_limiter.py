@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from adaptive_limiter import (
+    AdaptiveConcurrencyLimiter,
+    OverloadError,
+    parse_retry_after
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_limit_increases_when_healthy():
+    limiter = AdaptiveConcurrencyLimiter("test", 4, clock=Clock())
+
+    for _ in range(10):
+        limiter.on_success(1.0)
+
+    assert limiter.limit == 4
+
+
+def test_limit_holds_when_slow():
+    limiter = AdaptiveConcurrencyLimiter("test", 4, initial=2, clock=Clock())
+    limiter.on_success(1.0)
+    limit = limiter.limit
+
+    for _ in range(10):
+        limiter.on_success(10.0)
+
+    assert limiter.limit == limit
+
+
+def test_limit_decreases_on_overload():
+    clock = Clock()
+    limiter = AdaptiveConcurrencyLimiter("test", 8, initial=8, clock=clock)
+
+    clock.now += 1
+    limiter.on_overload()
+
+    assert limiter.limit == 4
+
+
+def test_limit_does_not_go_below_minimum():
+    clock = Clock()
+    limiter = AdaptiveConcurrencyLimiter("test", 8, 2, 2, clock=clock)
+
+    clock.now += 1
+    limiter.on_overload()
+
+    assert limiter.limit == 2
+
+
+def test_overloads_in_flight_only_decrease_once():
+    clock = Clock()
+    limiter = AdaptiveConcurrencyLimiter("test", 8, initial=8, clock=clock)
+    started = clock.now
+
+    clock.now += 1
+    for _ in range(4):
+        limiter.on_overload(started=started)
+
+    assert limiter.limit == 4
+
+
+def test_slot_on_overload():
+    clock = Clock()
+    limiter = AdaptiveConcurrencyLimiter("test", 8, initial=8, clock=clock)
+    clock.now += 1
+
+    with pytest.raises(OverloadError):
+        with limiter.slot():
+            clock.now += 1
+            raise OverloadError("Too many requests", 30)
+
+    assert limiter.limit == 4
+    assert limiter._paused_until == clock.now + 30
+    assert limiter._in_flight == 0
+
+
+def test_slot_on_other_error():
+    limiter = AdaptiveConcurrencyLimiter("test", 8, initial=8, clock=Clock())
+
+    with pytest.raises(ValueError):
+        with limiter.slot():
+            raise ValueError()
+
+    assert limiter.limit == 8
+    assert limiter._in_flight == 0
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        AdaptiveConcurrencyLimiter("test", 1, 2)
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after("120") == 120
+
+
+def test_parse_retry_after_date():
+    retry_time = datetime.now(timezone.utc) + timedelta(seconds=60)
+
+    retry_after = parse_retry_after(format_datetime(retry_time, usegmt=True))
+
+    assert 55 < retry_after <= 60
+
+
+def test_parse_retry_after_invalid():
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
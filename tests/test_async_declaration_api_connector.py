@@ -0,0 +1,112 @@
+from threading import Lock
+from time import sleep
+from unittest.mock import Mock
+
+import pytest
+
+from async_declaration_api_connector import AsyncDeclarationApiConnector
+from declaration_api_connector import DeclarationRequest
+
+
+@pytest.fixture
+def connector():
+    connector = Mock()
+    connector.sign_declaration.side_effect = (
+        lambda name, *args: DeclarationRequest(
+            {"name": name},
+            {},
+            f"signature-{name}",
+            f"cdb-signature-{name}"
+        )
+    )
+    connector.get_tsa.side_effect = lambda data, name: {"tsr": data}
+    connector.send_declaration.side_effect = (
+        lambda request: f"cid-{request.public_metadata['name']}"
+    )
+    return connector
+
+
+def test_submit(connector):
+    async_connector = AsyncDeclarationApiConnector(connector, 2)
+
+    futures = [
+        async_connector.submit(f"file-{i}", "ISCC:A", "url", "license", {}, {})
+        for i in range(10)
+    ]
+    cids = [f.result(timeout=5) for f in futures]
+    async_connector.close()
+
+    assert cids == [f"cid-file-{i}" for i in range(10)]
+    request = connector.send_declaration.call_args_list[0].args[0]
+    assert request.tsa_signature == {"tsr": "signature-file-0"}
+    assert request.commons_db_tsa_signature == {"tsr": "cdb-signature-file-0"}
+
+
+def test_submit_error(connector):
+    connector.send_declaration.side_effect = Exception("Invalid declaration")
+    async_connector = AsyncDeclarationApiConnector(connector, 2)
+
+    future = async_connector.submit("file", "ISCC:A", "url", "license", {}, {})
+
+    with pytest.raises(Exception, match="Invalid declaration"):
+        future.result(timeout=5)
+    async_connector.close()
+
+
+def test_concurrency_cap(connector):
+    lock = Lock()
+    in_flight = []
+    max_in_flight = []
+
+    def send(request):
+        with lock:
+            in_flight.append(request)
+            max_in_flight.append(len(in_flight))
+        sleep(0.01)
+        with lock:
+            in_flight.remove(request)
+        return "cid"
+
+    connector.send_declaration.side_effect = send
+    async_connector = AsyncDeclarationApiConnector(connector, 3)
+
+    futures = [
+        async_connector.submit(f"file-{i}", "ISCC:A", "url", "license", {}, {})
+        for i in range(20)
+    ]
+    for f in futures:
+        f.result(timeout=5)
+    async_connector.close()
+
+    assert max(max_in_flight) <= 3
+
+
+def test_submit_on_signed(connector):
+    signed = []
+    async_connector = AsyncDeclarationApiConnector(connector, 2)
+
+    future = async_connector.submit(
+        "file",
+        "ISCC:A",
+        "url",
+        "license",
+        {},
+        {},
+        signed.append
+    )
+    cid = future.result(timeout=5)
+    async_connector.close()
+
+    assert cid == "cid-file"
+    assert signed[0].tsa_signature == {"tsr": "signature-file"}
+
+
+def test_submit_request(connector):
+    async_connector = AsyncDeclarationApiConnector(connector, 2)
+    request = DeclarationRequest({"name": "file"}, {}, "signature", "signature")
+
+    cid = async_connector.submit_request(request).result(timeout=5)
+    async_connector.close()
+
+    assert cid == "cid-file"
+    connector.sign_declaration.assert_not_called()
@@ -0,0 +1,99 @@
+import math
+import threading
+
+from autotuner import Autotuner, allocate
+from pipeline import Pipeline, Stage
+
+
+def make_stages(lock=None):
+    lock = lock or threading.Lock()
+    return [
+        Stage("load", lambda item: None, lock=lock),
+        Stage("download", lambda item: None, 2, max_workers=8),
+        Stage("iscc", lambda item: None, 2, max_workers=8),
+        Stage("record", lambda item: "DONE", lock=lock),
+    ]
+
+
+def test_allocate_reaches_target():
+    stages = make_stages()
+    work = {"load": 0.01, "download": 2.0, "iscc": 1.0, "record": 0.01}
+
+    allocation = allocate(stages, ["download", "iscc"], work, 8, 3600)
+
+    assert allocation.workers == {"download": 2, "iscc": 1}
+    assert allocation.rate == 3600
+    assert allocation.bottleneck in ("download", "iscc")
+
+
+def test_allocate_shares_budget_by_work():
+    stages = make_stages()
+    work = {"load": 0.01, "download": 3.0, "iscc": 1.0, "record": 0.01}
+
+    allocation = allocate(stages, ["download", "iscc"], work, 8, 360000)
+
+    assert allocation.workers == {"download": 6, "iscc": 2}
+    assert math.isclose(allocation.rate, 7200)
+
+
+def test_allocate_locked_stages_bottleneck():
+    stages = make_stages()
+    work = {"load": 1.0, "download": 0.1, "iscc": 0.1, "record": 1.0}
+
+    allocation = allocate(stages, ["download", "iscc"], work, 8, 360000)
+
+    assert allocation.bottleneck == "load+record"
+    assert math.isclose(allocation.rate, 1800)
+
+
+def test_tune_sets_workers():
+    stages = make_stages()
+    pipeline = Pipeline(stages)
+    reports = []
+    autotuner = Autotuner(
+        pipeline,
+        ["download", "iscc"],
+        360000,
+        report=reports.append
+    )
+
+    allocation = autotuner.tune(
+        (0, 0, {"load": 0, "download": 0, "iscc": 0, "record": 0}),
+        (10, 10, {"load": 0.1, "download": 30, "iscc": 10, "record": 0.1})
+    )
+
+    assert allocation.workers == {"download": 3, "iscc": 1}
+    assert stages[1].workers == 3
+    assert stages[2].workers == 1
+    assert "Bottleneck" in reports[0]
+
+
+def test_tune_without_finished_files():
+    pipeline = Pipeline(make_stages())
+    reports = []
+    autotuner = Autotuner(pipeline, ["download"], 100, report=reports.append)
+
+    allocation = autotuner.tune((0, 5, {}), (10, 5, {}))
+
+    assert allocation is None
+    assert len(reports) == 1
+
+
+def test_stage_stats():
+    stage = Stage("stage", lambda item: "DONE")
+
+    stage.run(1)
+    stage.run(2)
+    processed, busy_time = stage.stats()
+
+    assert processed == 2
+    assert busy_time >= 0
+
+
+def test_stage_set_workers_is_capped():
+    stage = Stage("stage", lambda item: None, 2, max_workers=4)
+
+    stage.set_workers(10)
+    assert stage.workers == 4
+    stage.set_workers(0)
+    assert stage.workers == 1
@@ -0,0 +1,133 @@
+from types import SimpleNamespace
+
+import pywikibot
+
+from changed_files import (
+    CHECKPOINT_NAME,
+    get_changed_pages,
+    get_uploads,
+    is_changed,
+    save_checkpoint,
+    sha1_from_base36
+)
+from declaration_journal import create_journal
+
+START = pywikibot.Timestamp(2026, 1, 1)
+END = pywikibot.Timestamp(2026, 1, 2)
+
+
+class FakeLogEntry:
+    def __init__(self, page_id, sha1):
+        self._page_id = page_id
+        self.params = {"img_sha1": sha1} if sha1 else {}
+
+    def pageid(self):
+        if self._page_id is None:
+            raise KeyError("pageid")
+
+        return self._page_id
+
+
+class FakeSite:
+    maxlimit = 50
+
+    def __init__(self, log, revisions):
+        self._log = log
+        # Page ID -> latest revision ID.
+        self._revisions = revisions
+
+    def logevents(self, **kwargs):
+        return iter(self._log)
+
+    def load_pages_from_pageids(self, page_ids):
+        for page_id in page_ids:
+            yield SimpleNamespace(
+                site=self,
+                pageid=page_id,
+                latest_revision_id=self._revisions[page_id],
+                title=lambda i=page_id: f"File:{i}.jpg"
+            )
+
+    def preloadpages(self, pages, **kwargs):
+        return iter(pages)
+
+
+def test_sha1_from_base36():
+    assert sha1_from_base36("z") == "0" * 38 + "23"
+    assert sha1_from_base36("0") == "0" * 40
+
+
+def test_is_changed():
+    page = SimpleNamespace(latest_revision_id=2)
+
+    assert is_changed(page, 1, "abc", "abc") is True
+    assert is_changed(page, 2, "abc", "def") is True
+    assert is_changed(page, 2, "abc", "abc") is False
+    assert is_changed(page, 2, "abc", None) is False
+
+
+def test_get_uploads_keeps_latest_version():
+    site = FakeSite(
+        [
+            FakeLogEntry(1, "a"),
+            FakeLogEntry(None, "b"),
+            FakeLogEntry(1, "z"),
+            FakeLogEntry(2, None)
+        ],
+        {}
+    )
+
+    assert get_uploads(site, START, END) == {
+        1: sha1_from_base36("z"),
+        2: None
+    }
+
+
+def test_get_changed_pages():
+    journal = create_journal("sqlite:///:memory:")
+    same_hash = sha1_from_base36("a")
+    # Unchanged.
+    journal.add_declaration(set(), page_id=1, revision_id=10, image_hash=same_hash)
+    # New revision of the page.
+    journal.add_declaration(set(), page_id=2, revision_id=20, image_hash=same_hash)
+    # New version of the file.
+    journal.add_declaration(set(), page_id=3, revision_id=30, image_hash="old")
+    site = FakeSite(
+        [
+            FakeLogEntry(1, "a"),
+            FakeLogEntry(2, "a"),
+            FakeLogEntry(3, "a"),
+            # Not in the journal.
+            FakeLogEntry(4, "a")
+        ],
+        {1: 10, 2: 21, 3: 30, 4: 40}
+    )
+
+    pages = get_changed_pages(site, journal, START, END)
+
+    assert [p.pageid for p in pages] == [2, 3]
+
+
+def test_checkpoint_saved_after_clean_run():
+    journal = create_journal("sqlite:///:memory:")
+
+    save_checkpoint(journal, START, END, False, 0)
+
+    assert journal.get_checkpoint(CHECKPOINT_NAME) == END.isoformat()
+
+
+def test_checkpoint_not_saved_after_failed_run():
+    journal = create_journal("sqlite:///:memory:")
+    journal.save_checkpoint(CHECKPOINT_NAME, START.isoformat())
+
+    save_checkpoint(journal, START, END, False, 1)
+
+    assert journal.get_checkpoint(CHECKPOINT_NAME) == START.isoformat()
+
+
+def test_checkpoint_not_saved_after_stopped_run():
+    journal = create_journal("sqlite:///:memory:")
+
+    save_checkpoint(journal, START, END, True, 0)
+
+    assert journal.get_checkpoint(CHECKPOINT_NAME) is None
@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail(breaker: CircuitBreaker):
+    with pytest.raises(ConnectionError):
+        with breaker.call():
+            raise ConnectionError()
+
+
+def test_opens_after_failures_in_a_row():
+    breaker = CircuitBreaker("test", 3, clock=Clock())
+
+    fail(breaker)
+    fail(breaker)
+    with breaker.call():
+        pass
+    fail(breaker)
+    fail(breaker)
+
+    assert breaker.state == CLOSED
+
+    fail(breaker)
+
+    assert breaker.state == OPEN
+
+
+def test_half_open_after_reset_time():
+    clock = Clock()
+    breaker = CircuitBreaker("test", 1, 60, clock)
+    fail(breaker)
+
+    clock.now += 60
+
+    assert breaker.state == HALF_OPEN
+    assert breaker.acquire()
+
+
+def test_closes_when_probe_succeeds():
+    clock = Clock()
+    breaker = CircuitBreaker("test", 1, 60, clock)
+    fail(breaker)
+    clock.now += 60
+
+    with breaker.call():
+        pass
+
+    assert breaker.state == CLOSED
+    assert not breaker.acquire()
+
+
+def test_opens_again_when_probe_fails():
+    clock = Clock()
+    breaker = CircuitBreaker("test", 2, 60, clock)
+    fail(breaker)
+    fail(breaker)
+    clock.now += 60
+
+    fail(breaker)
+
+    assert breaker.state == OPEN
+
+
+def test_calls_wait_for_probe():
+    clock = Clock()
+    breaker = CircuitBreaker("test", 1, 60, clock)
+    fail(breaker)
+    clock.now += 60
+    probe = breaker.acquire()
+    acquired = threading.Event()
+
+    def call():
+        breaker.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=call)
+    thread.start()
+
+    assert probe
+    assert not acquired.wait(0.1)
+
+    breaker.on_success(probe)
+    thread.join(1)
+
+    assert acquired.is_set()
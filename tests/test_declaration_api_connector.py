@@ -0,0 +1,70 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import declaration_api_connector
+from adaptive_limiter import OverloadError
+from declaration_api_connector import (
+    OVERLOAD_RETRIES,
+    DeclarationApiConnector,
+    DeclarationRequest
+)
+
+
+@pytest.fixture
+def connector(tmp_path):
+    credentials = tmp_path / "credentials.json"
+    credentials.write_text(json.dumps({"credentialSubject": {"id": "did:1"}}))
+    key = tmp_path / "key.pem"
+    key.write_text("KEY")
+    return DeclarationApiConnector(
+        False,
+        "https://registry",
+        "api-key",
+        None,
+        credentials,
+        key,
+        key,
+        "https://tsa"
+    )
+
+
+def make_request():
+    return DeclarationRequest({}, {}, "signature", "signature", {}, {})
+
+
+def post_responses(monkeypatch, *status_codes):
+    posts = []
+    waits = []
+
+    def post(url, **kwargs):
+        status_code = status_codes[len(posts)]
+        posts.append(url)
+        return SimpleNamespace(
+            status_code=status_code,
+            ok=status_code == 200,
+            headers={"Retry-After": "3"},
+            text="",
+            json=lambda: {"cidV1": "cid123"}
+        )
+
+    monkeypatch.setattr(declaration_api_connector.requests, "post", post)
+    monkeypatch.setattr(declaration_api_connector, "sleep", waits.append)
+    return posts, waits
+
+
+def test_send_declaration_retries_when_overloaded(monkeypatch, connector):
+    posts, waits = post_responses(monkeypatch, 429, 200)
+
+    assert connector.send_declaration(make_request()) == "cid123"
+    assert len(posts) == 2
+    assert waits == [3.0]
+
+
+def test_send_declaration_gives_up_when_overloaded(monkeypatch, connector):
+    posts, waits = post_responses(monkeypatch, *[503] * (OVERLOAD_RETRIES + 1))
+
+    with pytest.raises(OverloadError):
+        connector.send_declaration(make_request())
+    assert len(posts) == OVERLOAD_RETRIES + 1
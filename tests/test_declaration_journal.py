@@ -1,7 +1,18 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest import TestCase
 
-from declaration_journal import Declaration, Tag, create_journal
+from sqlalchemy import text
+
+from declaration_journal import (
+    STAGE_CONFIRMED,
+    STAGE_ISCC,
+    STAGE_METADATA,
+    STAGE_SUBMITTED,
+    Declaration,
+    Tag,
+    create_journal,
+    stage_done
+)
 
 
 class DeclarationJournalTestCase(TestCase):
@@ -95,3 +106,278 @@ class DeclarationJournalTestCase(TestCase):
 
         assert self._declaration_journal.tag_exists("tag-1") is True
         assert self._declaration_journal.tag_exists("tag-2") is False
+
+    def test_claim_work_chunk(self):
+        self._declaration_journal.add_work_chunks(
+            "queue-1",
+            "batch:1",
+            [1, 2, 3, 4, 5],
+            2
+        )
+
+        first = self._declaration_journal.claim_work_chunk(
+            "queue-1",
+            "worker-1",
+            timedelta(minutes=10)
+        )
+        second = self._declaration_journal.claim_work_chunk(
+            "queue-1",
+            "worker-2",
+            timedelta(minutes=10)
+        )
+
+        assert first.get_page_ids() == [1, 2]
+        assert first.lease_owner == "worker-1"
+        assert first.batch == "batch:1"
+        assert second.get_page_ids() == [3, 4]
+        assert second.lease_owner == "worker-2"
+
+    def test_claim_work_chunk_empty_queue(self):
+        self._declaration_journal.add_work_chunks("queue-1", "batch:1", [1], 2)
+
+        chunk = self._declaration_journal.claim_work_chunk(
+            "queue-2",
+            "worker-1",
+            timedelta(minutes=10)
+        )
+
+        assert chunk is None
+
+    def test_claim_work_chunk_expired_lease(self):
+        self._declaration_journal.add_work_chunks("queue-1", "batch:1", [1], 2)
+        self._declaration_journal.claim_work_chunk(
+            "queue-1",
+            "worker-1",
+            timedelta(minutes=-1)
+        )
+
+        chunk = self._declaration_journal.claim_work_chunk(
+            "queue-1",
+            "worker-2",
+            timedelta(minutes=10)
+        )
+
+        assert chunk.lease_owner == "worker-2"
+        assert self._declaration_journal.renew_work_lease(
+            chunk,
+            "worker-1",
+            timedelta(minutes=10)
+        ) is False
+
+    def test_complete_work_chunk(self):
+        self._declaration_journal.add_work_chunks("queue-1", "batch:1", [1], 2)
+        chunk = self._declaration_journal.claim_work_chunk(
+            "queue-1",
+            "worker-1",
+            timedelta(minutes=10)
+        )
+
+        assert self._declaration_journal.renew_work_lease(
+            chunk,
+            "worker-1",
+            timedelta(minutes=10)
+        ) is True
+        assert self._declaration_journal.complete_work_chunk(
+            chunk,
+            "worker-1"
+        ) is True
+        assert self._declaration_journal.claim_work_chunk(
+            "queue-1",
+            "worker-1",
+            timedelta(minutes=-1)
+        ) is None
+        assert self._declaration_journal.count_work_chunks("queue-1") == {
+            "done": 1
+        }
+
+    def test_checkpoint(self):
+        assert self._declaration_journal.get_checkpoint("stream") is None
+
+        self._declaration_journal.save_checkpoint("stream", "1")
+        self._declaration_journal.save_checkpoint("stream", "2")
+
+        assert self._declaration_journal.get_checkpoint("stream") == "2"
+
+    def test_get_page_id_matches(self):
+        for page_id in range(1, 6):
+            self._add_declaration(page_id=page_id, revision_id=page_id * 10)
+
+        declarations = self._declaration_journal.get_page_id_matches(
+            [2, 4, 6],
+            chunk_size=2
+        )
+
+        assert sorted(d.page_id for d in declarations) == [2, 4]
+
+    def test_get_version_chunks(self):
+        for page_id in [5, 1, 3]:
+            self._add_declaration(
+                page_id=page_id,
+                revision_id=page_id * 10,
+                image_hash=f"hash{page_id}"
+            )
+
+        chunks = list(self._declaration_journal.get_version_chunks(chunk_size=2))
+
+        assert [[tuple(r) for r in c] for c in chunks] == [
+            [(1, 10, "hash1"), (3, 30, "hash3")],
+            [(5, 50, "hash5")]
+        ]
+
+    def test_add_tag(self):
+        self._declaration_journal.add_declaration({"tag-1"}, page_id=1, revision_id=1)
+        self._declaration_journal.add_declaration({"tag-2"}, page_id=2, revision_id=2)
+
+        assert self._declaration_journal.add_tag("tag-1", [1, 2, 3]) == 1
+        assert self._declaration_journal.add_tag("tag-1", [1, 2]) == 0
+        assert len(self._declaration_journal.get_declarations("tag-1")) == 2
+
+    def test_set_stage(self):
+        declaration = self._declaration_journal.add_declaration(
+            set(),
+            page_id=1,
+            revision_id=1
+        )
+
+        self._declaration_journal.set_stage(
+            declaration,
+            STAGE_ISCC,
+            {"thumbnail": "thumb"}
+        )
+        self._declaration_journal.set_stage(
+            declaration,
+            STAGE_METADATA,
+            {"metadata": "{}"}
+        )
+
+        assert declaration.stage == STAGE_METADATA
+        assert stage_done(declaration, STAGE_ISCC)
+        assert self._declaration_journal.get_artifacts(declaration) == {
+            "thumbnail": "thumb",
+            "metadata": "{}"
+        }
+
+        self._declaration_journal.delete_artifacts(declaration)
+
+        assert self._declaration_journal.get_artifacts(declaration) == {}
+
+    def test_get_due_failures(self):
+        now = datetime.now()
+        self._add_declaration(page_id=1, revision_id=1, cid="cid")
+        self._add_declaration(page_id=2, revision_id=2)
+        for page_id in [1, 2, 3]:
+            self._declaration_journal.save_failure(
+                page_id,
+                f"File:{page_id}.jpg",
+                "TimeoutError",
+                None,
+                now - timedelta(minutes=page_id)
+            )
+        self._declaration_journal.save_failure(4, "File:4.jpg", "E", None, None)
+
+        failures = self._declaration_journal.get_due_failures(now)
+
+        assert [f.page_id for f in failures] == [3, 2]
+
+    def test_get_page_ids(self):
+        self._declaration_journal.add_declaration({"tag-1"}, page_id=3, revision_id=3)
+        self._declaration_journal.add_declaration({"tag-1"}, page_id=1, revision_id=1)
+        self._declaration_journal.add_declaration(
+            {"tag-1"},
+            page_id=2,
+            revision_id=2,
+            cid="cid"
+        )
+        self._declaration_journal.add_declaration({"tag-2"}, page_id=4, revision_id=4)
+
+        page_ids = self._declaration_journal.get_page_ids(
+            "tag-1",
+            only_not_declared=True,
+            chunk_size=1
+        )
+
+        assert list(page_ids) == [1, 3]
+
+    def test_get_snapshots(self):
+        stages = [STAGE_ISCC, STAGE_METADATA, STAGE_SUBMITTED, STAGE_CONFIRMED]
+        for page_id, stage in enumerate(stages, 1):
+            declaration = self._declaration_journal.add_declaration(
+                {"tag-1"},
+                page_id=page_id,
+                revision_id=page_id
+            )
+            self._declaration_journal.set_stage(declaration, stage)
+        self._declaration_journal.update_declaration(declaration, cid="cid")
+
+        snapshots = self._declaration_journal.get_snapshots("tag-1")
+
+        assert [d.page_id for d in snapshots] == [2, 3]
+
+    def test_add_prepared_declarations(self):
+        self._declaration_journal.add_declaration({"tag-2"}, page_id=1, revision_id=10)
+
+        added = self._declaration_journal.add_prepared_declarations(
+            {"tag-1"},
+            [(1, 11), (2, 20), (3, 30), (4, 10)]
+        )
+
+        assert added == {2, 3}
+        declarations = self._declaration_journal.get_declarations("tag-1")
+        assert [(d.page_id, d.revision_id) for d in declarations] == [
+            (2, 20),
+            (3, 30)
+        ]
+        assert declarations[0].tags == {Tag(label="tag-1")}
+        assert self._declaration_journal.get_declarations("tag-2")[0].revision_id == 10
+
+    def test_add_prepared_declarations_without_fractional_seconds(self):
+        # Like MySQL DATETIME, which drops the microseconds.
+        self._declaration_journal._session.execute(text(
+            "CREATE TRIGGER truncate_created AFTER INSERT ON declaration "
+            "BEGIN UPDATE declaration SET created_timestamp = "
+            "substr(NEW.created_timestamp, 1, 19) WHERE id = NEW.id; END"
+        ))
+
+        added = self._declaration_journal.add_prepared_declarations(
+            {"tag-1"},
+            [(1, 10), (2, 20)]
+        )
+
+        assert added == {1, 2}
+        declarations = self._declaration_journal.get_declarations("tag-1")
+        assert [d.page_id for d in declarations] == [1, 2]
+        assert declarations[0].created_timestamp.microsecond == 0
+
+    def test_get_average_times(self):
+        self._declaration_journal.add_declaration(
+            {"tag-1"},
+            page_id=1,
+            revision_id=1,
+            download_time=1.0
+        )
+        self._declaration_journal.add_declaration(
+            {"tag-1"},
+            page_id=2,
+            revision_id=2,
+            download_time=3.0,
+            iscc_time=5.0
+        )
+        self._declaration_journal.add_declaration(
+            {"tag-2"},
+            page_id=3,
+            revision_id=3,
+            download_time=8.0
+        )
+
+        times = self._declaration_journal.get_average_times({"tag-1"})
+
+        assert times == {
+            "download_time": (2, 2.0),
+            "iscc_time": (1, 5.0),
+            "metadata_time": (0, None),
+            "request_time": (0, None)
+        }
+        assert self._declaration_journal.get_average_times()["download_time"] == (
+            3,
+            4.0
+        )
@@ -0,0 +1,93 @@
+import json
+import socket
+import threading
+
+import pytest
+
+from declaration_service import DeclarationService, WorkRequest
+
+
+def test_work_request_from_json():
+    request = WorkRequest.from_json(
+        '{"titles": ["File:A.jpg"], "batch": "batch:test", "limit": 1}'
+    )
+
+    assert request == WorkRequest(["File:A.jpg"], [], None, "batch:test", 1)
+
+
+@pytest.mark.parametrize("line", [
+    "not json",
+    "[]",
+    "{}",
+    '{"titles": "File:A.jpg"}',
+    '{"pages": [1]}',
+])
+def test_invalid_work_request(line):
+    with pytest.raises(ValueError):
+        WorkRequest.from_json(line)
+
+
+@pytest.fixture
+def service(tmp_path):
+    def handle(request, on_result):
+        if request.tag == "bad":
+            raise ValueError("Bad tag.")
+
+        for page_id in request.page_ids:
+            on_result(f"File:{page_id}.jpg", "DECLARED")
+        return {"declared": len(request.page_ids)}
+
+    service = DeclarationService(str(tmp_path / "service.sock"), handle)
+    thread = threading.Thread(target=service.serve_forever)
+    thread.start()
+    yield service
+    service.shutdown()
+    thread.join()
+
+
+def send_requests(path: str, *requests: str) -> list[dict]:
+    with socket.socket(socket.AF_UNIX) as client:
+        client.connect(path)
+        client.sendall("".join(f"{r}\n" for r in requests).encode())
+        client.shutdown(socket.SHUT_WR)
+        with client.makefile("rb") as f:
+            return [json.loads(line) for line in f]
+
+
+def test_service_streams_results(service):
+    responses = send_requests(service.path, '{"page_ids": [1, 2]}')
+
+    assert responses == [
+        {"title": "File:1.jpg", "result": "DECLARED"},
+        {"title": "File:2.jpg", "result": "DECLARED"},
+        {"done": True, "declared": 2}
+    ]
+
+
+def test_service_keeps_going_after_errors(service):
+    responses = send_requests(
+        service.path,
+        "{}",
+        '{"tag": "bad"}',
+        '{"page_ids": [3]}'
+    )
+
+    assert [r.get("error") for r in responses] == [
+        "Request must have titles, page_ids or tag.",
+        "Bad tag.",
+        None,
+        None
+    ]
+    assert responses[-1] == {"done": True, "declared": 1}
+
+
+def test_service_replaces_stale_socket(tmp_path):
+    path = str(tmp_path / "service.sock")
+    with socket.socket(socket.AF_UNIX) as old:
+        old.bind(path)
+
+    service = DeclarationService(path, lambda request, on_result: {})
+    thread = threading.Thread(target=service.serve_forever)
+    thread.start()
+    service.shutdown()
+    thread.join()
@@ -0,0 +1,62 @@
+import json
+
+from event_stream import Event, get_upload_title, parse_events, read_events
+
+
+def upload_event(title: str, **kwargs) -> str:
+    change = {
+        "wiki": "commonswiki",
+        "namespace": 6,
+        "type": "log",
+        "log_type": "upload",
+        "title": title
+    }
+    change.update(kwargs)
+    return json.dumps(change)
+
+
+def test_parse_events():
+    lines = [
+        ":ok\n",
+        "event: message\n",
+        "id: 1\n",
+        "data: first\n",
+        "\n",
+        "data: second\n",
+        "data: line\n",
+        "\n",
+        "id: 3\n",
+        "data: third\n"
+    ]
+
+    assert list(parse_events(lines)) == [
+        Event("1", "first"),
+        Event("1", "second\nline"),
+        Event("3", "third")
+    ]
+
+
+def test_read_events_from_file_after_id(tmp_path):
+    path = tmp_path / "events.txt"
+    path.write_text("id: 1\ndata: a\n\nid: 2\ndata: b\n\nid: 3\ndata: c\n\n")
+
+    events = read_events(str(path), "2")
+
+    assert [e.data for e in events] == ["c"]
+
+
+def test_get_upload_title():
+    assert get_upload_title(Event("1", upload_event("File:A.jpg"))) == "File:A.jpg"
+
+
+def test_get_upload_title_other_events():
+    assert get_upload_title(
+        Event("1", upload_event("File:A.jpg", wiki="enwiki"))
+    ) is None
+    assert get_upload_title(
+        Event("1", upload_event("User:A", namespace=2))
+    ) is None
+    assert get_upload_title(
+        Event("1", upload_event("File:A.jpg", type="edit"))
+    ) is None
+    assert get_upload_title(Event("1", "not json")) is None
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+from declaration_journal import create_journal
+from failure_queue import NO_CID_ERROR, FailureQueue
+from metadata_collector import MissingMetadataError
+
+NOW = datetime(2026, 1, 1)
+
+
+def make_queue(**kwargs) -> FailureQueue:
+    journal = create_journal("sqlite:///:memory:")
+    return FailureQueue(journal, clock=lambda: NOW, **kwargs)
+
+
+def test_backoff_doubles():
+    failure_queue = make_queue(
+        base_delay=timedelta(minutes=10),
+        max_delay=timedelta(minutes=30)
+    )
+
+    delays = []
+    for _ in range(3):
+        failure = failure_queue.add(1, "File:A.jpg", TimeoutError("Timeout."))
+        delays.append(failure.next_attempt - NOW)
+
+    assert delays == [
+        timedelta(minutes=10),
+        timedelta(minutes=20),
+        timedelta(minutes=30)
+    ]
+    assert failure.attempts == 3
+    assert failure.error == "TimeoutError"
+    assert failure.message == "Timeout."
+
+
+def test_permanent_error_not_retried():
+    failure_queue = make_queue()
+
+    failure = failure_queue.add(
+        1,
+        "File:A.jpg",
+        MissingMetadataError("URL."),
+        revision_id=10
+    )
+
+    assert failure.next_attempt is None
+    assert failure.revision_id == 10
+
+
+def test_gives_up_after_max_attempts():
+    failure_queue = make_queue(max_attempts=2)
+
+    failure_queue.add(1, "File:A.jpg")
+    failure = failure_queue.add(1, "File:A.jpg")
+
+    assert failure.error == NO_CID_ERROR
+    assert failure.next_attempt is None
+
+
+def test_due():
+    failure_queue = make_queue(base_delay=timedelta(0))
+    failure_queue.add(1, "File:A.jpg")
+    failure_queue.add(2, "File:B.jpg", MissingMetadataError())
+    failure_queue.add(3, "File:C.jpg")
+    failure_queue.remove(3)
+
+    assert failure_queue.due() == [1]
+
+
+def test_due_batches():
+    failure_queue = make_queue(base_delay=timedelta(0))
+    failure_queue.add(1, "File:A.jpg", batch="batch:a")
+    failure_queue.add(2, "File:B.jpg", batch="batch:b")
+    failure_queue.add(3, "File:C.jpg", batch="batch:a")
+    failure_queue.add(4, "File:D.jpg")
+
+    assert failure_queue.due_batches() == {
+        "batch:a": [1, 3],
+        "batch:b": [2],
+        None: [4]
+    }
+
+
+def test_removals_are_batched():
+    failure_queue = make_queue(remove_batch_size=2)
+    journal = failure_queue._journal
+    for page_id in [1, 2, 3]:
+        failure_queue.add(page_id, f"File:{page_id}.jpg")
+    failure_queue.remove(1)
+
+    assert journal.get_failure(1) is not None
+
+    failure_queue.remove(2)
+
+    assert journal.get_failure(1) is None
+    assert journal.get_failure(2) is None
+
+
+def test_failing_again_cancels_removal():
+    failure_queue = make_queue()
+    failure_queue.add(1, "File:A.jpg")
+    failure_queue.remove(1)
+    failure_queue.add(1, "File:A.jpg")
+    failure_queue.flush()
+
+    assert failure_queue._journal.get_failure(1).attempts == 2
@@ -0,0 +1,158 @@
+import json
+from types import SimpleNamespace
+
+import input_checkpoint
+from input_checkpoint import InputCheckpoint, category_pages
+
+# Category -> (files as (sort key, page ID), subcategories).
+CATEGORY_TREE = {
+    "Category:Root": (
+        [("10", 1), ("20", 2), ("20", 3)],
+        ["Category:Sub", "Category:Root"]
+    ),
+    "Category:Sub": ([("05", 4)], ["Category:Root"])
+}
+
+
+class FakeCategory:
+    def __init__(self, site, title):
+        self.site = site
+        self._title = title
+
+    def title(self):
+        return self._title
+
+    def subcategories(self):
+        return [FakeCategory(self.site, t) for t in CATEGORY_TREE[self._title][1]]
+
+
+def fake_file_members(category, start_sortkey=None):
+    for sortkey, page_id in CATEGORY_TREE[category.title()][0]:
+        if start_sortkey is None or sortkey >= start_sortkey:
+            page = SimpleNamespace(pageid=page_id, title=lambda i=page_id: f"File:{i}")
+            yield page, sortkey
+
+
+def list_category(monkeypatch, position=None, checkpoint=None):
+    monkeypatch.setattr(input_checkpoint, "Category", FakeCategory)
+    monkeypatch.setattr(input_checkpoint, "_file_members", fake_file_members)
+    root = FakeCategory(None, "Category:Root")
+    return category_pages(root, 1, checkpoint=checkpoint, position=position)
+
+
+def test_checkpoint_waits_for_earlier_files():
+    saved = []
+    checkpoint = InputCheckpoint(saved.append, save_interval=0)
+
+    assert checkpoint.add("1", "File:A.jpg") is True
+    assert checkpoint.add("2", None) is False
+    assert checkpoint.add("3", "File:B.jpg") is True
+    checkpoint.done("File:B.jpg")
+
+    assert checkpoint.position is None
+
+    checkpoint.done("File:A.jpg")
+
+    assert checkpoint.position == "3"
+    assert saved == ["3"]
+
+
+def test_checkpoint_drops_file_in_progress():
+    checkpoint = InputCheckpoint(lambda position: None)
+
+    assert checkpoint.add("1", "File:A.jpg") is True
+    assert checkpoint.add("2", "File:A.jpg") is False
+    checkpoint.done("File:A.jpg")
+
+    assert checkpoint.position == "2"
+    assert checkpoint.add("3", "File:A.jpg") is True
+
+
+def test_checkpoint_saves_at_interval():
+    now = [0.0]
+    saved = []
+    checkpoint = InputCheckpoint(saved.append, 10, lambda: now[0])
+
+    checkpoint.add("1")
+    now[0] = 5
+    checkpoint.add("2")
+
+    assert saved == []
+
+    now[0] = 10
+    checkpoint.add("3")
+
+    assert saved == ["3"]
+
+    checkpoint.save()
+
+    assert saved == ["3"]
+
+
+def test_category_pages_saves_sort_key(monkeypatch):
+    saved = []
+    checkpoint = InputCheckpoint(lambda p: saved.append(json.dumps(p)), 0)
+
+    pages = list_category(monkeypatch, checkpoint=checkpoint)
+    for page in pages:
+        checkpoint.done(page.title())
+        if page.pageid == 2:
+            break
+
+    assert json.loads(saved[-1]) == {
+        "categories": [["Category:Root", 0]],
+        "index": 0,
+        "sortkey": "20",
+        "pageid": 2
+    }
+
+
+def test_category_pages_continues_from_sort_key(monkeypatch):
+    position = {
+        "categories": [["Category:Root", 0], ["Category:Sub", 1]],
+        "index": 0,
+        "sortkey": "20",
+        "pageid": 2
+    }
+
+    pages = list_category(monkeypatch, position)
+
+    assert [p.pageid for p in pages] == [3, 4]
+
+
+def test_file_members_are_preloaded_in_chunks(monkeypatch):
+    members = [
+        {"pageid": i, "title": f"File:{i}.jpg", "sortkey": f"{i:02}"}
+        for i in range(5)
+    ]
+    preloaded = []
+
+    def preloadpages(pages, groupsize, content):
+        assert not content
+        preloaded.append([p.title for p in pages])
+        return iter(pages)
+
+    site = SimpleNamespace(preloadpages=preloadpages)
+    monkeypatch.setattr(input_checkpoint, "MEMBER_CHUNK_SIZE", 2)
+    monkeypatch.setattr(
+        input_checkpoint,
+        "ListGenerator",
+        lambda *args, **kwargs: iter(members)
+    )
+    monkeypatch.setattr(
+        input_checkpoint,
+        "FilePage",
+        lambda site, title: SimpleNamespace(title=title)
+    )
+    category = FakeCategory(site, "Category:Root")
+
+    files = list(input_checkpoint._file_members(category))
+
+    assert [(p._pageid, s) for p, s in files] == [
+        (0, "00"), (1, "01"), (2, "02"), (3, "03"), (4, "04")
+    ]
+    assert preloaded == [
+        ["File:0.jpg", "File:1.jpg"],
+        ["File:2.jpg", "File:3.jpg"],
+        ["File:4.jpg"]
+    ]
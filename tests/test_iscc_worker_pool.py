@@ -0,0 +1,82 @@
+import os
+
+import pytest
+from iscc_sdk import IsccMeta
+
+import iscc_worker_pool
+from iscc_worker_pool import IsccResult, IsccWorkerPool, _generate
+
+
+@pytest.fixture
+def iscc_code(monkeypatch):
+    iscc_meta = IsccMeta()
+    iscc_meta.iscc = "ISCC:ABCDEFGHIJ"
+    monkeypatch.setattr("iscc_sdk.code_iscc", lambda a: iscc_meta)
+    monkeypatch.setattr(
+        "thumbnail_generator.ThumbnailGenerator.generate",
+        lambda self: "thumbnail"
+    )
+
+
+def test_generate(iscc_code):
+    result = _generate("/path/file.img", True)
+
+    assert result.iscc == "ISCC:ABCDEFGHIJ"
+    assert result.iscc_time is not None
+    assert result.thumbnail == "thumbnail"
+
+
+def test_generate_only_thumbnail(iscc_code):
+    result = _generate("/path/file.img", False)
+
+    assert result.iscc is None
+    assert result.iscc_time is None
+    assert result.thumbnail == "thumbnail"
+
+
+def test_generate_from_bytes(iscc_code):
+    result = _generate(b"content", True)
+
+    assert result.iscc == "ISCC:ABCDEFGHIJ"
+
+
+def fake_generate(source, with_iscc):
+    # Run in the worker processes, which import it from this module.
+    if source == "broken":
+        raise ValueError("Broken file.")
+
+    return IsccResult(f"ISCC:{source}", None, str(os.getpid()))
+
+
+@pytest.fixture
+def worker_pool(monkeypatch):
+    monkeypatch.setattr(iscc_worker_pool, "_generate", fake_generate)
+    pool = IsccWorkerPool(1, max_tasks_per_worker=2)
+    yield pool
+    pool.close()
+
+
+def test_pool_generate(worker_pool):
+    assert worker_pool.generate("a").iscc == "ISCC:a"
+
+
+def test_pool_generate_batch(worker_pool):
+    results = worker_pool.generate_batch(["a", "b", "c"])
+
+    assert [r.iscc for r in results] == ["ISCC:a", "ISCC:b", "ISCC:c"]
+
+
+def test_pool_generate_error(worker_pool):
+    with pytest.raises(ValueError, match="Broken file."):
+        worker_pool.generate("broken")
+
+    assert worker_pool.generate("a").iscc == "ISCC:a"
+
+
+def test_pool_recycles_workers(worker_pool):
+    pids = [worker_pool.generate(str(i)).thumbnail for i in range(4)]
+
+    assert pids[0] == pids[1]
+    assert pids[2] == pids[3]
+    assert pids[1] != pids[2]
+    assert str(os.getpid()) not in pids
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+from declaration_journal import STAGE_METADATA, create_journal
+from journal_filter import JournalFilter
+
+
+def make_journal():
+    journal = create_journal("sqlite:///:memory:")
+    journal.add_declaration(set(), page_id=1, revision_id=1, cid="cid")
+    journal.add_declaration(set(), page_id=2, revision_id=2)
+    return journal
+
+
+def test_page_ids_drops_declared():
+    journal_filter = JournalFilter(make_journal(), chunk_size=2)
+
+    assert list(journal_filter.page_ids([1, 2, 3, 4])) == [2, 3, 4]
+    assert journal_filter.skipped == 1
+
+
+def test_page_ids_drops_all_in_journal_when_preparing():
+    journal_filter = JournalFilter(make_journal(), prepare=True)
+
+    assert list(journal_filter.page_ids([1, 2, 3])) == [3]
+    assert journal_filter.skipped == 2
+
+
+def test_pages():
+    pages = [SimpleNamespace(pageid=i) for i in [3, 1, 2]]
+    journal_filter = JournalFilter(make_journal(), chunk_size=2)
+    skipped = []
+
+    kept = list(journal_filter.pages(pages, skipped.append))
+
+    assert [p.pageid for p in kept] == [3, 2]
+    assert [p.pageid for p in skipped] == [1]
+
+
+def test_snapshot_keeps_prepared_declarations():
+    journal = create_journal("sqlite:///:memory:")
+    journal.add_prepared_declarations({"prepared"}, [(1, 1), (2, 2), (3, 3)])
+    journal.set_stage(journal.get_page_id_match(2), STAGE_METADATA)
+    journal.update_declaration(journal.get_page_id_match(3), cid="cid")
+    journal_filter = JournalFilter(journal, prepare=True, snapshot=True)
+
+    page_ids = journal_filter.page_ids(journal.get_page_ids("prepared", False))
+
+    assert list(page_ids) == [1]
+    assert journal_filter.skipped == 2
@@ -0,0 +1,80 @@
+from argparse import Namespace
+
+import make_declaration
+from make_declaration import PREPARED, SKIPPED, process_file
+
+
+class FakeFile:
+    snapshotted = False
+
+    def __init__(self, *args):
+        self.calls = []
+        FakeFile.last = self
+
+    def is_in_journal(self):
+        return True
+
+    def is_in_registry(self):
+        return False
+
+    def is_snapshotted(self):
+        return self.snapshotted
+
+    def has_invalid_metadata(self):
+        return True
+
+    def validate_metadata(self):
+        self.calls.append("validate_metadata")
+
+    def update_declaration(self):
+        self.calls.append("update_declaration")
+
+    def collect_metadata(self):
+        self.calls.append("collect_metadata")
+
+
+def snapshot_prepared_file(monkeypatch, snapshotted, validate_first=False):
+    monkeypatch.setattr(make_declaration, "File", FakeFile)
+    monkeypatch.setattr(make_declaration, "MetadataCollector", lambda *a: None)
+    monkeypatch.setattr(FakeFile, "snapshotted", snapshotted)
+    args = Namespace(
+        tag=[],
+        snapshot=True,
+        update=False,
+        validate_first=validate_first,
+        iscc=False
+    )
+    return process_file(None, args, None, None, None, "prepared", prepare=True)
+
+
+def test_snapshot_of_prepared_declaration(monkeypatch):
+    assert snapshot_prepared_file(monkeypatch, False) == PREPARED
+    assert FakeFile.last.calls == ["update_declaration", "collect_metadata"]
+
+
+def test_snapshot_skips_snapshotted_declaration(monkeypatch):
+    assert snapshot_prepared_file(monkeypatch, True) == SKIPPED
+    assert FakeFile.last.calls == []
+
+
+def test_snapshot_does_not_validate(monkeypatch):
+    assert snapshot_prepared_file(monkeypatch, False, True) == PREPARED
+    assert FakeFile.last.calls == ["update_declaration", "collect_metadata"]
+
+
+def test_run_batches_tags_pages_with_their_batch(monkeypatch):
+    runs = []
+
+    def run_pages(pages, run):
+        runs.append((run.batch_name, pages))
+        run.stopped = run.batch_name == "batch:b"
+
+    monkeypatch.setattr(make_declaration, "run_pages", run_pages)
+    run = Namespace(batch_name="", stopped=False)
+
+    make_declaration.run_batches(
+        {"batch:a": [1, 2], "batch:b": [3], "batch:c": [4]},
+        run
+    )
+
+    assert runs == [("batch:a", [1, 2]), ("batch:b", [3])]
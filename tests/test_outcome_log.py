@@ -0,0 +1,56 @@
+import json
+
+from outcome_log import OutcomeLog
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def read(path) -> list[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_writes_in_batches(tmp_path):
+    path = tmp_path / "outcomes.jsonl"
+    outcome_log = OutcomeLog(str(path), batch_size=2, clock=Clock())
+
+    outcome_log.add("File:A.jpg", "DECLARED")
+
+    assert read(path) == []
+
+    outcome_log.add("File:B.jpg", "SKIPPED")
+
+    assert [(r["title"], r["result"]) for r in read(path)] == [
+        ("File:A.jpg", "DECLARED"),
+        ("File:B.jpg", "SKIPPED")
+    ]
+
+
+def test_writes_after_interval(tmp_path):
+    path = tmp_path / "outcomes.jsonl"
+    clock = Clock()
+    outcome_log = OutcomeLog(str(path), sync_interval=5, clock=clock)
+    outcome_log.add("File:A.jpg", "DECLARED")
+
+    clock.now += 5
+    outcome_log.add("File:B.jpg", "FAILED")
+
+    assert len(read(path)) == 2
+
+
+def test_close_writes_rest_and_appends(tmp_path):
+    path = tmp_path / "outcomes.jsonl"
+    path.write_text('{"title": "File:Old.jpg", "result": "DECLARED"}\n')
+    outcome_log = OutcomeLog(str(path), clock=Clock())
+    outcome_log.add("File:A.jpg", "FAILED")
+
+    outcome_log.close()
+    outcome_log.close()
+
+    assert [r["title"] for r in read(path)] == ["File:Old.jpg", "File:A.jpg"]
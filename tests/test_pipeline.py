@@ -0,0 +1,257 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from pipeline import Pipeline, Quota, Stage
+
+
+def test_pipeline_runs_all_stages():
+    def double(item):
+        item["value"] *= 2
+
+    def add_one(item):
+        item["value"] += 1
+        return "DONE"
+
+    pipeline = Pipeline([
+        Stage("double", double, 3),
+        Stage("add", add_one, 2)
+    ])
+    items = [{"value": i} for i in range(20)]
+
+    results = list(pipeline.run(items))
+
+    assert len(results) == 20
+    assert {r.result for r in results} == {"DONE"}
+    assert sorted(r.item["value"] for r in results) == [
+        i * 2 + 1 for i in range(20)
+    ]
+
+
+def test_pipeline_early_result_skips_later_stages():
+    calls = []
+
+    def first(item):
+        if item % 2:
+            return "SKIPPED"
+
+    def second(item):
+        calls.append(item)
+        return "DONE"
+
+    pipeline = Pipeline([Stage("first", first), Stage("second", second)])
+
+    results = {r.item: r.result for r in pipeline.run(range(6))}
+
+    assert results == {
+        0: "DONE", 1: "SKIPPED", 2: "DONE",
+        3: "SKIPPED", 4: "DONE", 5: "SKIPPED"
+    }
+    assert sorted(calls) == [0, 2, 4]
+
+
+def test_pipeline_error():
+    def fail(item):
+        if item == 2:
+            raise ValueError("Bad item")
+        return "DONE"
+
+    pipeline = Pipeline([Stage("fail", fail)])
+
+    results = {r.item: r for r in pipeline.run(range(4))}
+
+    assert results[2].result is None
+    assert isinstance(results[2].error, ValueError)
+    assert results[3].result == "DONE"
+
+
+def test_pipeline_stop():
+    pipeline = Pipeline([Stage("stage", lambda item: "DONE")], queue_size=1)
+    seen = []
+
+    for result in pipeline.run(range(1000)):
+        seen.append(result)
+        if len(seen) == 3:
+            pipeline.stop()
+
+    done = [r for r in seen if r.result == "DONE"]
+    assert len(done) < 1000
+
+
+def test_stages_sharing_lock_are_not_concurrent():
+    lock = threading.Lock()
+    active = []
+    overlaps = []
+
+    def locked(item):
+        active.append(item)
+        if len(active) > 1:
+            overlaps.append(item)
+        active.remove(item)
+
+    pipeline = Pipeline([
+        Stage("first", locked, lock=lock),
+        Stage("second", locked, lock=lock),
+        Stage("last", lambda item: "DONE", 4)
+    ])
+
+    list(pipeline.run(range(50)))
+
+    assert overlaps == []
+
+
+def test_stage_needs_worker():
+    with pytest.raises(ValueError):
+        Stage("stage", lambda item: None, 0)
+
+
+def test_quota():
+    quota = Quota(2)
+
+    assert quota.acquire() is True
+    assert quota.acquire() is True
+    quota.release()
+    assert quota.acquire() is True
+    quota.commit()
+    quota.commit()
+
+    assert quota.acquire() is False
+
+
+def test_quota_reached():
+    quota = Quota(1)
+
+    assert quota.reached() is False
+    quota.acquire()
+    assert quota.reached() is False
+    quota.commit()
+    assert quota.reached() is True
+    assert Quota(None).reached() is False
+
+
+def _commit_all(quota):
+    while quota.acquire():
+        quota.commit()
+
+
+def test_quota_shared_between_processes():
+    context = multiprocessing.get_context("spawn")
+    quota = Quota(5, context)
+    processes = [
+        context.Process(target=_commit_all, args=(quota,)) for _ in range(3)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert quota.reached() is True
+    assert quota.acquire() is False
+
+
+def test_quota_without_limit():
+    quota = Quota(None)
+
+    for _ in range(10):
+        assert quota.acquire() is True
+        quota.commit()
+
+
+def test_pipeline_input_error():
+    def pages():
+        yield 1
+        raise ValueError("Bad input")
+
+    pipeline = Pipeline([Stage("stage", lambda item: "DONE")])
+
+    with pytest.raises(ValueError):
+        list(pipeline.run(pages()))
+
+
+def test_pipeline_stage_returning_future():
+    executor = ThreadPoolExecutor(2)
+
+    def later(item):
+        return executor.submit(lambda: "ODD" if item % 2 else None)
+
+    pipeline = Pipeline([
+        Stage("later", later),
+        Stage("last", lambda item: "EVEN")
+    ])
+
+    results = {r.item: r.result for r in pipeline.run(range(4))}
+    executor.shutdown()
+
+    assert results == {0: "EVEN", 1: "ODD", 2: "EVEN", 3: "ODD"}
+
+
+def test_finishing_future_does_not_block_on_full_queue():
+    release = threading.Event()
+    futures = []
+
+    def submit(item):
+        future = Future()
+        futures.append(future)
+        return future
+
+    def wait(item):
+        release.wait()
+
+    pipeline = Pipeline([
+        Stage("submit", submit, 1),
+        Stage("wait", wait, 1),
+        Stage("done", lambda item: "DONE", 1)
+    ], queue_size=1)
+    results = pipeline.run(range(5))
+    thread = threading.Thread(target=lambda: list(results), daemon=True)
+    thread.start()
+    while len(futures) < 5:
+        time.sleep(0.01)
+
+    # The wait stage and its queue are full, but finishing the futures
+    # returns right away rather than when the wait stage is released.
+    threading.Timer(1, release.set).start()
+    start_time = time.time()
+    for future in futures:
+        future.set_result(None)
+    finish_time = time.time() - start_time
+    thread.join(5)
+
+    assert finish_time < 0.5
+    assert not thread.is_alive()
+
+
+def test_stopped_pipeline_runs_stages_that_are_not_cancellable():
+    futures = []
+    recorded = []
+
+    def request(item):
+        if item == 3:
+            raise ValueError("Request failed.")
+
+        future = Future()
+        futures.append(future)
+        return future
+
+    def record(item):
+        recorded.append(item)
+        return "DONE"
+
+    pipeline = Pipeline([
+        Stage("request", request, 1),
+        Stage("record", record, 1, cancellable=False)
+    ])
+    results = {}
+    for result in pipeline.run(range(4)):
+        results[result.item] = result.result
+        if result.error is not None:
+            # Stopping with the other requests in flight.
+            pipeline.stop()
+            for future in futures:
+                future.set_result(None)
+
+    assert sorted(recorded) == [0, 1, 2]
+    assert results == {0: "DONE", 1: "DONE", 2: "DONE", 3: None}
@@ -0,0 +1,90 @@
+import pytest
+
+from rate_limiter import FileBucket, MemoryBucket, RateLimiter, take_token
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.waits = []
+
+    def __call__(self):
+        return self.now
+
+    def wait(self, seconds):
+        self.waits.append(seconds)
+        self.now += seconds
+
+
+def test_take_token_full_bucket():
+    tokens, updated, wait_time = take_token(None, None, 2, 3, 10.0)
+
+    assert tokens == 2
+    assert updated == 10.0
+    assert wait_time == 0
+
+
+def test_take_token_empty_bucket_borrows():
+    tokens, _, wait_time = take_token(0, 10.0, 2, 3, 10.0)
+
+    assert tokens == -1
+    assert wait_time == 0.5
+
+
+def test_take_token_refills_up_to_burst():
+    tokens, _, wait_time = take_token(0, 10.0, 2, 3, 100.0)
+
+    assert tokens == 2
+    assert wait_time == 0
+
+
+def test_rate_limiter_burst_then_rate():
+    clock = Clock()
+    rate_limiter = RateLimiter(2, 3, clock=clock, wait=clock.wait)
+
+    for _ in range(5):
+        rate_limiter.acquire()
+
+    assert clock.waits == [0.5, 0.5]
+
+
+def test_rate_limiter_no_wait_below_rate():
+    clock = Clock()
+    rate_limiter = RateLimiter(1, 1, clock=clock, wait=clock.wait)
+
+    for _ in range(3):
+        rate_limiter.acquire()
+        clock.now += 2
+
+    assert clock.waits == []
+
+
+def test_rate_limiter_shared_file_bucket(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / "bucket.json")
+    first = RateLimiter(1, 1, FileBucket(path), clock, clock.wait)
+    second = RateLimiter(1, 1, FileBucket(path), clock, clock.wait)
+
+    first.acquire()
+    second.acquire()
+
+    assert clock.waits == [1.0]
+
+
+def test_rate_limiter_memory_bucket_shared():
+    clock = Clock()
+    bucket = MemoryBucket()
+    first = RateLimiter(4, 1, bucket, clock, clock.wait)
+    second = RateLimiter(4, 1, bucket, clock, clock.wait)
+
+    first.acquire()
+    second.acquire()
+
+    assert clock.waits == [0.25]
+
+
+def test_rate_limiter_invalid_arguments():
+    with pytest.raises(ValueError):
+        RateLimiter(0)
+    with pytest.raises(ValueError):
+        RateLimiter(1, 0)
@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+
+from declaration_journal import create_journal
+from run_plan import RunPlan, StageTime, format_duration, get_stage_times
+
+
+def make_page(page_id, exists=True):
+    return SimpleNamespace(pageid=page_id, exists=lambda: exists)
+
+
+def make_journal():
+    journal = create_journal("sqlite:///:memory:")
+    journal.add_declaration(
+        {"tag-1"},
+        page_id=1,
+        revision_id=1,
+        cid="cid",
+        download_time=2.0,
+        iscc_time=4.0
+    )
+    journal.add_declaration({"tag-2"}, page_id=2, revision_id=2, download_time=4.0)
+    return journal
+
+
+def make_plan(**kwargs):
+    stage_times = {
+        "download": StageTime(10, 2.0),
+        "iscc": StageTime(10, 4.0),
+        "request": StageTime(10, 1.0)
+    }
+    return RunPlan(stage_times, **kwargs)
+
+
+def test_add_pages():
+    plan = make_plan()
+    pages = [make_page(i) for i in [1, 2, 3, 4]] + [make_page(0, False)]
+
+    plan.add_pages(pages, make_journal(), chunk_size=2)
+
+    assert (plan.new, plan.update, plan.skip, plan.missing) == (2, 1, 1, 1)
+
+
+def test_add_pages_update():
+    plan = make_plan()
+
+    plan.add_pages([make_page(i) for i in [1, 2, 3]], make_journal(), update=True)
+
+    assert (plan.new, plan.update, plan.skip) == (1, 2, 0)
+
+
+def test_add_pages_prepare():
+    plan = make_plan()
+
+    plan.add_pages([make_page(i) for i in [1, 2, 3]], make_journal(), prepare=True)
+
+    assert (plan.new, plan.update, plan.skip) == (1, 0, 2)
+
+
+def test_get_stage_times():
+    stage_times = get_stage_times(make_journal(), ["download", "iscc"], {"tag-2"})
+
+    assert stage_times == {
+        "download": StageTime(1, 4.0),
+        "iscc": StageTime(1, 4.0, True)
+    }
+
+
+def test_file_time_serial():
+    assert make_plan().file_time() == (7.0, None)
+
+
+def test_file_time_pipeline():
+    plan = make_plan(workers={"download": 4, "iscc": 2, "request": 2})
+
+    assert plan.file_time() == (2.0, "iscc")
+
+
+def test_file_time_pooled():
+    plan = make_plan(
+        workers={"download": 4, "iscc": 2, "request": 1},
+        pooled=True,
+        processes=2
+    )
+
+    assert plan.file_time() == (0.5, None)
+
+
+def test_file_time_request_rate():
+    plan = make_plan(processes=10, request_rate=0.5)
+
+    assert plan.file_time() == (2.0, "request rate")
+
+
+def test_duration_uses_limit():
+    plan = make_plan(new=10, update=5, limit=6)
+
+    assert plan.duration() == 42.0
+
+
+def test_format_duration():
+    assert format_duration(20) == "20 s"
+    assert format_duration(600) == "10 min"
+    assert format_duration(7500) == "2 h 5 min"
+
+
+def test_add_pages_snapshot():
+    journal = make_journal()
+    journal.add_declaration(set(), page_id=3, revision_id=3, stage="metadata")
+    plan = make_plan()
+
+    plan.add_pages(
+        [make_page(i) for i in [1, 2, 3, 4]],
+        journal,
+        prepare=True,
+        snapshot=True
+    )
+
+    assert (plan.new, plan.update, plan.skip) == (1, 1, 2)
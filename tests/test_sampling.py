@@ -0,0 +1,30 @@
+import random
+from collections import Counter
+
+from sampling import reservoir_sample
+
+
+def test_sample_size():
+    sample = reservoir_sample(range(1000), 10, random.Random(1))
+
+    assert len(sample) == 10
+    assert len(set(sample)) == 10
+    assert all(0 <= i < 1000 for i in sample)
+
+
+def test_fewer_items_than_sample_size():
+    assert reservoir_sample(iter([1, 2, 3]), 5) == [1, 2, 3]
+
+
+def test_empty_sample():
+    assert reservoir_sample(range(10), 0) == []
+
+
+def test_sample_is_uniform():
+    rng = random.Random(2)
+    counts = Counter()
+    for _ in range(2000):
+        counts.update(reservoir_sample(range(20), 5, rng))
+
+    # Each item is expected in a quarter of the samples.
+    assert all(400 < counts[i] < 600 for i in range(20))
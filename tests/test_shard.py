@@ -0,0 +1,47 @@
+import pytest
+
+from shard import Shard
+
+
+def test_parse():
+    shard = Shard.parse("2/5")
+
+    assert shard.index == 2
+    assert shard.count == 5
+
+
+@pytest.mark.parametrize("value", ["0/3", "4/3", "1/0", "1", "a/b", "-1/3"])
+def test_parse_invalid(value):
+    with pytest.raises(ValueError):
+        Shard.parse(value)
+
+
+def test_shards_partition_keys():
+    shards = [Shard(i, 3) for i in range(1, 4)]
+
+    for page_id in range(1000):
+        assert sum(s.contains(page_id) for s in shards) == 1
+
+
+def test_shards_are_balanced():
+    shards = [Shard(i, 4) for i in range(1, 5)]
+
+    sizes = [sum(s.contains(page_id) for page_id in range(10000)) for s in shards]
+
+    assert min(sizes) > 2000
+    assert max(sizes) < 3000
+
+
+def test_single_shard_contains_everything():
+    shard = Shard(1, 1)
+
+    assert all(shard.contains(page_id) for page_id in range(100))
+
+
+def test_title_normalised():
+    shard = Shard(1, 7)
+
+    for title in ["File:A b.jpg", "File:C_d.png"]:
+        assert shard.contains(title) == shard.contains(
+            title.replace(" ", "_") + "\n"
+        )
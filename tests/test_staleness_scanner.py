@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+from declaration_journal import create_journal
+from staleness_scanner import StalenessScanner, is_stale
+
+
+class FakeSite:
+    """Answers queries for page versions from a dict"""
+
+    def __init__(self, pages: dict):
+        self.pages = pages
+        self.requests = []
+
+    def simple_request(self, **kwargs):
+        self.requests.append(kwargs["pageids"])
+        pages = {}
+        for page_id in kwargs["pageids"]:
+            if page_id in self.pages:
+                revision_id, sha1 = self.pages[page_id]
+                pages[str(page_id)] = {
+                    "pageid": page_id,
+                    "revisions": [{"revid": revision_id}],
+                    "imageinfo": [{"sha1": sha1}]
+                }
+            else:
+                pages[str(-page_id)] = {"pageid": page_id, "missing": ""}
+        return SimpleNamespace(submit=lambda: {"query": {"pages": pages}})
+
+
+def test_is_stale():
+    assert is_stale(1, "a", 1, "a") is False
+    assert is_stale(1, "a", 2, "a") is True
+    assert is_stale(1, "a", 1, "b") is True
+    assert is_stale(1, None, 1, "b") is False
+
+
+def test_scan():
+    journal = create_journal("sqlite:///:memory:")
+    for page_id in range(1, 6):
+        journal.add_declaration(
+            {"batch:1"},
+            page_id=page_id,
+            revision_id=page_id * 10,
+            image_hash=f"hash{page_id}"
+        )
+    site = FakeSite({
+        1: (10, "hash1"),
+        2: (21, "hash2"),
+        3: (30, "new-hash"),
+        4: (40, "hash4")
+    })
+    scanner = StalenessScanner(journal, site, 2, "stale", "missing")
+
+    result = scanner.scan()
+
+    assert (result.scanned, result.stale, result.missing) == (5, 2, 1)
+    assert site.requests == [[1, 2], [3, 4], [5]]
+    assert sorted(d.page_id for d in journal.get_declarations("stale")) == [2, 3]
+    assert [d.page_id for d in journal.get_declarations("missing")] == [5]
+
+
+def test_scan_tag():
+    journal = create_journal("sqlite:///:memory:")
+    journal.add_declaration({"batch:1"}, page_id=1, revision_id=10)
+    journal.add_declaration({"batch:2"}, page_id=2, revision_id=20)
+    site = FakeSite({1: (11, None), 2: (21, None)})
+    scanner = StalenessScanner(journal, site, 50, "stale", "missing")
+
+    result = scanner.scan("batch:2")
+
+    assert (result.scanned, result.stale) == (1, 1)
+    assert [d.page_id for d in journal.get_declarations("stale")] == [2]
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from declaration_journal import create_journal
+from work_queue import WorkQueue
+
+
+def test_chunks():
+    journal = create_journal("sqlite:///:memory:")
+    work_queue = WorkQueue(journal, "queue-1", owner="worker-1")
+    work_queue.fill("batch:1", range(1, 6), 2)
+
+    page_ids = [chunk.get_page_ids() for chunk in work_queue.chunks()]
+
+    assert page_ids == [[1, 2], [3, 4], [5]]
+    assert work_queue.status() == {"done": 3}
+
+
+def test_chunk_left_leased_when_stopped():
+    journal = create_journal("sqlite:///:memory:")
+    work_queue = WorkQueue(
+        journal,
+        "queue-1",
+        timedelta(minutes=10),
+        owner="worker-1"
+    )
+    work_queue.fill("batch:1", range(1, 6), 2)
+
+    for chunk in work_queue.chunks():
+        break
+
+    assert work_queue.status() == {"leased": 1, "pending": 2}